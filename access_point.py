@@ -1,125 +1,191 @@
-import RPi.GPIO as GPIO
 import time
-import subprocess
 import os
 import signal
 import sys
-import json
-import psutil
-import termios
-import tty  # For keyboard input
-import atexit
-import select  # Add this with other imports
+import threading
+import logging
+
+# Must run before the project imports below so --profile-startup can time them
+import startup_profile
+startup_profile.enable()
+
+from app_logging import setup_logging
+
+import command_runner
+import config_files
+import credential_store
+import network_state
+import virtual_ap
+import watchdog
+import web_host
+import wifi_scan
+import wifi_state
+import wpa_ctrl
+from button import Button, GPIOBackend, SimulatedBackend
+from orchestrator import Step, SystemProbes, run_steps
 
 # Constants and Global Variables
 BUTTON_PIN = 17  # GPIO Pin 17
+BUTTON_DEBOUNCE = 0.05  # Seconds a level must be stable to count
+LONG_PRESS_SECONDS = 5  # Hold this long to tear the access point down
+BUTTON_BACKEND = os.environ.get('BUTTON_BACKEND', 'gpio')  # 'gpio' or 'simulated'
+WEB_PORT = int(os.environ.get('WEB_PORT', 80))  # 0 binds any free port (benchmarks)
+WEB_SERVER = os.environ.get('WEB_SERVER', 'async')  # 'async' or 'threaded'
+AP_MODE = os.environ.get('AP_MODE', 'single')  # 'single' or 'concurrent' (AP on uap0)
 WIFI_INTERFACE = 'wlan0'
 AP_SSID = 'PiConfigWiFi'
 AP_PASSWORD = '12345678'
 AP_IP = '192.168.4.1'
+AP_CONFLICTING_SERVICES = ['wpa_supplicant', 'hostapd', 'dnsmasq', 'dhcpcd']
+RECONNECT_TIMEOUT = 20  # Seconds to join a known network at startup
+WATCHDOG_ENABLED = os.environ.get('WATCHDOG', '1') != '0'
+WATCHDOG_INTERVAL = int(os.environ.get('WATCHDOG_INTERVAL', watchdog.CHECK_INTERVAL))
+WATCHDOG_LOSS_SECONDS = int(os.environ.get('WATCHDOG_LOSS_SECONDS', watchdog.LOSS_SECONDS))
+WATCHDOG_RETRY_SECONDS = int(os.environ.get('WATCHDOG_RETRY_SECONDS', watchdog.RETRY_SECONDS))
+PORTAL_IDLE_SECONDS = 300  # Keep a watchdog-started AP up while phones use the portal
+AP_TEARDOWN_DELAY = 5  # Seconds the portal stays up after a concurrent-mode connect
+
+logger = logging.getLogger('access_point')
+
+# In-process HTTP server hosting the config portal and admin panel
+web_host_server = None
+
+# Readiness checks used by the mode switch step graphs; commands go through
+# the shared command_runner.runner
+system_probes = SystemProbes()
 
-# Global process tracking
-web_server_process = None
+# Serializes access point mode switches between the button, watchdog and
+# portal threads; the mode itself is tracked in wifi_state.machine
+wifi = wifi_state.machine
+ap_lock = threading.Lock()
+
+# Falls back to the access point after sustained connectivity loss
+connectivity_watchdog = None
+
+# virtual_ap.VirtualAP when AP_MODE is 'concurrent' and the driver supports it
+concurrent_ap = None
 
 # Core AP Functions
+def ap_setup_steps():
+    """Step graph for switching wlan0 into access point mode"""
+    if concurrent_ap is not None:
+        return concurrent_ap.setup_steps() + [
+            Step('stop_admin_panel', lambda runner: stop_admin_panel(), required=False),
+            Step('portal_routes', lambda runner: switch_web_mode(web_host.PORTAL),
+                 after=['stop_admin_panel']),
+        ]
+    return [
+        # Stop admin panel first to free up port 80
+        Step('stop_admin_panel', lambda runner: stop_admin_panel(), required=False),
+        Step('rfkill_unblock', ['sudo', 'rfkill', 'unblock', 'wifi']),
+        Step('stop_client_services', ['sudo', 'systemctl', 'stop', *AP_CONFLICTING_SERVICES],
+             ready=('unit_inactive', *AP_CONFLICTING_SERVICES), required=False),
+        Step('hostapd_config', lambda runner: verify_hostapd_config(), required=False),
+        Step('link_up', ['sudo', 'ip', 'link', 'set', WIFI_INTERFACE, 'up'],
+             after=['rfkill_unblock', 'stop_client_services'],
+             ready=('interface_up', WIFI_INTERFACE)),
+        Step('flush_address', ['sudo', 'ip', 'addr', 'flush', 'dev', WIFI_INTERFACE],
+             after=['link_up']),
+        Step('add_address', ['sudo', 'ip', 'addr', 'add', f'{AP_IP}/24', 'dev', WIFI_INTERFACE],
+             after=['flush_address'], ready=('address_assigned', WIFI_INTERFACE, AP_IP)),
+        Step('start_hostapd', ['sudo', 'systemctl', 'start', 'hostapd'],
+             after=['link_up', 'hostapd_config'], ready=('unit_active', 'hostapd')),
+        Step('captive_dns_config', lambda runner: write_captive_dns_config(), required=False),
+        Step('start_dnsmasq_dhcpcd', ['sudo', 'systemctl', 'start', 'dnsmasq', 'dhcpcd'],
+             after=['add_address', 'captive_dns_config'],
+             ready=('unit_active', 'dnsmasq', 'dhcpcd')),
+        Step('portal_routes', lambda runner: switch_web_mode(web_host.PORTAL),
+             after=['stop_admin_panel']),
+    ]
+
+def ap_cleanup_steps():
+    """Step graph for handing wlan0 back to the client network services"""
+    if concurrent_ap is not None:
+        return concurrent_ap.cleanup_steps() + [
+            Step('admin_routes', lambda runner: switch_web_mode(web_host.ADMIN), required=False),
+        ]
+    return [
+        Step('admin_routes', lambda runner: switch_web_mode(web_host.ADMIN), required=False),
+        Step('stop_ap_services', ['sudo', 'systemctl', 'stop', 'hostapd', 'dnsmasq'],
+             ready=('unit_inactive', 'hostapd', 'dnsmasq'), required=False),
+        Step('flush_address', ['sudo', 'ip', 'addr', 'flush', 'dev', WIFI_INTERFACE],
+             after=['stop_ap_services'], required=False),
+        Step('remove_captive_dns', lambda runner: remove_captive_dns_config(),
+             after=['stop_ap_services'], required=False),
+        Step('link_down', ['sudo', 'ip', 'link', 'set', WIFI_INTERFACE, 'down'],
+             after=['flush_address'], ready=('interface_down', WIFI_INTERFACE), required=False),
+        # NetworkManager is absent on dhcpcd systems, so only wpa_supplicant is awaited
+        Step('start_client_services',
+             ['sudo', 'systemctl', 'start', 'NetworkManager', 'wpa_supplicant'],
+             after=['link_down'], ready=('unit_active', 'wpa_supplicant'), required=False),
+        Step('link_up', ['sudo', 'ip', 'link', 'set', WIFI_INTERFACE, 'up'],
+             after=['start_client_services'],
+             ready=('interface_up', WIFI_INTERFACE), required=False),
+        Step('restart_dhcpcd', ['sudo', 'systemctl', 'restart', 'dhcpcd'],
+             after=['link_up'], ready=('unit_active', 'dhcpcd'), required=False),
+        Step('restart_network_services',
+             ['sudo', 'systemctl', 'restart', 'networking', 'NetworkManager'],
+             after=['restart_dhcpcd'], required=False),
+    ]
+
 def setup_access_point():
     """Configure the Raspberry Pi as a WiFi access point"""
     try:
-        # Check for root privileges
-        if os.geteuid() != 0:
+        # Check for root privileges (a simulated runner changes nothing on the system)
+        if os.geteuid() != 0 and not getattr(command_runner.runner, 'simulated', False):
             raise PermissionError("This script must be run as root")
 
-        # Stop admin panel first to free up port 80
-        stop_admin_panel()
-        
-        # Simplified service management
-        print("Configuring access point...")
-        services_to_stop = ['wpa_supplicant', 'hostapd', 'dnsmasq', 'dhcpcd']
-        for service in services_to_stop:
-            subprocess.run(['sudo', 'systemctl', 'stop', service], check=False)
-        time.sleep(2)
-        
-        print("Setting up wireless interface...")
-        subprocess.run(['sudo', 'rfkill', 'unblock', 'wifi'], check=True)
-        subprocess.run(['sudo', 'ip', 'link', 'set', WIFI_INTERFACE, 'up'], check=True)
-        subprocess.run(['sudo', 'ip', 'addr', 'flush', 'dev', WIFI_INTERFACE], check=True)
-        subprocess.run(['sudo', 'ip', 'addr', 'add', f'{AP_IP}/24', 'dev', WIFI_INTERFACE], check=True)
+        logger.info("Configuring access point...")
+        result = run_steps(ap_setup_steps(), command_runner.runner, system_probes)
+        result.log_timings(logger, 'ap_setup')
+        if not result.ok:
+            failed = [name for name, step in result.steps.items()
+                      if step['status'] == 'failed' and step['required']]
+            raise RuntimeError(f"Access point setup failed at: {', '.join(failed)}")
         
-        # Start core services
-        verify_hostapd_config()
-        subprocess.run(['sudo', 'systemctl', 'start', 'hostapd'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'dnsmasq'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'dhcpcd'], check=True)
-        
-        # Start web server
-        stop_web_server()
-        subprocess.Popen(['sudo', 'python3', 'web_config.py'])
-        
-        print("\nAccess point and web server are ready")
-        print("Connect to 'PiConfigWiFi' network and visit http://192.168.4.1")
+        logger.info("Access point and web server are ready")
+        logger.info("Connect to 'PiConfigWiFi' network and visit http://192.168.4.1")
         return True
         
     except Exception as e:
-        print(f"Error in setup_access_point: {str(e)}")
+        logger.error(f"Error in setup_access_point: {str(e)}")
         return False
 
 def cleanup_ap():
     """Restore original network configuration"""
     try:
-        # Stop web server if running
-        global web_server_process
-        if web_server_process:
-            web_server_process.terminate()
-            web_server_process = None
-
-        print("Stopping AP services...")
-        subprocess.run(['sudo', 'systemctl', 'stop', 'hostapd'], check=False)
-        subprocess.run(['sudo', 'systemctl', 'stop', 'dnsmasq'], check=False)
-        
-        print("Resetting network interface...")
-        subprocess.run(['sudo', 'ip', 'addr', 'flush', 'dev', WIFI_INTERFACE], check=False)
-        subprocess.run(['sudo', 'ip', 'link', 'set', WIFI_INTERFACE, 'down'], check=False)
-        time.sleep(2)
-        
-        print("Starting network services...")
-        subprocess.run(['sudo', 'systemctl', 'start', 'NetworkManager'], check=False)
-        subprocess.run(['sudo', 'systemctl', 'start', 'wpa_supplicant'], check=False)
-        time.sleep(2)
-        
-        print("Bringing interface up...")
-        subprocess.run(['sudo', 'ip', 'link', 'set', WIFI_INTERFACE, 'up'], check=False)
-        subprocess.run(['sudo', 'systemctl', 'restart', 'dhcpcd'], check=False)
-        time.sleep(2)
-        
-        print("Final network restart...")
-        subprocess.run(['sudo', 'systemctl', 'restart', 'networking'], check=False)
-        subprocess.run(['sudo', 'systemctl', 'restart', 'NetworkManager'], check=False)
-        
-        print("Cleanup completed")
+        logger.info("Restoring client network configuration...")
+        result = run_steps(ap_cleanup_steps(), command_runner.runner, system_probes)
+        result.log_timings(logger, 'ap_cleanup')
+        logger.info("Cleanup completed")
     except Exception as e:
-        print(f"Cleanup error: {str(e)}")
+        logger.error(f"Cleanup error: {str(e)}")
 
 # Signal and Status Handling
 def signal_handler(signum, frame):
     """Handle cleanup on program termination"""
-    print("\nReceived termination signal. Cleaning up...")
+    logger.info("Received termination signal. Cleaning up...")
     cleanup_ap()
+    wifi.transition(wifi_state.IDLE, 'shutdown')
     sys.exit(0)
 
-def update_status(status):
-    """Write status to shared file"""
-    try:
-        with open('logs/wifi_status.json', 'w') as f:
-            json.dump(status, f)
-    except Exception as e:
-        print(f"Error updating status: {str(e)}")
+def start_access_point(owner, reason):
+    """Bring the AP up and track it (call with ap_lock held)"""
+    wifi.transition(wifi_state.AP_STARTING, reason, ap_owner=owner)
+    if setup_access_point():
+        wifi.transition(wifi_state.AP_READY, reason)
+        return True
+    wifi.transition(wifi_state.IDLE, 'ap_setup_failed')
+    return False
+
+def stop_access_point(reason):
+    """Take the AP down and track it (call with ap_lock held)"""
+    cleanup_ap()
+    wifi.transition(wifi_state.IDLE, reason)
 
 def is_web_server_running():
-    """Check if web server is already running"""
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-        if 'python' in proc.info['name'] and 'web_config.py' in str(proc.info['cmdline']):
-            return True
-    return False
+    """Check if the config portal is being served"""
+    return web_host_server is not None and web_host_server.mode == web_host.PORTAL
 
 def get_keyboard_input():
     """Get a single keyboard character"""
@@ -127,7 +193,7 @@ def get_keyboard_input():
         # Don't use tty.setraw mode, just read normally
         return sys.stdin.read(1).lower()
     except Exception as e:
-        print(f"Error reading keyboard: {str(e)}")
+        logger.error(f"Error reading keyboard: {str(e)}")
         return None
 
 # Register signal handlers
@@ -135,123 +201,376 @@ signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
 # After imports, before main code
-def setup_gpio():
-    """Initialize GPIO settings"""
+def on_button_press(duration):
+    """Short press: start the access point"""
+    with ap_lock:
+        if wifi.ap_running():
+            wifi.update(ap_owner='button')  # Keep it up; the watchdog no longer owns it
+            return
+        logger.info(f"Button pressed ({duration:.2f}s) - starting access point...")
+        start_access_point('button', 'button')
+
+def on_button_long_press():
+    """Long press: tear the access point down"""
+    with ap_lock:
+        if not wifi.ap_running():
+            return
+        logger.info("Button held - stopping access point...")
+        stop_access_point('button')
+
+def button_backend():
+    """GPIO edge events, or for BUTTON_BACKEND=simulated an in-memory pin"""
+    return SimulatedBackend() if BUTTON_BACKEND == 'simulated' else GPIOBackend()
+
+def setup_button():
+    """Initialize the button on GPIO edge events (or a simulated pin)"""
     try:
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        return True
+        backend = button_backend()
+        button = Button(BUTTON_PIN, backend,
+                        on_press=on_button_press,
+                        on_long_press=on_button_long_press,
+                        debounce=BUTTON_DEBOUNCE,
+                        long_press=LONG_PRESS_SECONDS)
+        button.start()
+        return button
     except Exception as e:
-        print(f"Error setting up GPIO: {str(e)}")
-        return False
+        logger.error(f"Error setting up GPIO: {str(e)}")
+        return None
 
 def stop_admin_panel():
     """Stop the admin panel service if it's running"""
     try:
-        print("Checking for running admin panel service...")
+        logger.info("Checking for running admin panel service...")
         if os.path.exists('/etc/systemd/system/pi-admin-panel.service'):
-            print("Stopping admin panel service...")
-            subprocess.run(['sudo', 'systemctl', 'stop', 'pi-admin-panel'], check=True)
-            print("Admin panel service stopped")
+            logger.info("Stopping admin panel service...")
+            command_runner.systemctl('stop', 'pi-admin-panel', check=True)
+            logger.info("Admin panel service stopped")
             return True
     except Exception as e:
-        print(f"Error stopping admin panel service: {str(e)}")
+        logger.error(f"Error stopping admin panel service: {str(e)}")
         return False
 
 def verify_hostapd_config():
     """Verify hostapd configuration file exists and has correct content"""
-    config_path = '/etc/hostapd/hostapd.conf'
+    config_path = config_files.HOSTAPD_CONF
     
-    print(f"\nChecking hostapd configuration at {config_path}")
-    config_content = f"""interface={WIFI_INTERFACE}
-driver=nl80211
-ssid={AP_SSID}
-hw_mode=g
-channel=7
-wmm_enabled=0
-macaddr_acl=0
-auth_algs=1
-ignore_broadcast_ssid=0
-wpa=2
-wpa_passphrase={AP_PASSWORD}
-wpa_key_mgmt=WPA-PSK
-wpa_pairwise=TKIP
-rsn_pairwise=CCMP
-country_code=US
-"""
+    logger.info(f"Checking hostapd configuration at {config_path}")
+    config_content = config_files.render_hostapd_config(WIFI_INTERFACE, AP_SSID, AP_PASSWORD)
     try:
-        if os.path.exists(config_path):
-            print("Configuration file exists, checking content...")
-            with open(config_path, 'r') as f:
-                current_content = f.read()
-            if current_content.strip() != config_content.strip():
-                print("Updating existing configuration...")
-                with open('hostapd.conf', 'w') as f:
-                    f.write(config_content)
-                subprocess.run(['sudo', 'mv', 'hostapd.conf', config_path], check=True)
+        result = config_files.write_config(config_path, config_content, mode=0o600)
+        if result['changed']:
+            logger.info("Configuration file updated")
         else:
-            print("Creating new configuration file...")
-            with open('hostapd.conf', 'w') as f:
-                f.write(config_content)
-            subprocess.run(['sudo', 'mv', 'hostapd.conf', config_path], check=True)
-            
-        subprocess.run(['sudo', 'chmod', '600', config_path], check=True)
-        print("Configuration file verified/updated successfully")
+            logger.info("Configuration file already up to date")
+        return True
+    except Exception as e:
+        logger.error(f"Error managing hostapd configuration: {str(e)}")
+        return False
+
+def reconnect_known_network():
+    """Join the best known network in range, without the access point flow
+
+    Returns True if the interface is connected afterwards.
+    """
+    try:
+        current = network_state.get_current_ssid(WIFI_INTERFACE)
+        if current:
+            logger.info(f"Already connected to {current}")
+            wifi.transition(wifi_state.CLIENT, 'already_connected', expect=wifi_state.IDLE,
+                            ssid=current)
+            return True
+        store = credential_store.known_networks
+        credential_store.import_existing(store)
+        records = store.networks()
+        if not records:
+            logger.info("No known networks; press the button to configure WiFi")
+            return False
+
+        results, _ = wifi_scan.cache.get()
+        choice = credential_store.select_best(records, results)
+        if choice is None:
+            logger.info("No known network in range; press the button to configure WiFi")
+            return False
+        record, bss = choice
+        if not wifi.transition(wifi_state.CONNECTING, 'known_network',
+                               expect=(wifi_state.IDLE, wifi_state.AP_READY),
+                               ssid=record['ssid']):
+            return False
+        logger.info(f"Joining known network {record['ssid']} ({bss['signal_dbm']} dBm)")
+
+        # Reload the re-ranked networks into the running wpa_supplicant
+        store.write_config(results, first=record['ssid'])
+        ctrl = wpa_ctrl.open_when_ready(WIFI_INTERFACE)
+        try:
+            ctrl.request('RECONFIGURE')
+            outcome, event = wpa_ctrl.wait_for_connection(ctrl, record['ssid'],
+                                                          timeout=RECONNECT_TIMEOUT)
+        finally:
+            ctrl.close()
+
+        with ap_lock:
+            if wifi.state != wifi_state.CONNECTING:
+                return False  # The button started the access point meanwhile
+            ap_up = wifi.ap_running()
+            if outcome == wpa_ctrl.CONNECTED:
+                store.record_success(record['ssid'])
+                logger.info(f"Connected to {record['ssid']}")
+                if ap_up:
+                    cleanup_ap()  # Concurrent mode kept the AP up meanwhile
+                wifi.transition(wifi_state.CLIENT, 'known_network')
+                return True
+            store.record_failure(record['ssid'])
+            logger.warning(f"Could not join {record['ssid']}: {outcome}")
+            wifi.transition(wifi_state.AP_READY if ap_up else wifi_state.IDLE, outcome)
+            return False
+    except Exception as e:
+        logger.error(f"Error reconnecting to a known network: {str(e)}")
+        wifi.transition(wifi_state.AP_READY if wifi.ap_running() else wifi_state.IDLE,
+                        'error', expect=wifi_state.CONNECTING)
+        return False
+
+def check_hostapd_config():
+    """Read-only startup check that primes the config hash for the AP switch"""
+    config_content = config_files.render_hostapd_config(WIFI_INTERFACE, AP_SSID, AP_PASSWORD)
+    try:
+        if config_files.is_current(config_files.HOSTAPD_CONF, config_content):
+            logger.info("hostapd configuration is up to date")
+        else:
+            logger.info("hostapd configuration will be rewritten when the access point starts")
+    except Exception as e:
+        logger.error(f"Error checking hostapd configuration: {str(e)}")
+
+def write_captive_dns_config():
+    """Point every DNS name at the portal so phones detect the captive portal"""
+    try:
+        config_files.write_config(config_files.CAPTIVE_DNS_CONF,
+                                  config_files.render_captive_dns_config(WIFI_INTERFACE, AP_IP))
         return True
     except Exception as e:
-        print(f"Error managing hostapd configuration: {str(e)}")
+        logger.error(f"Error writing captive portal DNS config: {str(e)}")
         return False
 
-def stop_web_server():
-    """Stop any running web servers on port 80"""
+def remove_captive_dns_config():
+    """Stop answering every DNS name once the access point is down"""
     try:
-        subprocess.run(['sudo', 'fuser', '-k', '80/tcp'], check=False)
-        time.sleep(2)  # Give time for the server to stop
+        config_files.remove_config(config_files.CAPTIVE_DNS_CONF)
     except Exception as e:
-        print(f"Error stopping web server: {str(e)}")
+        logger.error(f"Error removing captive portal DNS config: {str(e)}")
+
+def free_web_port():
+    """Stop anything left holding the web port before the web host binds it"""
+    if not WEB_PORT or system_probes.port_free(WEB_PORT):
+        return
+    stop_admin_panel()
+    try:
+        command_runner.run(['sudo', 'fuser', '-k', f'{WEB_PORT}/tcp'])
+    except Exception as e:
+        logger.error(f"Error freeing port {WEB_PORT}: {str(e)}")
+    deadline = time.monotonic() + 5
+    while not system_probes.port_free(WEB_PORT) and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+def start_web_host():
+    """Bind the web port once and serve the admin panel until the AP starts"""
+    global web_host_server
+    free_web_port()
+    web_host_server = web_host.WebHost(port=WEB_PORT, mode=web_host.ADMIN, server=WEB_SERVER)
+    web_host_server.start()
+    threading.Thread(target=preload_web_apps, name='web-preload', daemon=True).start()
+
+def preload_web_apps():
+    """Import Flask and both apps off the startup path"""
+    try:
+        with startup_profile.phase('web_app_preload'):
+            web_host_server.preload()
+            import web_config
+            web_config.on_connected = on_client_connected
+            web_config.concurrent_ap = concurrent_ap
+        logger.info("Web apps loaded")
+        startup_profile.report(logger, 'web_apps_loaded')
+    except Exception as e:
+        logger.error(f"Error loading web apps: {str(e)}")
+
+def switch_web_mode(mode):
+    """Swap the route set served on port 80"""
+    if web_host_server is not None:
+        web_host_server.switch(mode)
+
+def on_client_connected():
+    """The portal joined a network: AP services are down, show the admin panel"""
+    if concurrent_ap is not None:
+        # uap0 is still serving the portal; let the phone see the result first
+        time.sleep(AP_TEARDOWN_DELAY)
+    with ap_lock:
+        if concurrent_ap is not None and wifi.ap_running():
+            cleanup_ap()
+        wifi.transition(wifi_state.CLIENT, 'portal')
+    switch_web_mode(web_host.ADMIN)
+
+def on_connectivity_lost():
+    """Watchdog: the network has been gone too long, start the access point"""
+    with ap_lock:
+        if wifi.ap_running():
+            return
+        logger.warning("Connectivity lost - starting access point...")
+        if not start_access_point('watchdog', 'connectivity_lost') and connectivity_watchdog:
+            # on_retry only acts on a running AP; try again after another loss period
+            logger.warning("Access point setup failed - retrying after the next outage period")
+            connectivity_watchdog.rearm()
+
+def known_network_in_range():
+    """Check whether a saved network shows up in a scan (cached, or fresh if stale)"""
+    records = credential_store.known_networks.networks()
+    if not records:
+        return False
+    try:
+        results, _ = wifi_scan.cache.get()
+    except Exception as e:
+        logger.warning(f"Scan failed, using the last results: {str(e)}")
+        results = wifi_scan.cache.peek()
+    return bool(results) and credential_store.select_best(records, results) is not None
+
+def watchdog_ap_ready():
+    """The AP is up and was started by the watchdog (not the button)"""
+    return wifi.state == wifi_state.AP_READY and wifi.info['ap_owner'] == 'watchdog'
+
+def on_connectivity_retry():
+    """Watchdog: try the known networks again from a self-started AP
+
+    In single mode the AP is stopped for the attempt and restarted if it
+    fails, but only when a saved network is in range; in concurrent mode
+    wlan0 is free and the AP stays up meanwhile.
+    """
+    with ap_lock:
+        if not watchdog_ap_ready():
+            return
+        idle = web_host_server.idle_seconds() if web_host_server else None
+        if idle is not None and idle < PORTAL_IDLE_SECONDS:
+            logger.info("Portal in use; not retrying known networks yet")
+            return
+
+    if concurrent_ap is None:
+        # Scanning takes seconds; the AP stays up (and the lock free) meanwhile
+        if not known_network_in_range():
+            logger.info("No known network in range; keeping the access point up")
+            return
+        with ap_lock:
+            if not watchdog_ap_ready():
+                return
+            logger.info("Stopping access point to retry known networks...")
+            stop_access_point('watchdog_retry')
+
+    if reconnect_known_network() or concurrent_ap is not None:
+        return
+    with ap_lock:
+        if wifi.state != wifi_state.IDLE:
+            return
+        logger.info("No known network joined - restarting access point...")
+        start_access_point('watchdog', 'watchdog_retry')
+
+def on_connectivity_restored():
+    """Watchdog: wlan0 came back by itself; drop the watchdog's AP on uap0
+
+    Only concurrent mode can get here with the AP up: in single mode wlan0
+    serves the AP and cannot be online meanwhile.
+    """
+    with ap_lock:
+        if concurrent_ap is None or not watchdog_ap_ready():
+            return
+        logger.info("Connectivity restored - stopping access point...")
+        stop_access_point('connectivity_restored')
+
+def resume_access_point(previous):
+    """Bring the AP back after the daemon died while it was up"""
+    owner = previous.get('info', {}).get('ap_owner') or 'button'
+    with ap_lock:
+        logger.info(f"Access point was {previous.get('state')} before restart - restoring it...")
+        wifi.transition(wifi_state.RECOVERING, 'restart', ap_owner=owner)
+        if setup_access_point():
+            wifi.transition(wifi_state.AP_READY, 'restart')
+        else:
+            wifi.transition(wifi_state.IDLE, 'ap_setup_failed')
+
+def setup_concurrent_ap():
+    """Run the AP on uap0 next to wlan0 if requested and the driver allows it"""
+    global concurrent_ap
+    if AP_MODE != 'concurrent':
+        return
+    if not virtual_ap.detect_support(command_runner.runner):
+        logger.warning("WiFi driver cannot run an AP alongside wlan0; using single mode")
+        return
+    concurrent_ap = virtual_ap.VirtualAP(AP_SSID, AP_PASSWORD, AP_IP,
+                                         command_runner.runner, system_probes,
+                                         station_interface=WIFI_INTERFACE)
+    logger.info(f"Concurrent mode: access point on {concurrent_ap.interface}")
+
+def start_watchdog():
+    """Check connectivity in the background and fall back to the AP when it is lost"""
+    global connectivity_watchdog
+    connectivity_watchdog = watchdog.ConnectivityWatchdog(
+        check=lambda: watchdog.system_check(WIFI_INTERFACE),
+        on_offline=on_connectivity_lost,
+        on_online=on_connectivity_restored,
+        on_retry=on_connectivity_retry,
+        interval=WATCHDOG_INTERVAL,
+        loss_seconds=WATCHDOG_LOSS_SECONDS,
+        retry_seconds=WATCHDOG_RETRY_SECONDS)
+    connectivity_watchdog.start()
 
 # Main Program
 def main():
+    with startup_profile.phase('logging'):
+        setup_logging('access_point')
+    button = None
     try:
         # Setup GPIO first
-        if not setup_gpio():
-            print("Failed to setup GPIO")
+        with startup_profile.phase('gpio_init'):
+            button = setup_button()
+        if not button:
+            logger.error("Failed to setup GPIO")
             sys.exit(1)
+
+        with startup_profile.phase('config_verification'):
+            setup_concurrent_ap()
+            if concurrent_ap is None:
+                check_hostapd_config()
+
+        with startup_profile.phase('server_bind'):
+            start_web_host()
+
+        previous = wifi.restore()
+        wifi.start()
+        if previous and previous.get('ap_running'):
+            # The last run died with the access point up; carry on where it was
+            threading.Thread(target=resume_access_point, args=(previous,),
+                             name='resume-ap', daemon=True).start()
+        else:
+            # Rejoin a remembered network in the background instead of waiting for the AP flow
+            threading.Thread(target=reconnect_known_network, name='reconnect',
+                             daemon=True).start()
+        if WATCHDOG_ENABLED:
+            start_watchdog()
             
-        ap_running = False
-        print("\nWaiting for GPIO button (Pin 17) press to start access point...")
-        
-        # Uncomment the following lines to enable keyboard input
-        # print("Press 'w' to start access point")
-        # print("Press 'q' to quit")
+        logger.info("Waiting for GPIO button (Pin 17) press to start access point...")
+        logger.info(f"Hold the button for {LONG_PRESS_SECONDS} seconds to stop the access point")
+        startup_profile.report(logger, 'waiting_for_button')
         
+        # Button presses are handled on edge callbacks; sleep until a signal
         while True:
-            # Keyboard input handling (commented out for service mode)
-            """
-            if sys.stdin in select.select([sys.stdin], [], [], 0.1)[0]:
-                char = get_keyboard_input()
-                if char == 'w' and not ap_running:
-                    if setup_access_point():
-                        ap_running = True
-                elif char == 'q':
-                    print("\nShutting down...")
-                    cleanup_ap()
-                    break
-            """
-            
-            # Check GPIO button
-            if not GPIO.input(BUTTON_PIN) and not ap_running:
-                print("\nButton pressed - starting access point...")
-                if setup_access_point():
-                    ap_running = True
-            
-            time.sleep(0.1)
+            signal.pause()
             
     except KeyboardInterrupt:
-        print("\nShutting down...")
+        logger.info("Shutting down...")
         cleanup_ap()
+        wifi.transition(wifi_state.IDLE, 'shutdown')
     finally:
-        GPIO.cleanup()
+        if button:
+            button.stop()
+        if connectivity_watchdog:
+            connectivity_watchdog.stop()
+        wifi.stop()
+        if web_host_server:
+            web_host_server.stop()
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -1,56 +1,441 @@
-from flask import Flask, render_template, jsonify
-import subprocess
+from flask import Flask, Response, jsonify, request
+import collections
+import json
+import logging
 import os
+import sys
 import psutil
+import threading
 import time
 
 # Setup paths and app
 ADMIN_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ADMIN_DIR))
+
+import app_logging
+import command_runner
+import connectivity
+import metrics_export
+import metrics_history
+import network_state
+import static_assets
+import wifi_state
+
+logger = logging.getLogger('admin_server')
 app = Flask(__name__, template_folder=os.path.join(ADMIN_DIR, 'templates'))
 
-def get_system_info():
-    """Get current system status"""
-    try:
-        # Basic system metrics
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        
-        # Network information
-        wifi_cmd = subprocess.run(['iwconfig', 'wlan0'], 
-                                capture_output=True, 
-                                text=True)
-        ip_cmd = subprocess.run(['ip', 'addr', 'show', 'wlan0'],
-                              capture_output=True,
-                              text=True)
-        
-        # Internet connectivity check
-        ping_test = subprocess.run(['ping', '-c', '1', '-W', '2', '8.8.8.8'],
-                                 capture_output=True)
-            
-        return {
-            'cpu': psutil.cpu_percent(),
-            'memory': memory.percent,
-            'disk': disk.percent,
-            'wifi': wifi_cmd.stdout if wifi_cmd.returncode == 0 else 'Not available',
-            'ip': ip_cmd.stdout if ip_cmd.returncode == 0 else 'Not available',
-            'internet': ping_test.returncode == 0,
-            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+# Refresh interval in seconds for each group of metrics
+SAMPLE_INTERVALS = {
+    'system': 1,     # psutil cpu/memory/disk, cheap
+    'link': 5,       # sysfs, /proc/net/wireless and netlink reads
+    'internet': 30,  # connectivity probes, cached (see connectivity.py)
+}
+
+# Seconds between SSE keepalive comments when nothing changed
+STREAM_KEEPALIVE = 15
+# Number of recent deltas kept for stream clients that fall behind
+DELTA_HISTORY = 64
+
+# Metrics kept in the ring-buffer history (about 20 KB each, see metrics_history.py)
+HISTORY_METRICS = ('cpu', 'memory', 'disk', 'signal_dbm', 'link_quality', 'internet')
+
+def sample_system():
+    """Get cpu, memory and disk usage"""
+    memory = psutil.virtual_memory()
+    disk = psutil.disk_usage('/')
+    return {
+        'cpu': psutil.cpu_percent(),
+        'memory': memory.percent,
+        'disk': disk.percent
+    }
+
+def sample_link():
+    """Get wireless link and address information"""
+    link = network_state.get_link_info('wlan0')
+    wifi, ip = network_state.format_link_info(link)
+    return {
+        'link': link,
+        'wifi': wifi,
+        'ip': ip
+    }
+
+def sample_internet():
+    """Check internet connectivity"""
+    return {'internet': connectivity.internet_reachable()}
+
+def history_values(values):
+    """Numeric history samples from one metric group's sampled values"""
+    samples = {key: values[key] for key in ('cpu', 'memory', 'disk') if key in values}
+    link = values.get('link')
+    if link:
+        samples['signal_dbm'] = link.get('signal_dbm')
+        samples['link_quality'] = link.get('link_quality')
+    if 'internet' in values:
+        samples['internet'] = 1 if values['internet'] else 0
+    return samples
+
+# Prometheus metrics for /metrics, updated as values change (see metrics_export.py)
+exporter = metrics_export.MetricsExporter()
+exporter.gauge('piap_cpu_usage_percent', "CPU usage in percent")
+exporter.gauge('piap_memory_usage_percent', "Memory usage in percent")
+exporter.gauge('piap_disk_usage_percent', "Root filesystem usage in percent")
+exporter.gauge('piap_wifi_link_up', "Whether wlan0 has carrier")
+exporter.gauge('piap_wifi_signal_dbm', "wlan0 signal level in dBm")
+exporter.gauge('piap_wifi_link_quality', "wlan0 link quality")
+exporter.gauge('piap_wifi_bitrate_bits_per_second', "wlan0 transmit bitrate")
+exporter.gauge('piap_wifi_frequency_hertz', "wlan0 channel frequency")
+exporter.counter('piap_wifi_receive_bytes_total', "Bytes received on wlan0")
+exporter.counter('piap_wifi_transmit_bytes_total', "Bytes transmitted on wlan0")
+exporter.gauge('piap_internet_reachable', "Whether the last connectivity check succeeded")
+exporter.gauge('piap_wifi_state', "Current WiFi mode (1 for the current state)", ('state',))
+exporter.counter('piap_wifi_state_transitions_total', "WiFi mode transitions",
+                 ('from', 'to'))
+exporter.histogram('piap_wifi_state_duration_seconds',
+                   "Time spent in a WiFi mode before leaving it",
+                   (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300), ('state',))
+exporter.histogram('piap_command_duration_seconds', "System command duration",
+                   command_runner.BUCKETS, ('command',))
+exporter.counter('piap_command_failures_total', "System commands that exited non-zero",
+                 ('command',))
+exporter.counter('piap_command_timeouts_total', "System commands killed on timeout",
+                 ('command',))
+
+def export_values(values):
+    """Set the exported gauges from one metric group's sampled values"""
+    samples = {}
+    if 'cpu' in values:
+        samples.update({
+            'piap_cpu_usage_percent': values['cpu'],
+            'piap_memory_usage_percent': values['memory'],
+            'piap_disk_usage_percent': values['disk']
+        })
+    if 'link' in values:
+        link = values['link'] or {}
+        bitrate = link.get('bitrate_mbps')
+        frequency = link.get('frequency_mhz')
+        samples.update({
+            'piap_wifi_link_up': 1 if link.get('carrier') else 0,
+            'piap_wifi_signal_dbm': link.get('signal_dbm'),
+            'piap_wifi_link_quality': link.get('link_quality'),
+            'piap_wifi_bitrate_bits_per_second': bitrate * 1e6 if bitrate is not None else None,
+            'piap_wifi_frequency_hertz': frequency * 1e6 if frequency is not None else None,
+            'piap_wifi_receive_bytes_total': link.get('rx_bytes'),
+            'piap_wifi_transmit_bytes_total': link.get('tx_bytes')
+        })
+    if 'internet' in values:
+        samples['piap_internet_reachable'] = 1 if values['internet'] else 0
+    exporter.update(samples)
+
+def export_transition(record):
+    """wifi_state listener: count the transition and time spent in the old state"""
+    exporter.inc('piap_wifi_state_transitions_total', labels=(record['from'], record['to']))
+    exporter.observe('piap_wifi_state_duration_seconds', record['duration_ms'] / 1000,
+                     labels=(record['from'],))
+
+wifi_state.machine.listeners.append(export_transition)
+
+_exported_commands = {'stats': None, 'version': None}
+
+def export_scrape_state():
+    """Values read at scrape time: the WiFi state and the command stats
+
+    Command stats are only re-exported when the runner recorded something
+    since the last scrape.
+    """
+    status = wifi_state.status()
+    current = status.get('state') if status else None
+    for state in wifi_state.TRANSITIONS:
+        exporter.set('piap_wifi_state', None if current is None else int(state == current),
+                     labels=(state,))
+
+    stats = command_runner.runner.stats
+    if _exported_commands['stats'] is stats and _exported_commands['version'] == stats.version:
+        return
+    _exported_commands.update(stats=stats, version=stats.version)
+    for name, entry in stats.snapshot().items():
+        exporter.set_histogram('piap_command_duration_seconds', entry['buckets'].values(),
+                               entry['total_seconds'], entry['count'], labels=(name,))
+        exporter.set('piap_command_failures_total', entry['failures'], labels=(name,))
+        exporter.set('piap_command_timeouts_total', entry['timeouts'], labels=(name,))
+
+class MetricsSampler:
+    """Keep a shared system snapshot fresh from background threads
+
+    Each metric group is refreshed by its own thread on its own interval,
+    so a slow connectivity check never delays the cheap psutil numbers.
+    Readers get a copy of the latest snapshot without running anything.
+
+    Every refresh that changes a field bumps a version number and records
+    the changed fields once, so any number of stream clients can be fed
+    deltas from this single producer.
+    """
+
+    def __init__(self, intervals=None, history=None, export=False):
+        self.history = history
+        self.export = export
+        self.samplers = {
+            'system': sample_system,
+            'link': sample_link,
+            'internet': sample_internet,
+        }
+        self.intervals = dict(SAMPLE_INTERVALS, **(intervals or {}))
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._deltas = collections.deque(maxlen=DELTA_HISTORY)
+        self._snapshot = {
+            'cpu': 0,
+            'memory': 0,
+            'disk': 0,
+            'wifi': 'Not available',
+            'ip': 'Not available',
+            'link': None,
+            'internet': False
         }
-    except Exception as e:
-        print(f"Error getting system info: {str(e)}")
-        return None
+        self._sampled_at = {}
+        self._updated = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+    def start(self):
+        """Prime the cheap metrics and start one thread per metric group"""
+        with self._lock:
+            if self._threads:
+                return
+            # Each generation of threads gets its own stop event, so threads
+            # from a previous stop(wait=False) can never be revived
+            self._stop = threading.Event()
+            self._threads = [
+                threading.Thread(target=self._run, args=(group, self._stop),
+                                 name=f'sampler-{group}', daemon=True)
+                for group in self.samplers
+            ]
+            threads = list(self._threads)
+        self.refresh('system')
+        for thread in threads:
+            thread.start()
+
+    def stop(self, wait=True):
+        """Stop the sampler threads, optionally waiting for them to exit"""
+        with self._changed:
+            self._stop.set()
+            threads, self._threads = self._threads, []
+            self._changed.notify_all()
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def refresh(self, group):
+        """Sample one metric group now and merge it into the snapshot"""
+        try:
+            values = self.samplers[group]()
+        except Exception as e:
+            logger.error(f"Error sampling {group} metrics: {str(e)}")
+            return
+        now = time.time()
+        if self.history is not None:
+            for metric, value in history_values(values).items():
+                self.history.record(metric, value)
+        if self.export:
+            export_values(values)
+        with self._lock:
+            changed = {key: value for key, value in values.items()
+                       if self._snapshot.get(key) != value}
+            self._sampled_at[group] = now
+            self._updated = now
+            if changed:
+                self._snapshot.update(changed)
+                changed['timestamp'] = self._format_time(now)
+                self._version += 1
+                self._deltas.append((self._version, changed))
+                self._changed.notify_all()
+
+    def _run(self, group, stop):
+        interval = self.intervals[group]
+        while not stop.is_set():
+            started = time.monotonic()
+            self.refresh(group)
+            elapsed = time.monotonic() - started
+            stop.wait(max(0, interval - elapsed))
+
+    @staticmethod
+    def _format_time(timestamp):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+    def _snapshot_locked(self):
+        now = time.time()
+        info = dict(self._snapshot)
+        updated = self._updated or now
+        info['ages'] = {group: round(now - sampled, 3)
+                        for group, sampled in self._sampled_at.items()}
+        # The stalest group bounds how old any field of the snapshot can be
+        info['age'] = max(info['ages'].values(), default=0.0)
+        info['timestamp'] = self._format_time(updated)
+        return info
+
+    def snapshot(self):
+        """Return a copy of the latest snapshot with its age in seconds
+
+        age is the age of the stalest group; ages has one entry per group.
+        """
+        if not self._threads:
+            self.start()
+        with self._lock:
+            return self._snapshot_locked()
+
+    def changes_since(self, version=None, timeout=None):
+        """Wait for fields that changed after the given version
+
+        Returns (version, fields, full) where full is True when fields is a
+        complete snapshot, either because no version was given or because
+        the caller fell further behind than the delta history reaches.
+        Returns None if nothing changed before the timeout or the sampler
+        was stopped; only the initial (version=None) call starts it.
+        """
+        if version is None and not self._threads:
+            self.start()
+        with self._changed:
+            if version is None:
+                return self._version, self._snapshot_locked(), True
+            stop = self._stop
+            self._changed.wait_for(
+                lambda: self._version != version or stop.is_set(), timeout)
+            if self._version == version:
+                return None
+            if not self._deltas or self._deltas[0][0] > version + 1:
+                return self._version, self._snapshot_locked(), True
+            fields = {}
+            for delta_version, changed in self._deltas:
+                if delta_version > version:
+                    fields.update(changed)
+            return self._version, fields, False
+
+history = metrics_history.MetricsHistory(HISTORY_METRICS)
+sampler = MetricsSampler(history=history, export=True)
+
+def get_system_info():
+    """Get current system status from the cached snapshot"""
+    return sampler.snapshot()
 
 @app.route('/api/system-info')
 def system_info():
     """API endpoint for system information"""
-    info = get_system_info()
-    return jsonify(info if info else {'error': 'Failed to get system information'}), 
-           200 if info else 500
+    return jsonify(get_system_info())
+
+@app.route('/api/system-info/stream')
+def system_info_stream():
+    """Server-Sent Events stream of system information changes
+
+    Sends a full snapshot on connect, then only the fields that changed.
+    """
+    def events():
+        version, fields, _ = sampler.changes_since()
+        yield f"event: snapshot\ndata: {json.dumps(fields)}\n\n"
+        while True:
+            change = sampler.changes_since(version, timeout=STREAM_KEEPALIVE)
+            if change is None:
+                if not sampler.running:
+                    return
+                yield ": keepalive\n\n"
+                continue
+            version, fields, full = change
+            event = 'snapshot' if full else 'delta'
+            yield f"event: {event}\ndata: {json.dumps(fields)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/history')
+def metric_history():
+    """Recent values of one metric (?metric=cpu&range=10m)
+
+    Ranges up to 10 minutes come at 1 s resolution as [time, value];
+    longer ones, up to 24 hours, at 1 minute as [time, min, max, avg].
+    History only covers the time the sampler has been running.
+    """
+    metric = request.args.get('metric', 'cpu')
+    if metric not in history.metrics:
+        return jsonify({'success': False, 'error': f"Unknown metric: {metric}",
+                        'metrics': list(history.metrics)}), 400
+    try:
+        seconds = metrics_history.parse_range(request.args.get('range'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid range'}), 400
+    if not sampler.running:
+        sampler.start()
+    return jsonify(dict(history.query(metric, seconds), success=True))
+
+@app.route('/api/wifi-state')
+def wifi_state_status():
+    """Access point / client mode from the daemon's state machine
+
+    Live when hosted inside access_point.py, otherwise read from the
+    persisted logs/wifi_status.json.
+    """
+    status = wifi_state.status()
+    if status is None:
+        return jsonify({'success': False, 'error': 'WiFi state unavailable'}), 404
+    return jsonify(dict(status, success=True))
+
+@app.route('/api/commands')
+def command_stats():
+    """Count, failures, timeouts and duration histogram of each system command
+
+    Covers the commands run by this process since it started (the daemon's
+    when hosted inside access_point.py).
+    """
+    runner = command_runner.runner
+    return jsonify({
+        'success': True,
+        'drop_sudo': runner.drop_sudo,
+        'systemd_dbus': bool(runner.systemd and runner.systemd.connection),
+        'commands': runner.stats.snapshot()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics, or OpenMetrics when the scraper asks for it
+
+    The body is pre-rendered and only rebuilt after a value changed, so
+    scrapes between sampler refreshes are served from cache (gzip and
+    ETag handling as for static assets).
+    """
+    if not sampler.running:
+        sampler.start()
+    export_scrape_state()
+    openmetrics = 'application/openmetrics-text' in request.headers.get('Accept', '')
+    return static_assets.asset_response(exporter.asset(openmetrics))
+
+@app.route('/api/connectivity')
+def connectivity_status():
+    """Latest connectivity check: the target that answered first and its latency
+
+    Served from the shared checker's cache while it is fresh (?fresh=1
+    probes now).
+    """
+    fresh = request.args.get('fresh') == '1'
+    return jsonify(dict(connectivity.checker.check(fresh), success=True))
+
+@app.route('/api/logs')
+def recent_logs():
+    """Recent log records from memory (?limit=100&level=WARNING)"""
+    limit = request.args.get('limit', 100, type=int)
+    level = request.args.get('level')
+    return jsonify({'records': app_logging.ring_buffer.records(limit, level)})
+
+# The page is a static shell that loads its data from /api/system-info
+admin_page = static_assets.render_page(app, 'admin.html')
 
 @app.route('/')
 def admin_panel():
     """Serve the admin panel interface"""
-    return render_template('admin.html', system_info=get_system_info())
+    return static_assets.asset_response(admin_page)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
+    app_logging.setup_logging('admin_server')
+    sampler.start()
+    app.run(host='0.0.0.0', port=80, threaded=True)
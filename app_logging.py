@@ -0,0 +1,149 @@
+"""
+Shared logging setup for the Raspberry Pi WiFi configuration system
+
+setup_logging() routes every log call through a queue so request and
+button threads never wait on the SD card. A single background listener
+thread then writes each record to:
+- logs/<name>.log as one JSON object per line, rotated by size and age
+- an in-memory ring buffer the admin panel serves at /api/logs
+- the console (systemd journal when run as a service)
+
+Extra fields passed with extra={...} (job ids, step names, timings) are
+kept in the JSON records; timed() adds a duration_ms field.
+"""
+
+import atexit
+import collections
+import contextlib
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+LOG_DIR = os.environ.get('LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+MAX_BYTES = 1024 * 1024  # Rotate after 1 MB
+MAX_AGE = 24 * 60 * 60  # ... or after a day
+BACKUP_COUNT = 3
+RING_SIZE = 500  # Records kept in memory for /api/logs
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+def record_fields(record):
+    """Turn a log record into a flat dict with any extra fields"""
+    fields = {
+        'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+        'level': record.levelname,
+        'logger': record.name,
+        'thread': record.threadName,
+        'message': record.getMessage()
+    }
+    for key, value in vars(record).items():
+        if key not in _STANDARD_ATTRS and not key.startswith('_'):
+            fields[key] = value
+    return fields
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects"""
+
+    def format(self, record):
+        return json.dumps(record_fields(record), default=str)
+
+class RingBufferHandler(logging.Handler):
+    """Keep the most recent records in memory"""
+
+    def __init__(self, capacity=RING_SIZE):
+        super().__init__()
+        self.buffer = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.buffer.append(record_fields(record))
+
+    def records(self, limit=100, level=None):
+        """Return up to limit recent records, oldest first, at or above level"""
+        minimum = logging.getLevelName(level.upper()) if level else logging.NOTSET
+        if not isinstance(minimum, int):
+            minimum = logging.NOTSET
+        records = [r for r in list(self.buffer)
+                   if logging.getLevelName(r['level']) >= minimum]
+        return records[-limit:] if limit else records
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """Roll the log over when it exceeds max_bytes or is older than max_age"""
+
+    def __init__(self, filename, max_bytes=MAX_BYTES, max_age=MAX_AGE, backup_count=BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.max_age = max_age
+        self.opened_at = time.time()
+
+    def shouldRollover(self, record):
+        if (self.max_age and time.time() - self.opened_at >= self.max_age and
+                os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+
+ring_buffer = RingBufferHandler()
+
+def setup_logging(name, level=logging.INFO, console=True, console_format=CONSOLE_FORMAT):
+    """Configure queue-based logging for an entry point (first call wins)
+
+    Returns the logger for name; records from every logger in the process
+    end up in logs/<name>.log, the ring buffer and the console.
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is None:
+            handlers = [ring_buffer]
+            try:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                file_handler = RotatingLogFileHandler(os.path.join(LOG_DIR, f'{name}.log'))
+                file_handler.setFormatter(JsonFormatter())
+                handlers.append(file_handler)
+            except OSError as e:
+                print(f"Error opening log file: {str(e)}")
+            if console:
+                console_handler = logging.StreamHandler()
+                console_handler.setFormatter(logging.Formatter(console_format))
+                handlers.append(console_handler)
+
+            log_queue = queue.SimpleQueue()
+            root = logging.getLogger()
+            root.setLevel(level)
+            _queue_handler = logging.handlers.QueueHandler(log_queue)
+            root.addHandler(_queue_handler)
+            _listener = logging.handlers.QueueListener(log_queue, *handlers)
+            _listener.start()
+            atexit.register(shutdown_logging)
+    return logging.getLogger(name)
+
+def shutdown_logging():
+    """Flush queued records to their handlers and stop the listener thread"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _listener.stop()
+            _listener = _queue_handler = None
+
+@contextlib.contextmanager
+def timed(logger, message, level=logging.INFO, **fields):
+    """Log message with a duration_ms field once the block finishes"""
+    started = time.monotonic()
+    try:
+        yield fields
+    finally:
+        fields['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+        logger.log(level, message, extra=fields)
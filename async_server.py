@@ -0,0 +1,500 @@
+"""
+Asyncio HTTP/1.1 server for the WSGI apps (config portal and admin panel)
+
+Every phone that joins PiConfigWiFi fires a burst of connectivity checks,
+and the Flask development server spends a thread on each connection for
+as long as it stays open. Here a single event loop owns all sockets and
+only hands complete requests to small thread pools:
+
+- connections are capped (MAX_CONNECTIONS); extra ones get a 503
+- keep-alive connections are closed after KEEPALIVE_TIMEOUT idle seconds
+- slow clients get HEADER_TIMEOUT to send a request, and a handler that
+  takes longer than HANDLER_TIMEOUT gets a 504
+- known slow paths (network scans) run in their own pool so they can
+  never occupy the workers that answer probes and page loads
+- streamed bodies (the admin panel's server-sent events) are iterated in
+  a separate pool so long-lived streams do not hold request workers
+
+A thread cannot be interrupted, so the 504 only answers the client: the
+handler keeps its worker until it returns. Each pool counts its calls
+until they return, and requests get a 503 instead of queueing when
+timed-out handlers hold every worker of the pool (nothing would run
+before they return) or MAX_QUEUED requests are already waiting. A
+stream needs a free stream worker of its own; with all STREAM_WORKERS
+streaming, new streams get a 503 before any header is sent (the admin
+panel then polls).
+
+The interface mirrors werkzeug's server (serve_forever, shutdown,
+server_close, server_port) so web_host.WebHost can use either one.
+"""
+
+import asyncio
+import http
+import io
+import logging
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+MAX_CONNECTIONS = 64
+MAX_WORKERS = 8  # Threads running ordinary requests
+SLOW_WORKERS = 2  # Threads for SLOW_PATHS
+STREAM_WORKERS = 16  # Threads iterating streamed response bodies
+MAX_QUEUED = 32  # Requests waiting for a busy request or slow pool before 503s
+SLOW_PATHS = ('/scan_networks',)
+HEADER_TIMEOUT = 10  # Seconds to receive a request's headers and body
+KEEPALIVE_TIMEOUT = 15  # Idle seconds before a keep-alive connection is closed
+HANDLER_TIMEOUT = 60  # Seconds an app may take to start its response
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+logger = logging.getLogger('async_server')
+
+_END = object()  # Marks the end of a streamed body
+
+class RequestError(Exception):
+    """Malformed or unacceptable request, answered with status and closed"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def parse_head(data):
+    """Split a request head into (method, target, version, [(name, value)])"""
+    lines = data.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise RequestError(400, "Malformed request line")
+    if not version.startswith('HTTP/1.'):
+        raise RequestError(505, "HTTP version not supported")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise RequestError(400, "Malformed header")
+        headers.append((name.strip(), value.strip()))
+    return method, target, version, headers
+
+def build_environ(method, target, version, headers, body, server_name, server_port, peer):
+    """WSGI environ for one request"""
+    path, _, query = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path, encoding='latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': peer[0] if peer else '',
+        'REMOTE_PORT': str(peer[1]) if peer else '',
+        'REQUEST_URI': target,
+        'RAW_URI': target,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def simple_response(status, message='', keep_alive=False):
+    """Complete plain-text response as bytes"""
+    body = message.encode()
+    phrase = http.HTTPStatus(status).phrase
+    return (f"HTTP/1.1 {status} {phrase}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body
+
+class AsyncWSGIServer:
+    """Serve a WSGI app from one event loop with bounded worker pools"""
+
+    def __init__(self, host, port, app, max_connections=MAX_CONNECTIONS,
+                 max_workers=MAX_WORKERS, slow_workers=SLOW_WORKERS,
+                 stream_workers=STREAM_WORKERS, slow_paths=SLOW_PATHS,
+                 header_timeout=HEADER_TIMEOUT, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                 handler_timeout=HANDLER_TIMEOUT, fast_response=None, max_queued=MAX_QUEUED):
+        self.app = app
+        # fast_response(method, path, host, keep_alive) -> response bytes or None,
+        # answered on the loop without a worker (captive-portal probes)
+        self.fast_response = fast_response
+        self.max_connections = max_connections
+        self.slow_paths = tuple(slow_paths)
+        self.header_timeout = header_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.handler_timeout = handler_timeout
+        self.workers = ThreadPoolExecutor(max_workers, thread_name_prefix='http-worker')
+        self.slow_workers = ThreadPoolExecutor(slow_workers, thread_name_prefix='http-slow')
+        self.stream_workers = ThreadPoolExecutor(stream_workers, thread_name_prefix='http-stream')
+        # Per pool: calls submitted and not yet returned, the timed-out ones
+        # among them, and (threads, most calls allowed)
+        self.busy = {self.workers: 0, self.slow_workers: 0, self.stream_workers: 0}
+        self.stuck = dict.fromkeys(self.busy, 0)
+        self._limits = {self.workers: (max_workers, max_workers + max_queued),
+                        self.slow_workers: (slow_workers, slow_workers + max_queued),
+                        self.stream_workers: (stream_workers, stream_workers)}
+        self._busy_lock = threading.Lock()
+        self.connections = 0
+        self.loop = None
+        self._server = None
+        self._stopped = threading.Event()
+
+        # Bind now so the caller sees address errors and the port is held
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.socket.bind((host, port))
+            self.socket.listen(128)
+        except OSError:
+            self.socket.close()
+            raise
+        self.server_name = host
+        self.server_port = self.socket.getsockname()[1]
+
+    def serve_forever(self):
+        """Run the event loop until shutdown() is called"""
+        self.loop = asyncio.new_event_loop()
+        try:
+            self._server = self.loop.run_until_complete(asyncio.start_server(
+                self._handle_connection, sock=self.socket, limit=MAX_HEADER_BYTES))
+            self.loop.run_forever()
+            # Stop accepting and drop open (idle keep-alive or streaming) connections
+            self._server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self.loop.run_until_complete(asyncio.wait(tasks))
+        finally:
+            self.loop.close()
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stop serve_forever() from another thread and wait for it"""
+        if self.loop is not None and not self._stopped.is_set():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._stopped.wait()
+        for pool in (self.workers, self.slow_workers, self.stream_workers):
+            pool.shutdown(wait=False)
+
+    def server_close(self):
+        self.socket.close()
+
+    async def _handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            writer.write(simple_response(503, "Too many connections"))
+            await self._close(writer)
+            return
+        self.connections += 1
+        peer = writer.get_extra_info('peername')
+        try:
+            timeout = self.header_timeout
+            while True:
+                # A timer that drops the connection is much cheaper than wait_for()
+                timer = self.loop.call_later(timeout, writer.transport.abort)
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.LimitOverrunError:
+                    writer.write(simple_response(431, "Request headers too large"))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                finally:
+                    timer.cancel()
+                try:
+                    keep_alive = await self._handle_request(head, reader, writer, peer)
+                except RequestError as e:
+                    writer.write(simple_response(e.status, str(e)))
+                    break
+                if not keep_alive:
+                    break
+                timeout = self.keepalive_timeout
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled only by shutdown(); finish quietly
+            pass
+        finally:
+            self.connections -= 1
+            await self._close(writer)
+
+    async def _close(self, writer):
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    def _reserve(self, pool):
+        """Claim a place on pool for one call; False if the pool is saturated"""
+        threads, limit = self._limits[pool]
+        with self._busy_lock:
+            if self.busy[pool] >= limit or self.stuck[pool] >= threads:
+                return False
+            self.busy[pool] += 1
+            return True
+
+    def _release(self, pool):
+        with self._busy_lock:
+            self.busy[pool] -= 1
+
+    def _abandon(self, pool, future):
+        """Cancel a timed-out call; if already running, count it stuck until it returns"""
+        if future.cancel():
+            return
+        with self._busy_lock:
+            self.stuck[pool] += 1
+        future.add_done_callback(lambda _: self._unstick(pool))
+
+    def _unstick(self, pool):
+        with self._busy_lock:
+            self.stuck[pool] -= 1
+
+    def _submit(self, pool, function, *args):
+        """Run function on pool for a reserved place, freed once function returns
+
+        Cancelling the returned future only drops a call that has not
+        started; a running one keeps its place until it returns.
+        """
+        try:
+            future = pool.submit(function, *args)
+        except RuntimeError:
+            self._release(pool)  # Pool shut down
+            raise
+        future.add_done_callback(lambda _: self._release(pool))
+        return future
+
+    async def _handle_request(self, head, reader, writer, peer):
+        """Read the body, run the app off the loop and write the response"""
+        method, target, version, headers = parse_head(head[:-4])
+        fields = {name.lower(): value for name, value in headers}
+        if 'chunked' in fields.get('transfer-encoding', '').lower():
+            raise RequestError(411, "Chunked request bodies are not supported")
+        try:
+            length = int(fields.get('content-length', 0))
+        except ValueError:
+            raise RequestError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, "Request body too large")
+        body = b''
+        if length:
+            timer = self.loop.call_later(self.header_timeout, writer.transport.abort)
+            try:
+                body = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                raise RequestError(400, "Incomplete request body")
+            finally:
+                timer.cancel()
+
+        connection = fields.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        if self.fast_response is not None:
+            data = self.fast_response(method, target.partition('?')[0],
+                                      fields.get('host'), keep_alive)
+            if data is not None:
+                writer.write(data)
+                await writer.drain()
+                return keep_alive
+
+        environ = build_environ(method, target, version, headers, body,
+                                self.server_name, self.server_port, peer)
+        path = environ['PATH_INFO']
+        pool = self.slow_workers if path.startswith(self.slow_paths) else self.workers
+        if not self._reserve(pool):
+            logger.warning(f"All workers busy, refusing {method} {path}")
+            writer.write(simple_response(503, "Server busy"))
+            return False
+        call = self._submit(pool, self._run_app, environ)
+        future = asyncio.wrap_future(call, loop=self.loop)
+        timed_out = []
+
+        def expire():
+            timed_out.append(True)
+            self._abandon(pool, call)
+            future.cancel()
+
+        timer = self.loop.call_later(self.handler_timeout, expire)
+        try:
+            status, response_headers, body_parts, iterator = await future
+        except asyncio.CancelledError:
+            if not timed_out:
+                raise
+            logger.error(f"Handler for {method} {path} timed out")
+            writer.write(simple_response(504, "Request timed out"))
+            return False
+        except Exception as e:
+            logger.error(f"Error handling {method} {path}: {str(e)}")
+            writer.write(simple_response(500, "Internal server error"))
+            return False
+        finally:
+            timer.cancel()
+
+        if iterator is not None and not self._reserve(self.stream_workers):
+            # Refuse before the headers: EventSource gives up on a 503
+            logger.warning(f"All stream workers busy, refusing {method} {path}")
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            writer.write(simple_response(503, "Too many streams"))
+            return False
+
+        names = {name.lower() for name, _ in response_headers}
+        chunked = iterator is not None and 'content-length' not in names
+        if chunked and version != 'HTTP/1.1':
+            keep_alive = False
+            chunked = False
+        lines = [f"HTTP/1.1 {status}"]
+        lines += [f"{name}: {value}" for name, value in response_headers
+                  if name.lower() != 'connection']
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        # One write per response: separate small sends stall on delayed ACKs
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        writer.write(b''.join([head, *body_parts]))
+        logger.debug(f"{method} {path} {status.split(' ', 1)[0]}",
+                     extra={'remote': environ['REMOTE_ADDR']})
+
+        if iterator is None:
+            await writer.drain()
+            return keep_alive
+        return await self._stream(iterator, writer, chunked) and keep_alive
+
+    async def _stream(self, iterator, writer, chunked):
+        """Write a streamed body chunk by chunk; False if the client went away
+
+        One stream worker (reserved by the caller) iterates and finally
+        closes the body, handing chunks to the loop, so the generator never
+        runs on two threads.
+        """
+        chunks = asyncio.Queue()
+        stop = threading.Event()
+        loop = self.loop
+
+        def put(chunk):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            except RuntimeError:
+                stop.set()  # Loop already closed during shutdown
+
+        def pump():
+            try:
+                for chunk in iterator:
+                    if stop.is_set():
+                        break
+                    put(chunk)
+            except Exception as e:
+                logger.error(f"Error streaming response: {str(e)}")
+            finally:
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+                put(_END)
+
+        self._submit(self.stream_workers, pump)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is _END:
+                    break
+                if not chunk:
+                    continue
+                if chunked:
+                    writer.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                else:
+                    writer.write(chunk)
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            return True
+        except (ConnectionError, OSError):
+            return False
+        finally:
+            stop.set()
+
+    def _run_app(self, environ):
+        """Call the app in a worker thread
+
+        Returns (status, headers, body_parts, iterator). Bodies with a
+        Content-Length are read completely here and iterator is None;
+        anything else is streamed by the event loop.
+        """
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = status
+            response['headers'] = headers
+            return written.append
+
+        result = self.app(environ, start_response)
+        iterator = iter(result)
+        first = None
+        if 'status' not in response:
+            # start_response may be deferred until the first chunk
+            first = next(iterator, b'')
+        headers = response['headers']
+        if first is not None:
+            written.append(first)
+        if any(name.lower() == 'content-length' for name, _ in headers):
+            try:
+                written.extend(iterator)
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    close()
+            return response['status'], headers, written, None
+        if not hasattr(iterator, 'close') and hasattr(result, 'close'):
+            iterator = _ClosingIterator(iterator, result.close)
+        return response['status'], headers, written, iterator
+
+class _ClosingIterator:
+    """Iterator whose close() closes the original WSGI result"""
+
+    def __init__(self, iterator, close):
+        self.iterator = iterator
+        self.close = close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+def make_server(host, port, app, **options):
+    """Bind and return an AsyncWSGIServer (same call shape as werkzeug's)"""
+    return AsyncWSGIServer(host, port, app, **options)
+
+def serve(app, host='0.0.0.0', port=80, **options):
+    """Serve app in the current thread until interrupted"""
+    server = make_server(host, port, app, **options)
+    logger.info(f"Serving on http://{host}:{server.server_port} (asyncio)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,87 @@
+"""
+Off-device run of the concurrent AP + station connect flow
+
+Builds a virtual_ap.VirtualAP on fakes.FakeCommandRunner, FakeProbes and
+FakeStation, brings the AP up, and runs connect attempts: success, wrong
+password, no internet, and a target network on another channel. Config
+files go to a temporary directory. For each scenario it prints the job
+states, the elapsed time, and whether hostapd or dnsmasq were stopped
+(which would drop the portal). Exits non-zero if an expectation fails.
+
+Usage:
+    python3 benchmarks/concurrent_ap_simulation.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import config_files
+import virtual_ap
+import wpa_ctrl
+from fakes import FakeCommandRunner, FakeProbes, FakeStation
+from orchestrator import run_steps
+
+# Rough Pi 3 command latencies in seconds
+LATENCIES = {
+    ('sudo', 'systemctl', 'restart', 'hostapd'): 0.3,
+    ('sudo', 'systemctl', 'restart', 'dnsmasq'): 0.1,
+    ('sudo', 'systemctl', 'stop'): 0.1,
+    ('sudo', 'ip'): 0.01,
+}
+
+# name, FakeStation options, target channel, expected outcome, AP restarted for a channel move
+SCENARIOS = [
+    ('success', {'join_delay': 0.3}, 7, wpa_ctrl.CONNECTED, False),
+    ('wrong password', {'outcome': wpa_ctrl.WRONG_PASSWORD, 'join_delay': 0.2}, 7,
+     wpa_ctrl.WRONG_PASSWORD, False),
+    ('no internet', {'join_delay': 0.2, 'internet_after': None}, 7, wpa_ctrl.TIMEOUT, False),
+    ('other channel', {'join_delay': 0.3, 'internet_after': 2}, 11, wpa_ctrl.CONNECTED, True),
+]
+
+def portal_dropped(runner, since):
+    """Commands after since that stop the AP services"""
+    return [args for at, args in runner.calls
+            if at >= since and args[:3] == ['sudo', 'systemctl', 'stop']]
+
+def run_scenario(options, channel, timeout):
+    runner = FakeCommandRunner(LATENCIES)
+    ap = virtual_ap.VirtualAP('PiConfigWiFi', '12345678', '192.168.4.1', runner, FakeProbes(),
+                              station=FakeStation(**options), check_interval=0.05)
+    setup = run_steps(ap.setup_steps(), runner, ap.probes)
+    states = []
+    started = time.monotonic()
+    outcome = ap.connect('Home', timeout, channel, on_state=states.append)
+    elapsed = time.monotonic() - started
+    restarted = any(args[-1] == 'hostapd' and at >= started for at, args in runner.calls)
+    return {
+        'setup': setup,
+        'outcome': outcome,
+        'states': states,
+        'elapsed': elapsed,
+        'restarted': restarted,
+        'dropped': portal_dropped(runner, started)
+    }
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        config_files.HOSTAPD_CONF = os.path.join(directory, 'hostapd.conf')
+        config_files.CAPTIVE_DNS_CONF = os.path.join(directory, 'captive-portal.conf')
+        print(f"{'scenario':<16}{'setup s':>9}{'connect s':>11}  {'outcome':<16}states")
+        for name, options, channel, expected, move in SCENARIOS:
+            result = run_scenario(options, channel, timeout=1.0)
+            ok = (result['setup'].ok and result['outcome'] == expected
+                  and result['restarted'] == move and not result['dropped'])
+            failures += not ok
+            print(f"{name:<16}{result['setup'].duration:>9.2f}{result['elapsed']:>11.2f}  "
+                  f"{result['outcome']:<16}{' > '.join(result['states'])}"
+                  f"{'' if ok else '  FAIL'}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
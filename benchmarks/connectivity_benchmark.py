@@ -0,0 +1,129 @@
+"""
+Connectivity probes against local stand-in servers
+
+Starts fakes.StandInServers on 127.0.0.1 and measures:
+
+- online: each probe type alone and all of them at once (the first
+  success wins), next to the old `ping -c 1 -W 2` fork when ping is
+  installed
+- ICMP unanswered: an ICMP target on TEST-NET-3 next to a working TCP
+  one; a network that drops ICMP used to fail the ping check outright
+- captive portal: the HTTP stand-in answers 200 instead of 204
+- offline: the DNS stand-in drops queries and TCP is refused; a caller
+  polls the cached checker every --poll-interval seconds and the script
+  counts how many probe runs the backoff let through
+
+Exits non-zero if an outcome is wrong.
+
+Usage:
+    python3 benchmarks/connectivity_benchmark.py
+    python3 benchmarks/connectivity_benchmark.py --runs 500 --offline-seconds 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import command_runner
+import connectivity
+import fakes
+
+def timed(function, repeat):
+    samples, results = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results.append(function())
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples, results
+
+def report(name, samples, note=''):
+    ordered = sorted(samples)
+    print(f"{name:<32}{statistics.median(ordered):>10.3f}"
+          f"{ordered[int(0.95 * (len(ordered) - 1))]:>10.3f}  {note}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Connectivity probe benchmark")
+    parser.add_argument('--runs', type=int, default=200, help="probe runs per sample")
+    parser.add_argument('--timeout', type=float, default=0.5, help="probe timeout in seconds")
+    parser.add_argument('--offline-seconds', type=float, default=10)
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    servers = fakes.StandInServers().start()
+    failures = []
+
+    def probe(specs):
+        return connectivity.run_probes(connectivity.parse_targets(specs), args.timeout,
+                                       servers.resolver)
+
+    def expect(name, results, online, winner=None):
+        for result in results:
+            if result['online'] != online or (winner and not
+                                              (result['target'] or '').startswith(winner)):
+                failures.append(f"{name}: {result}")
+                return
+
+    try:
+        print(f"{'':<32}{'p50 ms':>10}{'p95 ms':>10}")
+        ping = command_runner.run(['ping', '-c', '1', '-W', '2', '127.0.0.1'])
+        if ping.returncode == 0:
+            report('ping -c 1 (fork)', timed(lambda: command_runner.run(
+                ['ping', '-c', '1', '-W', '2', '127.0.0.1']), args.runs)[0])
+        else:
+            print(f"{'ping -c 1 (fork)':<32}{'n/a':>10}{'n/a':>10}  ping unavailable")
+        for kind in ('icmp', 'tcp', 'dns', 'http'):
+            samples, results = timed(lambda: probe(servers.targets((kind,))), args.runs)
+            report(f'{kind} probe', samples)
+            expect(kind, results, True, kind)
+        samples, results = timed(lambda: probe(servers.targets()), args.runs)
+        winners = sorted({result['target'].split(':')[0] for result in results})
+        report('all probes at once', samples, f"first success: {', '.join(winners)}")
+        expect('all', results, True)
+
+        # TEST-NET-3 address: nothing should answer the echo request
+        blocked = ['icmp://203.0.113.1'] + servers.targets(('tcp',))
+        samples, results = timed(lambda: probe(blocked), args.runs)
+        report('ICMP unanswered, TCP open', samples)
+        expect('icmp unanswered', results, True)
+
+        servers.http_status = 200
+        samples, results = timed(lambda: probe(servers.targets(('http',))), args.runs)
+        report('captive portal (HTTP 200)', samples, results[0]['probes'][0]['error'])
+        expect('captive portal', results, False)
+        servers.http_status = 204
+
+        servers.dns_drop = True
+        offline = servers.targets(('dns', 'http')) + ['tcp://127.0.0.1:1']
+        checker = connectivity.ConnectivityChecker(offline, timeout=args.timeout,
+                                                   resolver=servers.resolver)
+        calls, waits = 0, []
+        ended = time.monotonic() + args.offline_seconds
+        while time.monotonic() < ended:
+            waited, results = timed(checker.check, 1)
+            waits += waited
+            calls += 1
+            expect('offline', results, False)
+            time.sleep(args.poll_interval)
+        report('offline, cached checker', waits,
+               f"{checker.runs} probe runs for {calls} calls in {args.offline_seconds:g}s")
+        if checker.runs >= calls / 2:
+            failures.append(f"offline: backoff let {checker.runs} of {calls} calls probe")
+
+        servers.dns_drop = False
+        result = checker.check(fresh=True)
+        expect('recovered', [result], True)
+    finally:
+        servers.stop()
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
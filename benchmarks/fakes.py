@@ -0,0 +1,412 @@
+"""
+Fakes and stand-ins for running the daemon and web apps off-device
+
+Used by the simulations and benchmarks in this directory and by tests/;
+nothing on the daemon's import path loads this module.
+
+- FakeBackend, FakeCommandRunner: pretend to run commands (command_runner)
+- MockSystemd: systemd's D-Bus API on a private socket (systemd_dbus)
+- FakeProbes: readiness probes that pass after a delay (orchestrator)
+- FakeStation: scripted station side of virtual_ap.VirtualAP
+- FakeProbe: scripted connectivity.run_probes() replacement
+- StandInServers: local TCP, DNS and HTTP servers for connectivity probes
+"""
+
+import http.server
+import itertools
+import os
+import random
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+import connectivity
+import systemd_dbus
+import wpa_ctrl
+from command_runner import CommandRunner, match_prefix
+from systemd_dbus import (BUS_NAME, ERROR, MANAGER, MANAGER_PATH, METHOD_RETURN,
+                          NO_REPLY_EXPECTED, NO_SUCH_UNIT, PROPERTIES, SIGNAL, SYSTEMD,
+                          UNKNOWN_METHOD, encode_message, read_message, unit_name, unit_path)
+
+class FakeBackend:
+    """Pretend to run commands
+
+    latencies maps a command prefix (tuple) to the seconds a matching
+    command should take; failures is a set of prefixes that exit with 1.
+    The longest matching prefix wins. For simulations, failure_rates maps
+    prefixes to the probability of exiting with 1, outputs maps prefixes
+    to the stdout to return, and jitter spreads each latency by up to
+    that fraction either way (random with the given seed). A latency
+    longer than the timeout ends in subprocess.TimeoutExpired, as a hung
+    command would.
+    """
+
+    def __init__(self, latencies=None, failures=(), failure_rates=None, outputs=None,
+                 jitter=0.0, seed=None):
+        self.latencies = latencies or {}
+        self.failures = set(failures)
+        self.failure_rates = failure_rates or {}
+        self.outputs = outputs or {}
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def execute(self, args, timeout, input=None, capture=True):
+        with self._lock:
+            spread = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            rate = self.failure_rates.get(match_prefix(args, self.failure_rates), 0)
+            failed = rate > 0 and self.random.random() < rate
+        prefix = match_prefix(args, self.latencies)
+        latency = max(0.0, self.latencies[prefix] * (1 + spread)) if prefix else 0.0
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise subprocess.TimeoutExpired(args, timeout)
+        time.sleep(latency)
+        returncode = 1 if failed or match_prefix(args, self.failures) else 0
+        stdout = self.outputs.get(match_prefix(args, self.outputs), '')
+        return subprocess.CompletedProcess(args, returncode, stdout, '')
+
+class FakeCommandRunner(CommandRunner):
+    """Record commands instead of running them (options as in FakeBackend)
+
+    Commands are recorded as given, sudo included, in calls as
+    (monotonic end time, args).
+    """
+
+    simulated = True  # Commands have no effect, so they need no root
+
+    def __init__(self, latencies=None, failures=(), failure_rates=None, outputs=None,
+                 jitter=0.0, seed=None, timeouts=None):
+        super().__init__(FakeBackend(latencies, failures, failure_rates, outputs, jitter, seed),
+                         drop_sudo=False, timeouts=timeouts)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def run(self, args, check=False, timeout=None, input=None, capture=True):
+        try:
+            return super().run(args, check=check, timeout=timeout, input=input, capture=capture)
+        finally:
+            with self._lock:
+                self.calls.append((time.monotonic(), list(args)))
+
+class MockSystemd:
+    """systemd's D-Bus API on a private socket, for running SystemdClient off-device
+
+    units maps unit names to options: 'active' (initial state),
+    'latency' (seconds each job takes) and 'result' (the job result,
+    'done' by default). Units not listed answer NoSuchUnit. Every method
+    call is recorded in calls as (member, body).
+    """
+
+    def __init__(self, units=None, latency=0.0, reload_latency=0.0):
+        self.directory = tempfile.mkdtemp(prefix='mock-systemd-')
+        self.path = os.path.join(self.directory, 'bus')
+        self.units = {unit_name(name): dict({'active': False, 'latency': latency,
+                                             'result': 'done'}, **(options or {}))
+                      for name, options in (units or {}).items()}
+        self.paths = {unit_path(name): name for name in self.units}
+        self.reload_latency = reload_latency
+        self.calls = []
+        self._lock = threading.Lock()
+        self._serials = itertools.count(1)
+        self._job_ids = itertools.count(1)
+        self._clients = []
+        self._server = None
+
+    @property
+    def address(self):
+        return f'unix:path={self.path}'
+
+    def start(self):
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(8)
+        threading.Thread(target=self._accept, name='mock-systemd', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.close()
+        try:
+            os.unlink(self.path)
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+    def is_active(self, unit):
+        return self.units[unit_name(unit)]['active']
+
+    def _accept(self):
+        while self._server is not None:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _send(self, client, data):
+        with self._lock:
+            try:
+                client.sendall(data)
+            except OSError:
+                pass
+
+    def _serve(self, client):
+        stream = systemd_dbus._Stream(client)
+        try:
+            stream.read_exact(1)
+            while True:
+                line = stream.read_line()
+                if line.startswith('AUTH'):
+                    client.sendall(b'OK 6d6f636b73797374656d64\r\n')
+                elif line == 'BEGIN':
+                    break
+                else:
+                    client.sendall(b'ERROR\r\n')
+            while True:
+                self._handle(client, read_message(stream))
+        except (OSError, EOFError, ValueError, struct.error):
+            client.close()
+
+    def _reply(self, client, message, signature='', body=()):
+        self._send(client, encode_message(METHOD_RETURN, next(self._serials), signature, body,
+                                          flags=NO_REPLY_EXPECTED, sender=SYSTEMD,
+                                          reply_serial=message['serial']))
+
+    def _error(self, client, message, name, text):
+        self._send(client, encode_message(ERROR, next(self._serials), 's', [text],
+                                          flags=NO_REPLY_EXPECTED, sender=SYSTEMD,
+                                          error_name=name, reply_serial=message['serial']))
+
+    def _handle(self, client, message):
+        member, body = message.get('member'), message['body']
+        self.calls.append((member, body))
+        if message.get('interface') == BUS_NAME:
+            if member == 'Hello':
+                return self._reply(client, message, 's', [f':1.{len(self._clients)}'])
+            return self._reply(client, message)
+        if message.get('interface') == PROPERTIES and message.get('path') in self.paths:
+            state = 'active' if self.units[self.paths[message['path']]]['active'] else 'inactive'
+            return self._reply(client, message, 'v', [('s', state)])
+        if member in ('StartUnit', 'StopUnit', 'RestartUnit'):
+            unit = body[0]
+            if unit not in self.units:
+                return self._error(client, message, NO_SUCH_UNIT, f"Unit {unit} not found.")
+            job_id = next(self._job_ids)
+            job = f'{MANAGER_PATH}/job/{job_id}'
+            self._reply(client, message, 'o', [job])
+            threading.Thread(target=self._run_job, args=(job_id, job, unit, member),
+                             daemon=True).start()
+        elif member == 'GetUnit':
+            if body[0] not in self.units:
+                return self._error(client, message, NO_SUCH_UNIT,
+                                   f"Unit {body[0]} not loaded.")
+            self._reply(client, message, 'o', [unit_path(body[0])])
+        elif member == 'EnableUnitFiles':
+            self._reply(client, message, 'ba(sss)', [False, []])
+        elif member in ('DisableUnitFiles', 'UnmaskUnitFiles'):
+            self._reply(client, message, 'a(sss)', [[]])
+        elif member == 'Reload':
+            time.sleep(self.reload_latency)
+            self._reply(client, message)
+        elif member == 'Subscribe':
+            self._reply(client, message)
+        else:
+            self._error(client, message, UNKNOWN_METHOD, f"Unknown method {member}")
+
+    def _run_job(self, job_id, job, unit, member):
+        options = self.units[unit]
+        time.sleep(options['latency'])
+        result = options['result']
+        if result == 'done':
+            options['active'] = member != 'StopUnit'
+        signal = encode_message(SIGNAL, next(self._serials), 'uoss', [job_id, job, unit, result],
+                                flags=NO_REPLY_EXPECTED, path=MANAGER_PATH, interface=MANAGER,
+                                member='JobRemoved', sender=SYSTEMD)
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            self._send(client, signal)
+
+class FakeProbes:
+    """Probes that pass after an optional per-probe delay"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self._first_seen = {}
+
+    def __getattr__(self, name):
+        def probe(*args):
+            first = self._first_seen.setdefault((name,) + args, time.monotonic())
+            return time.monotonic() - first >= self.delays.get(name, 0)
+        return probe
+
+class FakeStation:
+    """Scripted station for running the connect flow off-device
+
+    outcome is what join() returns after join_delay seconds; internet_after
+    is how many internet checks fail before one succeeds (None: never).
+    """
+
+    def __init__(self, outcome=wpa_ctrl.CONNECTED, join_delay=0.0, internet_after=0,
+                 channel=None):
+        self.outcome = outcome
+        self.join_delay = join_delay
+        self.internet_after = internet_after
+        self.current_channel = channel
+        self.calls = []
+
+    def channel(self):
+        return self.current_channel
+
+    def join(self, ssid, timeout):
+        self.calls.append(('join', ssid))
+        time.sleep(min(self.join_delay, timeout))
+        return self.outcome if self.join_delay <= timeout else wpa_ctrl.TIMEOUT
+
+    def reload(self):
+        self.calls.append(('reload',))
+
+    def internet_reachable(self):
+        self.calls.append(('internet',))
+        if self.internet_after is None:
+            return False
+        self.internet_after -= 1
+        return self.internet_after < 0
+
+class FakeProbe:
+    """Scripted run_probes() replacement for simulations
+
+    Each run takes latency seconds (spread by up to jitter either way) and
+    fails with probability failure_rate (random with the given seed).
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, jitter=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.runs = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, targets, timeout=connectivity.PROBE_TIMEOUT, resolver=None):
+        with self._lock:
+            spread = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            failed = self.random.random() < self.failure_rate
+            self.runs += 1
+        started = time.monotonic()
+        latency = min(max(0.0, self.latency * (1 + spread)), timeout)
+        time.sleep(latency)
+        spec = targets[0]['spec'] if targets else 'fake'
+        record = {'target': spec, 'ok': not failed, 'latency_ms': round(latency * 1000, 2),
+                  'error': 'Simulated failure' if failed else None}
+        return connectivity.probe_result([record], started, None if failed else record)
+
+class StandInServers:
+    """Local stand-ins for the probe targets, for tests and benchmarks
+
+    A TCP listener, a DNS server answering every A query with 127.0.0.1
+    (or dropping queries while dns_drop is set) and an HTTP server
+    answering with http_status (204, or e.g. 200 to act as a captive
+    portal), all on 127.0.0.1. targets() lists specs for them; http
+    targets use a name that only the stand-in DNS server resolves.
+    """
+
+    HTTP_NAME = 'connectivity.test'
+
+    def __init__(self, http_status=204, dns_drop=False):
+        self.http_status = http_status
+        self.dns_drop = dns_drop
+        self.dns_queries = 0
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind(('127.0.0.1', 0))
+        self.tcp.listen(64)
+        self.tcp.settimeout(0.1)
+        self.dns = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.dns.bind(('127.0.0.1', 0))
+        self.dns.settimeout(0.1)
+
+        servers = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(servers.http_status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.http = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.http.daemon_threads = True
+        self._threads = [threading.Thread(target=target, daemon=True) for target in
+                         (self._accept, self._answer_dns, self._serve_http)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _serve_http(self):
+        self.http.serve_forever(poll_interval=0.05)
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                connection, _ = self.tcp.accept()
+                connection.close()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+    def _answer_dns(self):
+        while not self._stop.is_set():
+            try:
+                query, address = self.dns.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.dns_queries += 1
+            if self.dns_drop or len(query) < 12:
+                continue
+            question_end = connectivity.skip_dns_name(query, 12) + 4
+            answer = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 60, 4) + socket.inet_aton('127.0.0.1')
+            header = query[:2] + struct.pack('!5H', 0x8180, 1, 1, 0, 0)
+            self.dns.sendto(header + query[12:question_end] + answer, address)
+
+    def targets(self, kinds=('icmp', 'tcp', 'dns', 'http')):
+        specs = {
+            'icmp': 'icmp://127.0.0.1',
+            'tcp': f'tcp://127.0.0.1:{self.tcp.getsockname()[1]}',
+            'dns': f'dns://127.0.0.1:{self.dns.getsockname()[1]}/example.com',
+            'http': f'http://{self.HTTP_NAME}:{self.http.server_port}/generate_204',
+        }
+        return [specs[kind] for kind in kinds]
+
+    @property
+    def resolver(self):
+        """The stand-in DNS server as (host, port), for ConnectivityChecker(resolver=...)"""
+        return self.dns.getsockname()
+
+    def stop(self):
+        self._stop.set()
+        self.http.shutdown()
+        self.http.server_close()
+        self.tcp.close()
+        self.dns.close()
+        for thread in self._threads:
+            thread.join(timeout=1)
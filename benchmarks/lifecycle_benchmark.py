@@ -0,0 +1,419 @@
+"""
+End-to-end AP/connect lifecycle benchmark on a simulated system layer
+
+Runs the real access point daemon code, web host, portal and admin panel
+in-process, with the system layer simulated:
+
+- systemctl, ip, rfkill, fuser and iw/iwlist go through a
+  fakes.FakeCommandRunner installed as the shared runner. It
+  applies Pi-like latencies with jitter and configurable failure rates,
+  and returns canned scan output that the real parsers consume.
+- Internet checks go through a fakes.FakeProbe that fails at
+  --ping-failure-rate.
+- Readiness probes are fakes.FakeProbes with per-probe delays.
+- Association with the chosen network takes --assoc-seconds. It fails
+  with a wrong password at --wrong-password-rate.
+- The GPIO button is button.SimulatedBackend, pressed like a real one.
+
+Each simulated device runs in its own process and repeats the lifecycle:
+
+1. Press the button and wait for the portal.
+2. Make phone requests over HTTP: probes, page, status and scans.
+3. POST /connect and poll the job until it finishes.
+4. On success, use the admin panel. On failure, tear the AP down.
+
+Phase times come from the WiFi state machine and the connect jobs.
+Endpoint times are measured over keep-alive HTTP connections to the web
+host. No root, radio or GPIO is needed, so it runs on any Linux box.
+
+Usage:
+    python3 benchmarks/lifecycle_benchmark.py                      # compare against baseline
+    python3 benchmarks/lifecycle_benchmark.py --devices 8 --cycles 10 --scale 0.2
+    python3 benchmarks/lifecycle_benchmark.py --update-baseline
+
+Prints n/p50/p95/p99/max per phase and per endpoint. p95 values are
+compared with benchmarks/lifecycle_baseline.json (machine specific, not
+committed); the script exits non-zero when one got slower than the
+tolerance allows.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from portal_load_test import percentile
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'lifecycle_baseline.json')
+TOLERANCE = 0.25  # Allowed p95 slowdown over the baseline
+SLACK_MS = 5  # Absolute slack so sub-millisecond endpoints don't flap
+STATE_TIMEOUT = 60
+
+# Seconds per command on a Pi 3B+, multiplied by --scale
+COMMAND_LATENCIES = {
+    ('sudo', 'systemctl', 'start'): 0.20,
+    ('sudo', 'systemctl', 'start', 'hostapd'): 0.35,
+    ('sudo', 'systemctl', 'restart'): 0.40,
+    ('sudo', 'systemctl', 'stop'): 0.10,
+    ('sudo', 'systemctl', 'enable'): 0.30,
+    ('systemctl', 'is-active'): 0.01,
+    ('sudo', 'ip'): 0.01,
+    ('sudo', 'rfkill'): 0.01,
+    ('sudo', 'fuser'): 0.05,
+    ('sudo', 'iw', 'dev'): 2.5,
+    ('sudo', 'iwlist'): 2.5,
+}
+PROBE_LATENCY = 0.03  # Seconds per internet check, multiplied by --scale
+
+# Seconds until each readiness probe passes, multiplied by --scale
+PROBE_DELAYS = {
+    'unit_active': 0.15,
+    'unit_inactive': 0.05,
+    'interface_up': 0.02,
+    'interface_down': 0.02,
+    'address_assigned': 0.05,
+}
+
+SCAN_NETWORKS = 12
+TARGET_SSID = 'Network0'
+TARGET_PASSWORD = 'secret123'
+
+def fake_scan_output(count=SCAN_NETWORKS):
+    """(iw, iwlist) scan output for count WPA2 networks"""
+    iw, iwlist = [], []
+    for i in range(count):
+        bssid = f'aa:bb:cc:dd:ee:{i:02x}'
+        channel = 1 + (i * 5) % 11
+        freq = 2407 + 5 * channel
+        signal = -40 - 3 * i
+        iw.append(f"BSS {bssid}(on wlan0)\n\tfreq: {freq}\n\tsignal: {signal}.00 dBm\n"
+                  f"\tSSID: Network{i}\n\tDS Parameter set: channel {channel}\n"
+                  f"\tcapability: ESS Privacy ShortSlotTime (0x0411)\n"
+                  f"\tRSN:\t * Version: 1\n\t\t * Authentication suites: PSK\n")
+        iwlist.append(f"          Cell {i + 1:02d} - Address: {bssid}\n"
+                      f"                    Channel:{channel}\n"
+                      f"                    Frequency:{freq / 1000:.3f} GHz\n"
+                      f"                    Quality={70 - i}/70  Signal level={signal} dBm\n"
+                      f"                    Encryption key:on\n"
+                      f"                    ESSID:\"Network{i}\"\n"
+                      f"                    IE: IEEE 802.11i/WPA2 Version 1\n"
+                      f"                        Authentication Suites (1) : PSK\n")
+    return ''.join(iw), 'wlan0     Scan completed :\n' + ''.join(iwlist)
+
+class Samples:
+    """Latency samples in milliseconds keyed by 'phase:name' or 'endpoint:name'"""
+
+    def __init__(self):
+        self.values = {}
+        self.counts = {}
+
+    def add(self, key, seconds):
+        if seconds is None:
+            return
+        self.values.setdefault(key, []).append(seconds * 1000)
+
+    def count(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+class PortalClient:
+    """Keep-alive HTTP client that times every request by endpoint"""
+
+    def __init__(self, port, samples):
+        self.port = port
+        self.samples = samples
+        self.connection = None
+
+    def request(self, method, path, body=None, endpoint=None):
+        headers = {'Host': '192.168.4.1'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            started = time.perf_counter()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                self.close()
+                if attempt:
+                    raise
+                continue
+            self.samples.add(f'endpoint:{method} {endpoint or path}', time.perf_counter() - started)
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+            if response.getheader('Content-Type', '').startswith('application/json'):
+                return response.status, json.loads(data)
+            return response.status, data
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def wait_for_state(machine, states, after, timeout=STATE_TIMEOUT):
+    """Wait for a transition made after the wall-clock time after into one of states"""
+    deadline = time.monotonic() + timeout
+    while machine.since < after or machine.state not in states:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"WiFi state stuck in {machine.state}")
+        time.sleep(0.005)
+    return machine.state
+
+def state_duration(machine, state):
+    """Seconds the most recent visit to state lasted, from the transition history"""
+    for transition in reversed(machine.history):
+        if transition['from'] == state:
+            return transition['duration_ms'] / 1000
+    return None
+
+def simulated_system(args, seed):
+    """Command runner for one device"""
+    scale = args.scale
+    iw_output, iwlist_output = fake_scan_output()
+    failure_rates = {prefix: args.failure_rate for prefix in COMMAND_LATENCIES
+                     if prefix[:2] == ('sudo', 'systemctl') and prefix[2] != 'stop'}
+    import fakes
+    return fakes.FakeCommandRunner(
+        latencies={prefix: latency * scale for prefix, latency in COMMAND_LATENCIES.items()},
+        failure_rates=failure_rates,
+        outputs={('sudo', 'iw', 'dev'): iw_output, ('sudo', 'iwlist'): iwlist_output},
+        jitter=args.jitter, seed=seed)
+
+def run_device(index, args, results):
+    """One simulated device: set up the fakes, then run the lifecycle --cycles times"""
+    state_dir = tempfile.mkdtemp(prefix=f'lifecycle-{index}-')
+    os.environ.update(BUTTON_BACKEND='simulated', WEB_PORT='0', LOG_DIR=state_dir)
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    import config_files
+    for name in ('HOSTAPD_CONF', 'CAPTIVE_DNS_CONF', 'WPA_SUPPLICANT_CONF',
+                 'KNOWN_NETWORKS_FILE', 'ADMIN_SERVICE_FILE'):
+        setattr(config_files, name, os.path.join(state_dir, name.lower()))
+
+    import access_point
+    import command_runner
+    import connectivity
+    import credential_store
+    import fakes
+    import web_host
+    import wifi_scan
+    import wifi_state
+    import wpa_ctrl
+
+    seed = args.seed + index
+    rng = random.Random(seed)
+    runner = simulated_system(args, seed)
+    command_runner.runner = runner
+    connectivity.checker = connectivity.ConnectivityChecker(probe=fakes.FakeProbe(
+        PROBE_LATENCY * args.scale, args.ping_failure_rate, args.jitter, seed))
+
+    def new_probes():
+        return fakes.FakeProbes({name: delay * args.scale for name, delay in PROBE_DELAYS.items()})
+
+    host = web_host.WebHost(host='127.0.0.1', port=0, mode=web_host.ADMIN)
+    host.start()
+    host.preload()
+    access_point.web_host_server = host
+    import web_config
+    web_config.credentials = credential_store.CredentialStore(config_files.KNOWN_NETWORKS_FILE)
+    wifi_scan.cache = web_config.scan_cache = wifi_scan.ScanCache(lambda: wifi_scan.scan('wlan0'))
+    web_config.on_connected = access_point.on_client_connected
+
+    def associate(ssid, deadline):
+        time.sleep(min(args.assoc_seconds * args.scale, max(0, deadline - time.monotonic())))
+        if rng.random() < args.wrong_password_rate:
+            return wpa_ctrl.WRONG_PASSWORD
+        return wpa_ctrl.CONNECTED
+
+    web_config.wait_for_association = associate
+
+    machine = wifi_state.machine
+    button = access_point.setup_button()
+    samples = Samples()
+    client = PortalClient(host.server.server_port, samples)
+    try:
+        for _ in range(args.cycles):
+            access_point.system_probes = new_probes()
+            # Button -> portal
+            pressed = time.perf_counter()
+            after = time.time()
+            button.backend.press(access_point.BUTTON_PIN, 0.1)
+            state = wait_for_state(machine, (wifi_state.AP_READY, wifi_state.IDLE), after)
+            samples.add('phase:button_to_portal', time.perf_counter() - pressed)
+            samples.add('phase:ap_setup', state_duration(machine, wifi_state.AP_STARTING))
+            if state != wifi_state.AP_READY:
+                samples.count('ap_setup_failed')
+                continue
+
+            # Phone joins and configures WiFi
+            client.request('GET', '/generate_204')
+            client.request('GET', '/hotspot-detect.html')
+            client.request('GET', '/')
+            client.request('GET', '/status')
+            web_config.scan_cache.invalidate()
+            client.request('GET', '/scan_networks', endpoint='/scan_networks (scan)')
+            client.request('GET', '/scan_networks', endpoint='/scan_networks (cached)')
+            after = time.time()
+            status, reply = client.request('POST', '/connect',
+                                           {'ssid': TARGET_SSID, 'password': TARGET_PASSWORD})
+            job_id = reply['job_id']
+            deadline = time.monotonic() + STATE_TIMEOUT
+            portal = True
+            while True:
+                if portal:
+                    status, job = client.request('GET', f'/connect/{job_id}',
+                                                 endpoint='/connect/<id>')
+                    # The portal routes are gone once the Pi has joined the network
+                    portal = status != 404
+                if not portal:
+                    job = web_config.get_job(job_id)
+                if job['state'] in ('connected', 'failed') or time.monotonic() > deadline:
+                    break
+                time.sleep(0.1)
+            samples.add('phase:connect', job['duration'] or 0)
+            samples.count(f"connect_{job['state']}")
+
+            if job['state'] == 'connected':
+                wait_for_state(machine, (wifi_state.CLIENT,), after)
+                samples.add('phase:connecting', state_duration(machine, wifi_state.CONNECTING))
+                client.request('GET', '/api/system-info')
+                client.request('GET', '/api/wifi-state')
+                client.request('GET', '/api/commands')
+                client.request('GET', '/api/history?metric=cpu&range=10m',
+                               endpoint='/api/history')
+            else:
+                wait_for_state(machine, (wifi_state.AP_READY, wifi_state.IDLE), after)
+                recovering = state_duration(machine, wifi_state.RECOVERING)
+                if recovering is not None:
+                    samples.add('phase:recovering', recovering)
+                started = time.perf_counter()
+                access_point.on_button_long_press()
+                samples.add('phase:ap_cleanup', time.perf_counter() - started)
+    finally:
+        client.close()
+        button.stop()
+        host.stop()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    results.put({'values': samples.values, 'counts': samples.counts})
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        'n': len(ordered),
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1]
+    }
+
+def load_baseline():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_baseline(summary, args):
+    with open(BASELINE_FILE, 'w') as f:
+        json.dump({'p95_ms': {key: round(stats['p95'], 2) for key, stats in summary.items()},
+                   'scale': args.scale, 'python': sys.version.split()[0]}, f, indent=2)
+        f.write('\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="AP/connect lifecycle benchmark")
+    parser.add_argument('--devices', type=int, default=4, help="simulated devices (processes)")
+    parser.add_argument('--cycles', type=int, default=5, help="lifecycles per device")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier for simulated latencies")
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--failure-rate', type=float, default=0.01,
+                        help="probability that a systemctl start/restart fails")
+    parser.add_argument('--ping-failure-rate', type=float, default=0.05)
+    parser.add_argument('--wrong-password-rate', type=float, default=0.1)
+    parser.add_argument('--assoc-seconds', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', help="also write the summary to this file")
+    parser.add_argument('--verbose', action='store_true', help="keep the daemon's log output")
+    args = parser.parse_args()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_device, args=(i, args, results))
+                 for i in range(args.devices)]
+    started = time.monotonic()
+    for process in processes:
+        process.start()
+    merged, counts = {}, {}
+    for _ in processes:
+        result = None
+        while result is None:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    print("A simulated device failed; see the traceback above")
+                    return 2
+
+        for key, values in result['values'].items():
+            merged.setdefault(key, []).extend(values)
+        for key, count in result['counts'].items():
+            counts[key] = counts.get(key, 0) + count
+    for process in processes:
+        process.join()
+    elapsed = time.monotonic() - started
+
+    summary = {key: summarize(values) for key, values in sorted(merged.items())}
+    print(f"{args.devices} devices x {args.cycles} cycles in {elapsed:.1f}s "
+          f"(scale {args.scale}, seed {args.seed})")
+    print(f"{'':<42}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for key, stats in summary.items():
+        print(f"{key:<42}{stats['n']:>5}{stats['p50']:>10.1f}{stats['p95']:>10.1f}"
+              f"{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    print('outcomes: ' + ', '.join(f"{key} {count}" for key, count in sorted(counts.items())))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'counts': counts}, f, indent=2)
+
+    if args.update_baseline:
+        save_baseline(summary, args)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+    baseline = load_baseline()
+    if baseline is None:
+        save_baseline(summary, args)
+        print(f"No baseline yet; recorded this run in {BASELINE_FILE}")
+        return 0
+    if baseline.get('scale') != args.scale:
+        print(f"Baseline was recorded at scale {baseline.get('scale')}; not comparing")
+        return 0
+
+    regressions = []
+    for key, stats in summary.items():
+        limit = baseline['p95_ms'].get(key)
+        if limit is not None and stats['p95'] > limit * (1 + args.tolerance) + SLACK_MS:
+            regressions.append(f"{key}: p95 {stats['p95']:.1f} ms > baseline {limit:.1f} ms")
+    if regressions:
+        print("FAIL:\n  " + '\n  '.join(regressions))
+        return 1
+    print(f"OK: every p95 within {args.tolerance:.0%} of the baseline")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Load test for the configuration portal's HTTP servers
+
+Serves web_config.app from this process with the asyncio server
+(async_server.py) and/or werkzeug's threaded server, then simulates phones
+joined to the access point from a separate client process. Each simulated
+phone keeps one keep-alive connection open and cycles through what a real
+one does: connectivity probes, the portal page, status polls and the
+occasional network scan. Scans use a fake scanner that takes --scan-delay
+seconds, like a real radio scan, so no WiFi hardware is needed.
+
+Usage:
+    python3 benchmarks/portal_load_test.py                       # both servers
+    python3 benchmarks/portal_load_test.py --server async --clients 40 --duration 20
+
+Prints sustained requests/second, latency percentiles and errors for each
+server. Results are comparative; run on the Pi itself for absolute numbers.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# Request mix of one simulated phone, repeated for the whole run
+CLIENT_SCRIPT = [
+    '/generate_204',
+    '/hotspot-detect.html',
+    '/connecttest.txt',
+    '/',
+    '/status',
+    '/generate_204',
+    '/status',
+    '/scan_networks',
+    '/status',
+]
+
+FAKE_NETWORKS = [
+    {'bssid': f'aa:bb:cc:dd:ee:{i:02x}', 'ssid': f'Network{i}', 'signal_dbm': -40 - i,
+     'quality': 90 - i, 'channel': 1 + i % 11, 'frequency_mhz': 2412 + 5 * (i % 11),
+     'security': 'WPA2', 'associated': False}
+    for i in range(12)
+]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+async def read_response(reader):
+    """Read one response; returns (status, keep_alive)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection') != 'close' and lines[0].startswith('HTTP/1.1')
+
+async def simulated_phone(port, offset, deadline, stats):
+    """One client on a keep-alive connection, reconnecting when closed"""
+    reader = writer = None
+    step = offset
+    while time.monotonic() < deadline:
+        path = CLIENT_SCRIPT[step % len(CLIENT_SCRIPT)]
+        step += 1
+        started = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n".encode())
+            status, keep_alive = await asyncio.wait_for(read_response(reader), 30)
+            stats['latencies'].append(time.monotonic() - started)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            if not keep_alive:
+                writer.close()
+                reader = writer = None
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            stats['errors'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+def run_clients(port, clients, duration, results):
+    """Client process entry point: run all phones and report summary stats"""
+    stats = {'latencies': [], 'statuses': {}, 'errors': 0}
+
+    async def main():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(simulated_phone(port, i, deadline, stats) for i in range(clients)))
+
+    started = time.monotonic()
+    asyncio.run(main())
+    elapsed = time.monotonic() - started
+    latencies = sorted(stats['latencies'])
+    results.put({
+        'requests': len(latencies),
+        'elapsed': elapsed,
+        'errors': stats['errors'],
+        'statuses': stats['statuses'],
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+    })
+
+def make_server(kind, app):
+    if kind == 'async':
+        import async_server
+        return async_server.make_server('127.0.0.1', 0, app)
+    from werkzeug.serving import make_server as make_werkzeug_server
+    return make_werkzeug_server('127.0.0.1', 0, app, threaded=True)
+
+def run(kind, clients, duration):
+    import web_config
+    server = make_server(kind, web_config.app)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_clients,
+                                      args=(server.server_port, clients, duration, results))
+    process.start()
+    result = results.get()
+    process.join()
+    server.shutdown()
+    server.server_close()
+    return result
+
+def format_ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.1f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Portal HTTP server load test")
+    parser.add_argument('--server', choices=['async', 'threaded', 'both'], default='both')
+    parser.add_argument('--clients', type=int, default=25)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--scan-delay', type=float, default=2.0)
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    import web_config
+    import wifi_scan
+
+    def fake_scan():
+        time.sleep(args.scan_delay)
+        return [dict(bss) for bss in FAKE_NETWORKS]
+
+    web_config.scan_cache = wifi_scan.ScanCache(fake_scan)
+
+    kinds = ['async', 'threaded'] if args.server == 'both' else [args.server]
+    print(f"{args.clients} clients for {args.duration:.0f}s each, scan delay {args.scan_delay}s")
+    print(f"{'server':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}{'errors':>8}  statuses")
+    for kind in kinds:
+        web_config.scan_cache.invalidate()
+        result = run(kind, args.clients, args.duration)
+        rate = result['requests'] / result['elapsed']
+        statuses = ' '.join(f"{code}:{count}" for code, count in sorted(result['statuses'].items()))
+        print(f"{kind:<10}{result['requests']:>10}{rate:>10.1f}{format_ms(result['p50']):>10}"
+              f"{format_ms(result['p95']):>10}{format_ms(result['p99']):>10}"
+              f"{format_ms(result['max']):>10}{result['errors']:>8}  {statuses}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Cold-start regression benchmark for access_point.py
+
+Starts access_point.py in a fresh interpreter several times with the
+simulated button backend and an ephemeral web port, and measures the wall
+time until it logs that it is waiting for the button. The median is
+compared against a stored baseline (or --budget-ms) and the script exits
+non-zero if startup got slower than the allowed tolerance.
+
+Usage:
+    python3 benchmarks/startup_benchmark.py                  # compare against baseline
+    python3 benchmarks/startup_benchmark.py --update-baseline
+    python3 benchmarks/startup_benchmark.py --budget-ms 3000 # fixed budget (e.g. Pi Zero)
+
+The baseline is machine specific, so it is stored next to this script in
+startup_baseline.json rather than shared between machines. The profile
+report of the slowest run is printed when the check fails.
+"""
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_FILE = os.path.join(BENCH_DIR, 'startup_baseline.json')
+READY_MARKER = 'Waiting for GPIO button'
+RUNS = 7
+TOLERANCE = 0.20  # Allowed slowdown over the baseline median
+RUN_TIMEOUT = 60
+
+def measure_once(log_dir, timeout=RUN_TIMEOUT):
+    """Return (seconds until READY_MARKER, captured output) for one cold start"""
+    env = dict(os.environ, BUTTON_BACKEND='simulated', WEB_PORT='0', LOG_DIR=log_dir,
+               PYTHONDONTWRITEBYTECODE='1')
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, 'access_point.py'), '--profile-startup'],
+        cwd=REPO_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    output = []
+    elapsed = None
+    try:
+        deadline = started + timeout
+        in_report = False
+        for line in process.stdout:
+            if elapsed is None and READY_MARKER in line:
+                elapsed = time.perf_counter() - started
+            if elapsed is not None:
+                # Keep the profile report that follows the marker, then stop
+                if 'Startup profile' in line:
+                    in_report = True
+                elif in_report and not line.startswith(' '):
+                    break
+            output.append(line)
+            if time.perf_counter() > deadline:
+                break
+    finally:
+        # SIGKILL so the daemon's signal handler does not try to restore networking
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+    if elapsed is None:
+        raise RuntimeError("access_point.py never reached the button wait:\n" + ''.join(output))
+    return elapsed, ''.join(output)
+
+def load_baseline():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_baseline(median_ms):
+    with open(BASELINE_FILE, 'w') as f:
+        json.dump({'waiting_for_button_ms': round(median_ms, 1), 'python': sys.version.split()[0]},
+                  f, indent=2)
+        f.write('\n')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--runs', type=int, default=RUNS)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--budget-ms', type=float, help="fixed budget instead of the baseline")
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    timings = []
+    slowest_output = ''
+    with tempfile.TemporaryDirectory() as log_dir:
+        for _ in range(args.runs):
+            elapsed, output = measure_once(log_dir)
+            if not timings or elapsed > max(timings):
+                slowest_output = output
+            timings.append(elapsed)
+
+    timings_ms = sorted(t * 1000 for t in timings)
+    median_ms = statistics.median(timings_ms)
+    print(f"cold start to '{READY_MARKER}': median {median_ms:.1f} ms, "
+          f"min {timings_ms[0]:.1f} ms, max {timings_ms[-1]:.1f} ms over {len(timings_ms)} runs")
+
+    if args.update_baseline:
+        save_baseline(median_ms)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+
+    if args.budget_ms is not None:
+        limit_ms = args.budget_ms
+    else:
+        baseline = load_baseline()
+        if baseline is None:
+            save_baseline(median_ms)
+            print(f"No baseline yet; recorded this run in {BASELINE_FILE}")
+            return 0
+        limit_ms = baseline['waiting_for_button_ms'] * (1 + args.tolerance)
+
+    if median_ms > limit_ms:
+        print(f"FAIL: median {median_ms:.1f} ms exceeds the limit of {limit_ms:.1f} ms")
+        print("Slowest run:")
+        print(slowest_output)
+        return 1
+    print(f"OK: within the limit of {limit_ms:.1f} ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+systemctl forks vs the D-Bus systemd client, against a mock systemd
+
+Starts fakes.MockSystemd on a private socket and measures:
+
+- call overhead: `is-active` over the shared D-Bus connection, compared
+  with spawning a trivial process (a lower bound for a systemctl fork,
+  which also connects and authenticates to the bus on every call)
+- mode switch: stopping the four AP-conflicting units one job at a time
+  (the old per-unit systemctl loop) and as one batched call whose jobs
+  run in parallel and complete on JobRemoved signals
+
+Exits non-zero if the unit states end up wrong or the batched switch is
+not faster than the sequential one.
+
+Usage:
+    python3 benchmarks/systemd_dbus_benchmark.py
+    python3 benchmarks/systemd_dbus_benchmark.py --job-latency 0.1 --calls 500
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fakes
+import systemd_dbus
+from command_runner import CommandRunner
+
+UNITS = ['wpa_supplicant', 'hostapd', 'dnsmasq', 'dhcpcd']
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def report(name, samples):
+    ordered = sorted(samples)
+    print(f"{name:<36}{statistics.median(ordered):>10.3f}"
+          f"{ordered[int(0.95 * (len(ordered) - 1))]:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="D-Bus systemd client benchmark")
+    parser.add_argument('--calls', type=int, default=200, help="calls per overhead sample")
+    parser.add_argument('--switches', type=int, default=5, help="mode switches per variant")
+    parser.add_argument('--job-latency', type=float, default=0.2,
+                        help="seconds each mock unit job takes")
+    args = parser.parse_args()
+
+    mock = fakes.MockSystemd({unit: {'active': True} for unit in UNITS},
+                                    latency=args.job_latency).start()
+    client = systemd_dbus.SystemdClient(mock.address)
+    runner = CommandRunner(systemd=client, drop_sudo=True)
+    failures = 0
+    try:
+        print(f"{'':<36}{'p50 ms':>10}{'p95 ms':>10}")
+        report('fork+exec /bin/true', timed(
+            lambda: subprocess.run(['true'], capture_output=True), args.calls))
+        report('is-active over D-Bus', timed(
+            lambda: runner.run(['sudo', 'systemctl', 'is-active', 'hostapd']), args.calls))
+        report('is-active x4 over D-Bus', timed(
+            lambda: runner.run(['systemctl', 'is-active'] + UNITS), args.calls))
+
+        def sequential(action):
+            for unit in UNITS:
+                runner.systemctl(action, unit, check=True)
+
+        def batched(action):
+            runner.systemctl(action, *UNITS, check=True)
+
+        results = {}
+        for name, switch in (('sequential', sequential), ('batched', batched)):
+            samples = []
+            for _ in range(args.switches):
+                samples += timed(lambda: switch('stop'), 1)
+                failures += any(mock.is_active(unit) for unit in UNITS)
+                switch('start')
+                failures += not all(mock.is_active(unit) for unit in UNITS)
+            results[name] = statistics.median(samples)
+            report(f'stop {len(UNITS)} units ({name})', samples)
+    finally:
+        client.close()
+        mock.stop()
+
+    speedup = results['sequential'] / results['batched']
+    print(f"Batched switch is {speedup:.1f}x faster than one unit at a time")
+    if failures or speedup <= 1:
+        print("FAIL")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
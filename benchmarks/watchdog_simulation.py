@@ -0,0 +1,88 @@
+"""
+Simulated-clock scenarios for the connectivity watchdog
+
+Drives watchdog.ConnectivityWatchdog through scripted outages with
+watchdog.simulate(), so hours of behaviour run in milliseconds without
+WiFi hardware. Each scenario states when the access point fallback, the
+known-network retries and the return to online must happen; the script
+prints the transitions and the number of checks (wakeups) per simulated
+hour and exits non-zero if any expectation fails.
+
+Usage:
+    python3 benchmarks/watchdog_simulation.py
+    python3 benchmarks/watchdog_simulation.py --verbose
+"""
+
+import argparse
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import watchdog
+
+UP = (True, True)
+NO_UPSTREAM = (True, False)
+DOWN = (False, False)
+
+def timeline(*segments):
+    """connectivity(t) from (until_seconds, state) segments; the last state holds"""
+    def connectivity(t):
+        for until, state in segments:
+            if t < until:
+                return state
+        return segments[-1][1]
+    return connectivity
+
+def flapping(period, down_for):
+    """Link that drops for down_for seconds out of every period"""
+    return lambda t: DOWN if t % period < down_for else UP
+
+# name, connectivity, duration, expected callback events as (name, earliest, latest)
+SCENARIOS = [
+    ('stable', timeline((float('inf'), UP)), 3600, []),
+    ('short dropout', timeline((600, UP), (660, DOWN), (float('inf'), UP)), 3600, []),
+    ('flapping link', flapping(300, 40), 3600, []),
+    ('sustained loss', timeline((600, UP), (float('inf'), DOWN)), 3600,
+     [('offline', 720, 760), ('retry', 1020, 1060), ('retry', 1620, 1660),
+      ('retry', 2820, 2860)]),
+    ('upstream outage then recovery', timeline((600, UP), (1500, NO_UPSTREAM), (float('inf'), UP)),
+     3600, [('offline', 720, 760), ('retry', 1020, 1060), ('online', 1500, 1540)]),
+]
+
+def check(events, expected):
+    """List of problems comparing recorded events with the expected ones"""
+    problems = []
+    if len(events) != len(expected):
+        problems.append(f"expected {len(expected)} events, got {len(events)}")
+    for (at, name), (want, earliest, latest) in zip(events, expected):
+        if name != want or not earliest <= at <= latest:
+            problems.append(f"expected {want} in [{earliest}, {latest}]s, got {name} at {at:.0f}s")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Connectivity watchdog scenarios")
+    parser.add_argument('--verbose', action='store_true', help="print every transition")
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'scenario':<32}{'checks/h':>10}{'events':>8}  result")
+    for name, connectivity, duration, expected in SCENARIOS:
+        result = watchdog.simulate(connectivity, duration)
+        problems = check(result['events'], expected)
+        failures += bool(problems)
+        rate = result['checks'] * 3600 / duration
+        print(f"{name:<32}{rate:>10.0f}{len(result['events']):>8}  "
+              f"{'ok' if not problems else 'FAIL'}")
+        for problem in problems:
+            print(f"    {problem}")
+        if args.verbose:
+            for at, old, new in result['transitions']:
+                print(f"    {at:>7.0f}s  {old} -> {new}")
+            for at, event in result['events']:
+                print(f"    {at:>7.0f}s  {event}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
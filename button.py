@@ -0,0 +1,187 @@
+"""
+Edge-driven push button handling for the Raspberry Pi WiFi configuration system
+
+Instead of polling the pin, the backend reports every edge and the Button
+debounces them with a short settle timer, then classifies each press:
+- short press: released before the long press threshold
+- long press: held past the threshold (fires while still held)
+
+Backends:
+- GPIOBackend: RPi.GPIO edge detection (imported lazily, Pi only)
+- SimulatedBackend: in-memory pin levels for running on any Linux box
+  (BUTTON_BACKEND=simulated), driven from code with set_level()/press()
+"""
+
+import threading
+import time
+
+class GPIOBackend:
+    """Pin source backed by RPi.GPIO edge detection"""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+    def setup(self, pin, callback):
+        """Configure the pin as a pulled-up input and report every edge"""
+        self.GPIO.setmode(self.GPIO.BCM)
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+        self.GPIO.add_event_detect(pin, self.GPIO.BOTH,
+                                   callback=lambda channel: callback(self.read(channel)))
+
+    def read(self, pin):
+        return self.GPIO.input(pin)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+class SimulatedBackend:
+    """In-memory pin source; tests drive it with set_level()"""
+
+    def __init__(self, idle_level=1):
+        self.idle_level = idle_level
+        self.levels = {}
+        self.callbacks = {}
+        self._lock = threading.Lock()
+
+    def setup(self, pin, callback):
+        with self._lock:
+            self.levels[pin] = self.idle_level
+            self.callbacks[pin] = callback
+
+    def read(self, pin):
+        with self._lock:
+            if pin not in self.callbacks:
+                raise RuntimeError(f"Pin {pin} read before setup")  # As RPi.GPIO does
+            return self.levels[pin]
+
+    def set_level(self, pin, level):
+        """Change the pin level and fire the edge callback if it changed"""
+        with self._lock:
+            if self.levels.get(pin, self.idle_level) == level:
+                return
+            self.levels[pin] = level
+            callback = self.callbacks.get(pin)
+        if callback:
+            callback(level)
+
+    def press(self, pin, duration, bounces=0):
+        """Hold the button for duration seconds, optionally with contact bounce"""
+        active = 1 - self.idle_level
+        for _ in range(bounces):
+            self.set_level(pin, active)
+            self.set_level(pin, self.idle_level)
+        self.set_level(pin, active)
+        time.sleep(duration)
+        for _ in range(bounces):
+            self.set_level(pin, self.idle_level)
+            self.set_level(pin, active)
+        self.set_level(pin, self.idle_level)
+
+    def cleanup(self):
+        with self._lock:
+            self.callbacks.clear()
+
+class Button:
+    """Debounced button with short and long press callbacks
+
+    on_press(duration) runs when the button is released before long_press
+    seconds; on_long_press() runs as soon as it has been held that long.
+    Callbacks run on timer threads, never in the backend's edge callback.
+    """
+
+    def __init__(self, pin, backend, on_press=None, on_long_press=None,
+                 debounce=0.05, long_press=5.0, active_low=True):
+        self.pin = pin
+        self.backend = backend
+        self.on_press = on_press
+        self.on_long_press = on_long_press
+        self.debounce = debounce
+        self.long_press = long_press
+        self.active_low = active_low
+        self.pressed = False
+        self._lock = threading.Lock()
+        self._settle_timer = None
+        self._long_timer = None
+        self._edge_time = None
+        self._pressed_at = None
+        self._long_fired = False
+
+    def start(self):
+        """Attach to the backend and start receiving edges
+
+        The pin has to be set up before it can be read (RPi.GPIO raises
+        RuntimeError otherwise). An edge between the two is not lost: its
+        settle timer reads the pin again. A button already held counts as
+        pressed from now, long press timer included.
+        """
+        self.backend.setup(self.pin, self._on_edge)
+        pressed = self._is_active(self.backend.read(self.pin))
+        with self._lock:
+            if self._settle_timer is not None or pressed == self.pressed:
+                return  # An edge arrived meanwhile; its settle timer decides
+            self.pressed = pressed
+            if pressed:
+                self._edge_time = time.monotonic()
+                self._press_started(self._edge_time)
+
+    def stop(self):
+        """Cancel pending timers and release the backend"""
+        with self._lock:
+            for timer in (self._settle_timer, self._long_timer):
+                if timer:
+                    timer.cancel()
+            self._settle_timer = self._long_timer = None
+        self.backend.cleanup()
+
+    def _is_active(self, level):
+        return (level == 0) if self.active_low else (level == 1)
+
+    def _on_edge(self, level):
+        # Restart the settle timer on every edge; only a level that stays
+        # put for the debounce period counts as a state change
+        with self._lock:
+            if self._settle_timer is None:
+                self._edge_time = time.monotonic()
+            else:
+                self._settle_timer.cancel()
+            self._settle_timer = threading.Timer(self.debounce, self._settled)
+            self._settle_timer.daemon = True
+            self._settle_timer.start()
+
+    def _settled(self):
+        pressed = self._is_active(self.backend.read(self.pin))
+        with self._lock:
+            self._settle_timer = None
+            if pressed == self.pressed:
+                return
+            self.pressed = pressed
+            edge_time = self._edge_time
+            if pressed:
+                self._press_started(edge_time)
+                return
+            if self._long_timer:
+                self._long_timer.cancel()
+                self._long_timer = None
+            duration = edge_time - self._pressed_at
+            short_press = not self._long_fired
+        if short_press and self.on_press:
+            self.on_press(duration)
+
+    def _press_started(self, edge_time):
+        """Record a press and arm the long press timer (lock held)"""
+        self._pressed_at = edge_time
+        self._long_fired = False
+        if self.on_long_press:
+            remaining = self.long_press - (time.monotonic() - edge_time)
+            self._long_timer = threading.Timer(max(0, remaining), self._held)
+            self._long_timer.daemon = True
+            self._long_timer.start()
+
+    def _held(self):
+        with self._lock:
+            if not self.pressed:
+                return
+            self._long_timer = None
+            self._long_fired = True
+        self.on_long_press()
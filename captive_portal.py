@@ -0,0 +1,105 @@
+"""
+Captive-portal detection responses for phones joining PiConfigWiFi
+
+Operating systems check for internet access right after joining a network
+by fetching a known URL (Android /generate_204, Apple
+/hotspot-detect.html, Windows /connecttest.txt and /ncsi.txt, Firefox
+/canonical.html, ...). Answering those with a redirect to the portal makes
+the phone open the WiFi setup page by itself.
+
+Every response is built once at import time, both as complete HTTP bytes
+(served straight from the asyncio server's event loop) and as a WSGI
+(status, headers, body) triple for CaptivePortalMiddleware, so probe
+traffic never reaches Flask. DNS for every name is pointed at the access
+point by the dnsmasq drop-in from config_files.render_captive_dns_config().
+"""
+
+PORTAL_IP = '192.168.4.1'
+PORTAL_URL = f'http://{PORTAL_IP}/'
+
+# Connectivity-check paths of the common operating systems
+PROBE_PATHS = (
+    '/generate_204',  # Android, ChromeOS
+    '/gen_204',  # Android
+    '/hotspot-detect.html',  # iOS, macOS
+    '/library/test/success.html',  # older iOS
+    '/connecttest.txt',  # Windows 10+
+    '/ncsi.txt',  # Windows 7/8
+    '/redirect',  # Windows after a failed check
+    '/canonical.html',  # Firefox
+    '/success.txt',  # Firefox
+    '/check_network_status.txt',  # Samsung
+    '/kindle-wifi/wifistub.html',  # Kindle
+)
+
+# Hosts that belong to the portal itself; anything else is redirected
+PORTAL_HOSTS = {PORTAL_IP, 'raspberrypi', 'raspberrypi.local', 'localhost', '127.0.0.1'}
+
+_REDIRECT_BODY = (f'<html><head><meta http-equiv="refresh" content="0; url={PORTAL_URL}">'
+                  f'</head><body><a href="{PORTAL_URL}">WiFi setup</a></body></html>').encode()
+
+def build_redirect(location=PORTAL_URL, body=_REDIRECT_BODY):
+    """WSGI (status, headers, body) for an uncacheable redirect"""
+    headers = [
+        ('Location', location),
+        ('Content-Type', 'text/html; charset=utf-8'),
+        ('Content-Length', str(len(body))),
+        ('Cache-Control', 'no-cache, no-store, must-revalidate'),
+    ]
+    return '302 Found', headers, body
+
+def to_bytes(response, keep_alive=True):
+    """Serialize a WSGI response triple to a complete HTTP/1.1 message"""
+    status, headers, body = response
+    lines = [f'HTTP/1.1 {status}'] + [f'{name}: {value}' for name, value in headers]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+REDIRECT = build_redirect()
+RESPONSES = {path: REDIRECT for path in PROBE_PATHS}
+
+# Precomputed wire bytes, keyed by (path, keep_alive)
+RESPONSE_BYTES = {}
+for _path, _response in RESPONSES.items():
+    RESPONSE_BYTES[_path, True] = to_bytes(_response, keep_alive=True)
+    RESPONSE_BYTES[_path, False] = to_bytes(_response, keep_alive=False)
+REDIRECT_BYTES = {True: to_bytes(REDIRECT, keep_alive=True),
+                  False: to_bytes(REDIRECT, keep_alive=False)}
+
+def _foreign_host(host):
+    return bool(host) and host.split(':', 1)[0].lower() not in PORTAL_HOSTS
+
+def lookup(method, path, host=None):
+    """WSGI response triple for a probe or foreign-host request, else None"""
+    if method not in ('GET', 'HEAD'):
+        return None
+    response = RESPONSES.get(path)
+    if response is None and _foreign_host(host):
+        response = REDIRECT
+    return response
+
+def lookup_bytes(method, path, host=None, keep_alive=True):
+    """Complete HTTP response bytes for a probe or foreign-host request, else None"""
+    if method not in ('GET', 'HEAD'):
+        return None
+    data = RESPONSE_BYTES.get((path, keep_alive))
+    if data is None and _foreign_host(host):
+        data = REDIRECT_BYTES[keep_alive]
+    if data is not None and method == 'HEAD':
+        data = data[:data.index(b'\r\n\r\n') + 4]
+    return data
+
+class CaptivePortalMiddleware:
+    """WSGI middleware answering probe paths before the wrapped app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        response = lookup(environ['REQUEST_METHOD'], environ.get('PATH_INFO', ''),
+                          environ.get('HTTP_HOST'))
+        if response is None:
+            return self.app(environ, start_response)
+        status, headers, body = response
+        start_response(status, headers)
+        return [] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
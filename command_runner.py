@@ -0,0 +1,214 @@
+"""
+Shared command execution for the daemon, web apps and scripts
+
+Every system command goes through a CommandRunner:
+
+- A leading 'sudo' is dropped when the process already runs as root
+  (every entry point requires root), saving an exec per command.
+- Each command has a timeout (TIMEOUTS by prefix, else DEFAULT_TIMEOUT).
+  A command that runs over is killed and reported with exit status 124,
+  like coreutils timeout, so the callers' error handling still applies.
+- systemctl() runs one action on several units in a single invocation.
+  With a systemd client (systemd_dbus.SystemdClient, used by default
+  when running as root), the systemctl commands it understands skip the
+  fork and go over one D-Bus connection. Commands it does not handle,
+  or any command while the bus is unavailable, run systemctl as before.
+- CommandStats keeps per-command counts, failures, timeouts and a
+  duration histogram; the admin panel serves them at /api/commands.
+
+A backend runs the command: SubprocessBackend, or FakeBackend from
+benchmarks/fakes.py to run without a system (latencies, failures and
+canned output per command prefix). FakeCommandRunner there wraps a
+FakeBackend and records every call.
+
+Modules call command_runner.run() and command_runner.systemctl(), which
+use the shared `runner`; replace it to redirect every command at once.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import systemd_dbus
+
+SYSTEMD_BACKEND = os.environ.get('SYSTEMD_BACKEND', 'dbus')  # 'dbus' or 'systemctl'
+DEFAULT_TIMEOUT = 30  # Seconds, for commands not in TIMEOUTS
+TIMEOUT_STATUS = 124  # Exit status reported for a command that timed out
+NOT_FOUND_STATUS = 127  # Exit status reported when the program is missing
+
+# Timeouts in seconds by command prefix (after sudo); the longest prefix wins
+TIMEOUTS = {
+    ('systemctl',): 45,
+    ('systemctl', 'is-active'): 5,
+    ('ip',): 5,
+    ('rfkill',): 5,
+    ('fuser',): 10,
+    ('iw',): 10,
+    ('iw', 'dev'): 20,  # Scans
+    ('iwlist',): 20,
+    ('apt-get',): 1800,
+    ('chown',): 120,
+}
+
+# Histogram bucket upper bounds in seconds (plus +Inf)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Programs whose first argument is part of the command name in the stats
+SUBCOMMANDS = {'systemctl', 'ip', 'iw', 'apt-get', 'rfkill'}
+
+logger = logging.getLogger('command_runner')
+
+def strip_sudo(args):
+    return list(args[1:]) if args[:1] == ['sudo'] else list(args)
+
+def command_name(args):
+    """Stats key for a command: 'systemctl start', 'ip link', 'iwlist', ..."""
+    args = strip_sudo(list(args))
+    if not args:
+        return ''
+    program = os.path.basename(args[0])
+    if program in SUBCOMMANDS:
+        subcommand = next((arg for arg in args[1:] if not arg.startswith('-')), None)
+        if subcommand:
+            return f'{program} {subcommand}'
+    return program
+
+def match_prefix(args, table):
+    """Longest key of table that is a prefix of args, or None"""
+    matches = [prefix for prefix in table if tuple(args[:len(prefix)]) == tuple(prefix)]
+    return max(matches, key=len) if matches else None
+
+class CommandStats:
+    """Count, failures, timeouts and duration histogram per command name"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._commands = {}
+        self.version = 0  # Bumped on every record, so readers can skip unchanged stats
+
+    def record(self, name, seconds, returncode, timed_out=False):
+        with self._lock:
+            self.version += 1
+            entry = self._commands.get(name)
+            if entry is None:
+                entry = self._commands[name] = {
+                    'count': 0, 'failures': 0, 'timeouts': 0,
+                    'total_seconds': 0.0, 'max_seconds': 0.0,
+                    'histogram': [0] * (len(self.buckets) + 1)
+                }
+            entry['count'] += 1
+            entry['failures'] += returncode != 0
+            entry['timeouts'] += timed_out
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound),
+                         len(self.buckets))
+            entry['histogram'][index] += 1
+
+    def snapshot(self):
+        """{name: {count, failures, timeouts, total_seconds, max_seconds, buckets}}
+
+        buckets are cumulative counts keyed by upper bound ('0.1', ..., '+Inf').
+        """
+        labels = [f'{bound:g}' for bound in self.buckets] + ['+Inf']
+        with self._lock:
+            commands = {name: dict(entry, histogram=list(entry['histogram']))
+                        for name, entry in self._commands.items()}
+        snapshot = {}
+        for name, entry in sorted(commands.items()):
+            cumulative, buckets = 0, {}
+            for label, count in zip(labels, entry.pop('histogram')):
+                cumulative += count
+                buckets[label] = cumulative
+            entry['total_seconds'] = round(entry['total_seconds'], 4)
+            entry['max_seconds'] = round(entry['max_seconds'], 4)
+            entry['buckets'] = buckets
+            snapshot[name] = entry
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+            self.version += 1
+
+class SubprocessBackend:
+    """Run commands as subprocesses"""
+
+    def execute(self, args, timeout, input=None, capture=True):
+        return subprocess.run(args, capture_output=capture, text=True, timeout=timeout,
+                              input=input)
+
+class CommandRunner:
+    """Run commands with sudo handling, timeouts and per-command stats"""
+
+    def __init__(self, backend=None, drop_sudo=None, timeouts=None,
+                 default_timeout=DEFAULT_TIMEOUT, stats=None, systemd=None):
+        self.backend = backend or SubprocessBackend()
+        self.drop_sudo = os.geteuid() == 0 if drop_sudo is None else drop_sudo
+        self.timeouts = TIMEOUTS if timeouts is None else timeouts
+        self.default_timeout = default_timeout
+        self.stats = stats or CommandStats()
+        self.systemd = systemd
+
+    def _execute(self, args, timeout, input, capture):
+        command = strip_sudo(args)
+        if (self.systemd is not None and command[:1] == ['systemctl'] and
+                self.systemd.handles(command[1:])):
+            try:
+                return self.systemd.systemctl(command[1:], timeout)
+            except (systemd_dbus.DBusError, OSError) as e:
+                # OSError: the bus socket is missing or was reset mid-call
+                logger.warning(f"systemd D-Bus call failed, running systemctl: {str(e)}")
+        return self.backend.execute(args, timeout, input=input, capture=capture)
+
+    def timeout_for(self, args):
+        prefix = match_prefix(strip_sudo(args), self.timeouts)
+        return self.timeouts[prefix] if prefix else self.default_timeout
+
+    def run(self, args, check=False, timeout=None, input=None, capture=True):
+        """Run args and return a CompletedProcess with text stdout/stderr
+
+        check raises subprocess.CalledProcessError on a non-zero exit,
+        including a timeout (124) or a missing program (127). With
+        capture=False the command writes to this process's stdout and
+        stderr instead (both are None in the result), for long commands
+        whose progress the user should see, like apt-get.
+        """
+        args = strip_sudo(args) if self.drop_sudo else list(args)
+        timeout = timeout or self.timeout_for(args)
+        timed_out = False
+        started = time.monotonic()
+        try:
+            result = self._execute(args, timeout, input, capture)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Command timed out after {timeout}s: {' '.join(args)}")
+            result = subprocess.CompletedProcess(args, TIMEOUT_STATUS, '',
+                                                 f"Timed out after {timeout}s")
+            timed_out = True
+        except OSError as e:
+            result = subprocess.CompletedProcess(args, NOT_FOUND_STATUS, '', str(e))
+        self.stats.record(command_name(args), time.monotonic() - started,
+                          result.returncode, timed_out)
+        if check and result.returncode:
+            raise subprocess.CalledProcessError(result.returncode, args,
+                                                result.stdout, result.stderr)
+        return result
+
+    def systemctl(self, action, *units, check=False, timeout=None):
+        """One systemctl action on every unit in a single invocation"""
+        return self.run(['sudo', 'systemctl', action, *units], check=check, timeout=timeout)
+
+# Shared by every module in the process; systemd over D-Bus needs root
+runner = CommandRunner(systemd=systemd_dbus.SystemdClient()
+                       if SYSTEMD_BACKEND == 'dbus' and os.geteuid() == 0 else None)
+
+def run(args, check=False, timeout=None, input=None, capture=True):
+    """Run a command through the shared runner"""
+    return runner.run(args, check=check, timeout=timeout, input=input, capture=capture)
+
+def systemctl(action, *units, check=False, timeout=None):
+    """One systemctl action on several units through the shared runner"""
+    return runner.systemctl(action, *units, check=check, timeout=timeout)
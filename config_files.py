@@ -0,0 +1,214 @@
+"""
+Atomic, change-aware writer for system configuration files
+
+Renders the hostapd, wpa_supplicant, captive DNS and admin panel unit
+files and writes them only when their content actually changed. Writes go
+to a temp file in the target directory which is fsynced, given its mode and renamed over the
+original, so a power cut leaves either the old or the new file, never a
+half-written one. No sudo, mv or chmod processes are spawned; callers are
+expected to run as root already.
+
+write_config() reports whether the file changed and which service (if any)
+depends on it, so callers only restart or reload what needs it.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+HOSTAPD_CONF = '/etc/hostapd/hostapd.conf'
+WPA_SUPPLICANT_CONF = '/etc/wpa_supplicant/wpa_supplicant.conf'
+ADMIN_SERVICE_FILE = '/etc/systemd/system/pi-admin-panel.service'
+SYSTEMD_UNIT_DIR = '/etc/systemd/system'
+CAPTIVE_DNS_CONF = '/etc/dnsmasq.d/captive-portal.conf'
+KNOWN_NETWORKS_FILE = '/etc/wpa_supplicant/known_networks.json'
+
+# Service that has to be restarted to pick up a changed file
+DEPENDENT_SERVICES = {
+    HOSTAPD_CONF: 'hostapd',
+    WPA_SUPPLICANT_CONF: 'wpa_supplicant',
+    ADMIN_SERVICE_FILE: 'pi-admin-panel',
+    CAPTIVE_DNS_CONF: 'dnsmasq',
+}
+
+# path -> (mtime_ns, size, sha256) of the last file we read or wrote
+_known_hashes = {}
+_hash_lock = threading.Lock()
+
+def content_hash(content):
+    """SHA-256 of the file content (str or bytes)"""
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.sha256(content).hexdigest()
+
+def file_hash(path):
+    """SHA-256 of a file, reusing the cached value while its stat is unchanged"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    with _hash_lock:
+        known = _known_hashes.get(path)
+    if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        return known[2]
+    with open(path, 'rb') as f:
+        digest = content_hash(f.read())
+    with _hash_lock:
+        _known_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+def is_current(path, content):
+    """True if path already holds exactly content"""
+    return file_hash(path) == content_hash(content)
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_config(path, content, mode=0o644):
+    """Atomically replace path with content if it differs
+
+    Returns a dict:
+        changed        - True if the file content was written
+        restart        - dependent service to restart, or None if unchanged
+        daemon_reload  - True if a systemd unit file changed
+        hash           - SHA-256 of the new content
+    """
+    digest = content_hash(content)
+    result = {
+        'path': path,
+        'changed': False,
+        'restart': None,
+        'daemon_reload': False,
+        'hash': digest
+    }
+
+    if file_hash(path) == digest:
+        # Content is current; only repair the mode if needed
+        if os.stat(path).st_mode & 0o777 != mode:
+            os.chmod(path, mode)
+        return result
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fchmod(f.fileno(), mode)
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+    stat = os.stat(path)
+    with _hash_lock:
+        _known_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    result['changed'] = True
+    result['restart'] = DEPENDENT_SERVICES.get(path)
+    result['daemon_reload'] = os.path.dirname(path) == SYSTEMD_UNIT_DIR
+    return result
+
+def render_hostapd_config(interface, ssid, password, channel=7, country='US'):
+    """hostapd.conf for a WPA2-PSK access point (5 GHz for channels above 14)"""
+    hw_mode = 'a' if channel > 14 else 'g'
+    return f"""interface={interface}
+driver=nl80211
+ssid={ssid}
+hw_mode={hw_mode}
+channel={channel}
+wmm_enabled=0
+macaddr_acl=0
+auth_algs=1
+ignore_broadcast_ssid=0
+wpa=2
+wpa_passphrase={password}
+wpa_key_mgmt=WPA-PSK
+wpa_pairwise=TKIP
+rsn_pairwise=CCMP
+country_code={country}
+"""
+
+def _psk_value(ssid, psk):
+    """64 hex digit PSK, derived from a passphrase as wpa_passphrase does"""
+    if re.fullmatch(r'[0-9a-fA-F]{64}', psk):
+        return psk.lower()
+    return hashlib.pbkdf2_hmac('sha1', psk.encode(), ssid.encode(), 4096, 32).hex()
+
+def render_wpa_supplicant_networks(networks, country='US'):
+    """wpa_supplicant.conf with one WPA-PSK block per network dict (ssid, psk, priority)
+
+    SSIDs and PSKs are written as hex, so no quote, newline or other
+    character in a saved network can break the file or add directives.
+    """
+    blocks = [f'''
+network={{
+    ssid={network['ssid'].encode().hex()}
+    psk={_psk_value(network['ssid'], network['psk'])}
+    key_mgmt=WPA-PSK
+    priority={int(network.get('priority', 0))}
+}}''' for network in networks]
+    return f'''
+country={country}
+ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev
+update_config=1
+''' + ''.join(blocks) + '\n'
+
+def parse_wpa_supplicant_networks(content):
+    """ssid/psk dicts for the PSK network blocks in a wpa_supplicant.conf"""
+    networks = []
+    for block in re.findall(r'network=\{(.*?)\}', content, re.S):
+        ssid = re.search(r'^\s*ssid=(?:"(.*)"|((?:[0-9a-fA-F]{2})+))\s*$', block, re.M)
+        psk = re.search(r'^\s*psk=(?:"(.*)"|([0-9a-fA-F]{64}))\s*$', block, re.M)
+        if ssid and psk:
+            name = ssid.group(1)
+            if name is None:
+                name = bytes.fromhex(ssid.group(2)).decode(errors='replace')
+            networks.append({'ssid': name, 'psk': psk.group(1) or psk.group(2)})
+    return networks
+
+def render_captive_dns_config(interface, address):
+    """dnsmasq drop-in resolving every name to the portal on the AP interface"""
+    return f"""# Written by access_point.py while the setup access point is up
+interface={interface}
+bind-dynamic
+address=/#/{address}
+"""
+
+def remove_config(path):
+    """Delete a generated file; returns True if it existed"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    with _hash_lock:
+        _known_hashes.pop(path, None)
+    _fsync_dir(os.path.dirname(path) or '.')
+    return True
+
+def render_admin_service(admin_server_path, admin_dir):
+    """systemd unit running the admin panel"""
+    return f'''[Unit]
+Description=Pi Admin Panel
+After=network.target
+
+[Service]
+ExecStart=/usr/bin/python3 {admin_server_path}
+WorkingDirectory={admin_dir}
+User=root
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+'''
@@ -0,0 +1,417 @@
+"""
+Internet connectivity probes against several targets at once
+
+Deciding "internet is up" by forking `ping -c 1 -W 2 8.8.8.8` blocks for
+two seconds when offline and always fails on networks that drop ICMP.
+Instead run_probes() starts every configured probe at once on
+non-blocking sockets driven by one selector, and returns as soon as one
+succeeds:
+
+    icmp://8.8.8.8                  echo request on a raw socket (or an
+                                    unprivileged ICMP datagram socket)
+    tcp://1.1.1.1:443               TCP connect
+    dns://8.8.8.8/example.com       A query sent to that server
+    http://host/generate_204        GET answered with 204; anything else
+                                    (a captive portal's login page) fails
+
+Host names in icmp, tcp and http targets are resolved with a DNS query to
+the system resolver as part of the probe.
+
+CONNECTIVITY_TARGETS overrides DEFAULT_TARGETS (comma separated).
+
+ConnectivityChecker caches the outcome: an online result for ONLINE_TTL
+seconds, an offline one for a delay that doubles from OFFLINE_BACKOFF up
+to MAX_BACKOFF while the checks keep failing, so callers polling an
+offline network do not probe on every call. Concurrent callers share one
+probe run. check(fresh=True) bypasses the cache, for flows that just
+changed the network.
+
+Stand-in servers for testing without the internet and a FakeProbe for
+simulations are in benchmarks/fakes.py.
+"""
+
+import errno
+import ipaddress
+import itertools
+import logging
+import os
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+PROBE_TIMEOUT = 2  # Seconds for one run of all probes
+ONLINE_TTL = 10  # Seconds an online result is reused
+OFFLINE_BACKOFF = 1  # Seconds an offline result is reused, doubling per failed run
+MAX_BACKOFF = 60
+DNS_NAME = 'connectivitycheck.gstatic.com'  # Resolved by dns:// targets without a path
+FALLBACK_RESOLVER = '8.8.8.8'
+RESOLV_CONF = '/etc/resolv.conf'
+
+DEFAULT_TARGETS = (
+    'icmp://8.8.8.8',
+    'icmp://1.1.1.1',
+    'tcp://8.8.8.8:53',
+    'tcp://1.1.1.1:443',
+    'dns://8.8.8.8',
+    'dns://1.1.1.1',
+    'http://connectivitycheck.gstatic.com/generate_204',
+)
+DEFAULT_PORTS = {'icmp': 0, 'tcp': None, 'dns': 53, 'http': 80}
+
+logger = logging.getLogger('connectivity')
+
+class ProbeError(Exception):
+    """A probe got an answer, but not the one that means 'online'"""
+
+def parse_target(spec):
+    """'tcp://1.1.1.1:443' -> {'spec', 'kind', 'host', 'port', 'path'}"""
+    parts = urlsplit(spec.strip())
+    if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+        raise ValueError(f"Invalid connectivity target: {spec}")
+    port = parts.port or DEFAULT_PORTS[parts.scheme]
+    if port is None:
+        raise ValueError(f"Connectivity target needs a port: {spec}")
+    path = parts.path or '/'
+    if parts.scheme == 'dns':
+        path = parts.path.strip('/') or DNS_NAME
+    elif parts.query:
+        path += '?' + parts.query
+    return {'spec': spec.strip(), 'kind': parts.scheme, 'host': parts.hostname,
+            'port': port, 'path': path}
+
+def parse_targets(specs):
+    """Targets from a comma separated string or a list of specs"""
+    if isinstance(specs, str):
+        specs = specs.split(',')
+    return [parse_target(spec) for spec in specs if spec.strip()]
+
+def system_resolver(path=RESOLV_CONF):
+    """First nameserver in resolv.conf (it changes with each DHCP lease)"""
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    return fields[1]
+    except OSError:
+        pass
+    return FALLBACK_RESOLVER
+
+def _family(host):
+    return socket.AF_INET6 if ipaddress.ip_address(host).version == 6 else socket.AF_INET
+
+def _is_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+_sequence = itertools.count(1)
+
+# Each probe is a generator that yields (socket, selector events) to wait
+# for, returns on success and raises OSError or ProbeError on failure.
+# run_probes() closes the ones still waiting when it is done.
+
+def _connect(host, port):
+    sock = socket.socket(_family(host), socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        error = sock.connect_ex((host, port))
+        if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            yield sock, selectors.EVENT_WRITE
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            raise OSError(error, os.strerror(error))
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+def _dns_query(name, query_id):
+    labels = b''.join(bytes([len(label)]) + label.encode('idna')
+                      for label in name.rstrip('.').split('.'))
+    # Recursion desired, one question: type A, class IN
+    return struct.pack('!6H', query_id, 0x0100, 1, 0, 0, 0) + labels + b'\0' + \
+        struct.pack('!2H', 1, 1)
+
+def skip_dns_name(data, offset):
+    """Offset just past the (possibly compressed) DNS name at offset"""
+    while True:
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            return offset + 2
+        offset += length + 1
+        if length == 0:
+            return offset
+
+def _dns_addresses(data):
+    """(query id, rcode, IPv4 addresses) from a DNS response"""
+    query_id, flags, questions, answers = struct.unpack('!4H', data[:8])
+    offset = 12
+    for _ in range(questions):
+        offset = skip_dns_name(data, offset) + 4
+    addresses = []
+    for _ in range(answers):
+        offset = skip_dns_name(data, offset)
+        kind, _, _, length = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        if kind == 1 and length == 4:
+            addresses.append(socket.inet_ntoa(data[offset:offset + 4]))
+        offset += length
+    return query_id, flags & 0x000f, addresses
+
+def _address(host, resolver):
+    """host itself if it is an address, else its first A record from resolver"""
+    if _is_address(host):
+        return host
+    server, port = resolver if isinstance(resolver, tuple) else (resolver, 53)
+    addresses = yield from _resolve(host, server, port)
+    return addresses[0]
+
+def _resolve(name, server, port=53):
+    sock = socket.socket(_family(server), socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        query_id = random.getrandbits(16)
+        sock.sendto(_dns_query(name, query_id), (server, port))
+        while True:
+            yield sock, selectors.EVENT_READ
+            data = sock.recv(4096)
+            try:
+                answer_id, rcode, addresses = _dns_addresses(data)
+            except (struct.error, IndexError):
+                continue
+            if answer_id != query_id:
+                continue
+            if rcode:
+                raise ProbeError(f"DNS error code {rcode} for {name}")
+            if not addresses:
+                raise ProbeError(f"No address for {name}")
+            return addresses
+    finally:
+        sock.close()
+
+def probe_icmp(target, resolver):
+    """Echo request; raw sockets need root, ICMP datagram sockets need ping_group_range"""
+    host = yield from _address(target['host'], resolver)
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        raw = True
+    except PermissionError:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        raw = False
+    try:
+        sock.setblocking(False)
+        ident, sequence = os.getpid() & 0xffff, next(_sequence) & 0xffff
+        header = struct.pack('!BBHHH', 8, 0, 0, ident, sequence)
+        payload = b'piap-connectivity'
+        checksum = _checksum(header + payload)
+        sock.sendto(struct.pack('!BBHHH', 8, 0, checksum, ident, sequence) + payload,
+                    (host, 0))
+        while True:
+            yield sock, selectors.EVENT_READ
+            data, address = sock.recvfrom(1024)
+            if raw:
+                data = data[(data[0] & 0x0f) * 4:]  # Skip the IP header
+            if address[0] != host or len(data) < 8:
+                continue
+            kind, _, _, _, reply_sequence = struct.unpack('!BBHHH', data[:8])
+            # Datagram sockets get the kernel's identifier, so match on sequence
+            if kind == 0 and reply_sequence == sequence:
+                return
+    finally:
+        sock.close()
+
+def probe_tcp(target, resolver):
+    address = yield from _address(target['host'], resolver)
+    sock = yield from _connect(address, target['port'])
+    sock.close()
+
+def probe_dns(target, resolver):
+    yield from _resolve(target['path'], target['host'], target['port'])
+
+def probe_http(target, resolver):
+    host = target['host']
+    address = yield from _address(host, resolver)
+    sock = yield from _connect(address, target['port'])
+    try:
+        host_header = host if target['port'] == 80 else f"{host}:{target['port']}"
+        request = (f"GET {target['path']} HTTP/1.1\r\nHost: {host_header}\r\n"
+                   f"User-Agent: piap-connectivity\r\nConnection: close\r\n\r\n").encode()
+        while request:
+            yield sock, selectors.EVENT_WRITE
+            request = request[sock.send(request):]
+        response = b''
+        while b'\r\n' not in response:
+            yield sock, selectors.EVENT_READ
+            chunk = sock.recv(1024)
+            if not chunk or len(response) > 4096:
+                raise ProbeError("No HTTP status line")
+            response += chunk
+        status = response.split(b'\r\n', 1)[0].split()
+        if len(status) < 2 or status[1] != b'204':
+            raise ProbeError(f"HTTP status {status[1].decode() if len(status) > 1 else '?'}"
+                             " instead of 204")
+    finally:
+        sock.close()
+
+PROBES = {
+    'icmp': probe_icmp,
+    'tcp': probe_tcp,
+    'dns': probe_dns,
+    'http': probe_http,
+}
+
+def probe_result(probes, started, winner=None):
+    """Result dict from probe records ({target, ok, latency_ms, error})"""
+    return {
+        'online': winner is not None,
+        'target': winner['target'] if winner else None,
+        'latency_ms': winner['latency_ms'] if winner else None,
+        'duration_ms': round((time.monotonic() - started) * 1000, 2),
+        'checked_at': round(time.time(), 3),
+        'probes': probes
+    }
+
+def run_probes(targets, timeout=PROBE_TIMEOUT, resolver=None):
+    """Probe every target at once; return at the first success or the timeout
+
+    Returns {online, target, latency_ms, duration_ms, checked_at, probes},
+    where probes lists the targets that finished (all of them when
+    offline) with their latency or error.
+    """
+    resolver = resolver or system_resolver()
+    started = time.monotonic()
+    deadline = started + timeout
+    selector = selectors.DefaultSelector()
+    records = []
+    winner = None
+
+    def advance(probe, target):
+        nonlocal winner
+        record = {'target': target['spec'], 'ok': False,
+                  'latency_ms': round((time.monotonic() - started) * 1000, 2), 'error': None}
+        try:
+            sock, events = next(probe)
+        except StopIteration:
+            record['ok'] = True
+            records.append(record)
+            if winner is None:
+                winner = record
+            return
+        except (OSError, ProbeError, ValueError) as e:
+            record['error'] = str(e)
+            records.append(record)
+            return
+        selector.register(sock, events, (probe, target))
+
+    try:
+        for target in targets:
+            advance(PROBES[target['kind']](target, resolver), target)
+        while winner is None and selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                selector.unregister(key.fileobj)
+                advance(*key.data)
+                if winner is not None:
+                    break
+    finally:
+        for key in list(selector.get_map().values()):
+            selector.unregister(key.fileobj)
+            probe, target = key.data
+            probe.close()
+            if winner is None:
+                records.append({'target': target['spec'], 'ok': False,
+                                'latency_ms': None, 'error': 'Timed out'})
+        selector.close()
+    return probe_result(records, started, winner)
+
+class ConnectivityChecker:
+    """Cached connectivity checks with exponential backoff while offline"""
+
+    def __init__(self, targets=None, timeout=PROBE_TIMEOUT, resolver=None, ttl=ONLINE_TTL,
+                 backoff=OFFLINE_BACKOFF, max_backoff=MAX_BACKOFF, probe=run_probes,
+                 clock=time.monotonic):
+        self.targets = parse_targets(targets if targets is not None else DEFAULT_TARGETS)
+        self.timeout = timeout
+        self.resolver = resolver
+        self.ttl = ttl
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.probe = probe
+        self.clock = clock
+        self.runs = 0
+        self._delay = backoff
+        self._cached = None  # (result, checked, expires)
+        self._lock = threading.Lock()
+
+    def _from_cache(self):
+        cached = self._cached
+        if cached is None:
+            return None
+        result, checked, expires = cached
+        now = self.clock()
+        if now >= expires:
+            return None
+        return dict(result, cached=True, age=round(now - checked, 3))
+
+    def check(self, fresh=False):
+        """Latest result ({online, target, latency_ms, ...} plus cached and age)"""
+        if not fresh:
+            result = self._from_cache()
+            if result is not None:
+                return result
+        with self._lock:
+            # Another caller may have probed while this one waited
+            if not fresh:
+                result = self._from_cache()
+                if result is not None:
+                    return result
+            try:
+                result = self.probe(self.targets, self.timeout, self.resolver)
+            except Exception as e:
+                logger.error(f"Connectivity probe failed: {str(e)}")
+                result = probe_result([], self.clock())
+            now = self.clock()
+            self.runs += 1
+            if result['online']:
+                self._delay = self.backoff
+                expires = now + self.ttl
+            else:
+                expires = now + self._delay
+                self._delay = min(self._delay * 2, self.max_backoff)
+            previous = self._cached[0]['online'] if self._cached else None
+            if previous != result['online']:
+                logger.info(f"Internet {'reachable' if result['online'] else 'unreachable'}",
+                            extra={'target': result['target'],
+                                   'latency_ms': result['latency_ms']})
+            self._cached = (result, now, expires)
+            return dict(result, cached=False, age=0.0)
+
+    def invalidate(self):
+        """Forget the cached result and the backoff, e.g. after a network change"""
+        with self._lock:
+            self._cached = None
+            self._delay = self.backoff
+
+# Shared by every module in the process
+checker = ConnectivityChecker(os.environ.get('CONNECTIVITY_TARGETS') or None)
+
+def internet_reachable(fresh=False):
+    """True if a probe target answered (cached, see ConnectivityChecker)"""
+    return checker.check(fresh)['online']
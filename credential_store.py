@@ -0,0 +1,184 @@
+"""
+Persistent store of known WiFi networks
+
+Every network the portal connects to is remembered with its passphrase,
+a user priority, the last time it connected and how often it failed in a
+row. render_config() turns the store into a multi-network
+wpa_supplicant.conf whose priority= values follow our ranking, and
+select_best() combines that history with scan results so the Pi can
+rejoin the best known network in range by itself instead of needing the
+access point flow after every move.
+
+Records:
+    {'ssid', 'psk', 'priority', 'added', 'last_success', 'failures'}
+
+The store file holds passphrases and is written atomically with mode 0600
+through config_files.write_config().
+"""
+
+import json
+import os
+import threading
+import time
+
+import config_files
+import wifi_scan
+
+MAX_COUNTED_FAILURES = 3  # Failures beyond this do not lower the rank further
+FAILURE_PENALTY = 10
+PRIORITY_WEIGHT = 20
+RECENT_SUCCESS_DAYS = 15  # A success is worth up to this many points, less one per day
+SIGNAL_FLOOR = -90  # dBm treated as unusable
+
+def history_score(record, now=None):
+    """Rank from priority, recent success and failures (higher is better)"""
+    now = time.time() if now is None else now
+    score = record.get('priority', 0) * PRIORITY_WEIGHT
+    if record.get('last_success'):
+        age_days = (now - record['last_success']) / 86400
+        score += max(0, RECENT_SUCCESS_DAYS - age_days)
+    score -= FAILURE_PENALTY * min(record.get('failures', 0), MAX_COUNTED_FAILURES)
+    return score
+
+def signal_score(signal_dbm):
+    """Points for signal strength: 0 at SIGNAL_FLOOR, about 30 at -30 dBm"""
+    if signal_dbm is None:
+        return 0
+    return max(0, signal_dbm - SIGNAL_FLOOR) / 2
+
+def rank(records, scan_results=None, now=None):
+    """Order records best first: visible networks by signal and history, then the rest"""
+    visible = {}
+    if scan_results:
+        visible = {bss['ssid']: bss for bss in wifi_scan.best_by_ssid(scan_results)}
+
+    def key(record):
+        bss = visible.get(record['ssid'])
+        score = history_score(record, now)
+        if bss is not None:
+            score += signal_score(bss['signal_dbm'])
+        return (bss is not None, score, record.get('last_success') or 0)
+
+    return sorted(records, key=key, reverse=True)
+
+def select_best(records, scan_results, now=None):
+    """Best known network present in the scan as (record, bss), or None"""
+    visible = {bss['ssid']: bss for bss in wifi_scan.best_by_ssid(scan_results)}
+    candidates = [record for record in records if record['ssid'] in visible]
+    if not candidates:
+        return None
+    best = rank(candidates, scan_results, now)[0]
+    return best, visible[best['ssid']]
+
+class CredentialStore:
+    """Known networks persisted as JSON"""
+
+    def __init__(self, path=config_files.KNOWN_NETWORKS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = None
+
+    def _load(self):
+        if self._records is None:
+            try:
+                with open(self.path) as f:
+                    self._records = {r['ssid']: r for r in json.load(f).get('networks', [])}
+            except FileNotFoundError:
+                self._records = {}
+        return self._records
+
+    def _save(self):
+        data = {'networks': sorted(self._records.values(), key=lambda r: r['ssid'])}
+        config_files.write_config(self.path, json.dumps(data, indent=2, sort_keys=True) + '\n',
+                                  mode=0o600)
+
+    def networks(self):
+        """All records (copies), unordered"""
+        with self._lock:
+            return [dict(record) for record in self._load().values()]
+
+    def get(self, ssid):
+        with self._lock:
+            record = self._load().get(ssid)
+            return dict(record) if record else None
+
+    def add(self, ssid, psk, priority=None):
+        """Remember a network, returning the record it replaced (or None)"""
+        with self._lock:
+            records = self._load()
+            previous = records.get(ssid)
+            record = {
+                'ssid': ssid,
+                'psk': psk,
+                'priority': priority if priority is not None else (previous or {}).get('priority', 0),
+                'added': time.time(),
+                'last_success': None,
+                'failures': 0
+            }
+            if previous and previous['psk'] == psk:
+                record['added'] = previous['added']
+                record['last_success'] = previous['last_success']
+            records[ssid] = record
+            self._save()
+            return dict(previous) if previous else None
+
+    def restore(self, ssid, previous):
+        """Put back the record add() replaced, or forget ssid if there was none"""
+        with self._lock:
+            records = self._load()
+            if previous:
+                records[ssid] = dict(previous)
+            else:
+                records.pop(ssid, None)
+            self._save()
+
+    def remove(self, ssid):
+        with self._lock:
+            if self._load().pop(ssid, None) is not None:
+                self._save()
+
+    def record_success(self, ssid, now=None):
+        with self._lock:
+            record = self._load().get(ssid)
+            if record:
+                record['last_success'] = time.time() if now is None else now
+                record['failures'] = 0
+                self._save()
+
+    def record_failure(self, ssid):
+        with self._lock:
+            record = self._load().get(ssid)
+            if record:
+                record['failures'] = record.get('failures', 0) + 1
+                self._save()
+
+    def render_config(self, scan_results=None, first=None, country='US'):
+        """wpa_supplicant.conf with every known network, best ranked highest
+
+        first forces one SSID to the top (the network the user just chose).
+        """
+        ranked = rank(self.networks(), scan_results)
+        if first is not None:
+            ranked.sort(key=lambda record: record['ssid'] != first)
+        networks = [dict(record, priority=len(ranked) - index)
+                    for index, record in enumerate(ranked)]
+        return config_files.render_wpa_supplicant_networks(networks, country)
+
+    def write_config(self, scan_results=None, first=None, country='US'):
+        """Write the rendered config; returns config_files.write_config()'s result"""
+        return config_files.write_config(config_files.WPA_SUPPLICANT_CONF,
+                                         self.render_config(scan_results, first, country),
+                                         mode=0o600)
+
+# Shared store for the portal and the access point daemon
+known_networks = CredentialStore()
+
+def import_existing(store, path=config_files.WPA_SUPPLICANT_CONF):
+    """Seed an empty store from network blocks in an existing wpa_supplicant.conf"""
+    if store.networks() or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        networks = config_files.parse_wpa_supplicant_networks(f.read())
+    for network in networks:
+        store.add(network['ssid'], network['psk'])
+    return len(networks)
@@ -19,6 +19,14 @@ import os
 import sys
 import shutil
 
+import command_runner
+import connectivity
+
+def error_detail(e):
+    """str(e), plus the captured stderr of a failed command"""
+    stderr = getattr(e, 'stderr', None)
+    return f"{str(e)}\n  {stderr.strip()}" if stderr and stderr.strip() else str(e)
+
 def check_root():
     """Check if script is running with root privileges"""
     if os.geteuid() != 0:
@@ -29,7 +37,7 @@ def check_environment():
     """Check if system is running headless or with desktop"""
     try:
         # Check if X server is running
-        result = subprocess.run(['pidof', 'X'], capture_output=True)
+        result = command_runner.run(['pidof', 'X'])
         has_display = result.returncode == 0
         
         if has_display:
@@ -67,26 +75,27 @@ def install_packages():
     
     try:
         print("Testing internet connectivity...")
-        test = subprocess.run(['ping', '-c', '1', '8.8.8.8'], capture_output=True)
-        if test.returncode != 0:
+        if not connectivity.internet_reachable(fresh=True):
             print("Error: No internet connection detected")
             print("Please ensure you have a working internet connection")
             return False
 
         print("Updating package lists...")
-        subprocess.run(['apt-get', 'update'], check=True)
+        # apt-get output goes straight to the terminal so progress and errors show
+        command_runner.run(['apt-get', 'update'], check=True, capture=False)
         
         # Install main packages
         print("\nInstalling main packages...")
         for package in required_packages:
             print(f"Installing {package}...")
-            subprocess.run(['apt-get', 'install', '-y', package], check=True)
+            command_runner.run(['apt-get', 'install', '-y', package], check=True, capture=False)
         
         # Check and handle GPIO package
         if not check_gpio_package():
             print("\nRPI.GPIO not found, attempting to install...")
             try:
-                subprocess.run(['apt-get', 'install', '-y', 'python3-rpi.gpio'], check=True)
+                command_runner.run(['apt-get', 'install', '-y', 'python3-rpi.gpio'], check=True,
+                                   capture=False)
                 print("Successfully installed RPI.GPIO")
             except subprocess.CalledProcessError as e:
                 print(f"Warning: Could not install RPI.GPIO: {str(e)}")
@@ -132,6 +141,27 @@ def verify_files():
         required_files = [
             'access_point.py',
             'web_config.py',
+            'network_state.py',
+            'button.py',
+            'orchestrator.py',
+            'wifi_scan.py',
+            'wpa_ctrl.py',
+            'app_logging.py',
+            'config_files.py',
+            'web_host.py',
+            'startup_profile.py',
+            'async_server.py',
+            'captive_portal.py',
+            'static_assets.py',
+            'credential_store.py',
+            'watchdog.py',
+            'virtual_ap.py',
+            'wifi_state.py',
+            'metrics_history.py',
+            'command_runner.py',
+            'systemd_dbus.py',
+            'metrics_export.py',
+            'connectivity.py',
             'admin/admin_server.py',
             'templates/config.html',
             'admin/templates/admin.html'
@@ -193,7 +223,7 @@ def set_permissions():
         for directory in directories:
             if os.path.exists(directory):
                 # 755 = User:rwx Group:r-x Others:r-x
-                subprocess.run(['sudo', 'chmod', '755', directory], check=True)
+                command_runner.run(['sudo', 'chmod', '755', directory], check=True)
                 print(f"Set permissions for {directory}")
                 
         # Ensure Python files are executable
@@ -206,19 +236,20 @@ def set_permissions():
         for file in python_files:
             if os.path.exists(file):
                 # 755 = User:rwx Group:r-x Others:r-x
-                subprocess.run(['sudo', 'chmod', '755', file], check=True)
+                command_runner.run(['sudo', 'chmod', '755', file], check=True)
                 print(f"Set permissions for {file}")
                 
         # Set ownership to current user for all files
         current_user = os.environ.get('SUDO_USER', os.environ.get('USER'))
         if current_user:
-            subprocess.run(['sudo', 'chown', '-R', f'{current_user}:{current_user}', '.'], check=True)
+            command_runner.run(['sudo', 'chown', '-R', f'{current_user}:{current_user}', '.'],
+                               check=True)
             print(f"Set ownership to {current_user}")
             
         return True
         
     except Exception as e:
-        print(f"Error setting permissions: {str(e)}")
+        print(f"Error setting permissions: {error_detail(e)}")
         return False
 
 def create_log_directory():
@@ -226,10 +257,10 @@ def create_log_directory():
     try:
         if not os.path.exists('logs'):
             os.makedirs('logs')
-        subprocess.run(['sudo', 'chmod', '777', 'logs'], check=True)
+        command_runner.run(['sudo', 'chmod', '777', 'logs'], check=True)
         return True
     except Exception as e:
-        print(f"Error creating log directory: {str(e)}")
+        print(f"Error creating log directory: {error_detail(e)}")
         return False
 
 def main():
@@ -0,0 +1,179 @@
+"""
+Prometheus / OpenMetrics text exposition from a pre-rendered buffer
+
+Each metric family keeps its sample lines as rendered text. A change to
+a value re-renders only that family, and only if the value actually
+changed. The scrape body is joined from the family texts at most once
+per change and cached together with its gzip variant, so repeated
+scrapes of unchanged metrics cost a dict lookup.
+
+    exporter = MetricsExporter()
+    exporter.gauge('piap_cpu_usage_percent', "CPU usage")
+    exporter.set('piap_cpu_usage_percent', 12.5)
+    asset = exporter.asset(openmetrics=False)  # static_assets-style asset
+
+Families are gauges, counters (set to an absolute total or incremented)
+and histograms (observed one value at a time, or set from cumulative
+bucket counts kept elsewhere). A value of None removes the sample.
+"""
+
+import gzip
+import hashlib
+import math
+import threading
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+GZIP_LEVEL = 6
+MIN_COMPRESS_SIZE = 256
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class MetricFamily:
+    """One metric name with its samples, one per label value tuple"""
+
+    def __init__(self, name, kind, help_text, labels=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+        # Counters are named foo_total in both formats; OpenMetrics declares them as foo
+        base = name[:-len('_total')] if kind == 'counter' and name.endswith('_total') else name
+        self.headers = {
+            False: f'# HELP {name} {help_text}\n# TYPE {name} {kind}\n',
+            True: f'# HELP {base} {help_text}\n# TYPE {base} {kind}\n',
+        }
+        self.samples = {}
+        self.text = ''
+
+    def render(self):
+        lines = []
+        for values, sample in self.samples.items():
+            if self.kind != 'histogram':
+                lines.append(f'{self.name}{_labels(self.labels, values)} {format_value(sample)}')
+                continue
+            counts, total, count = sample
+            for bound, cumulative in zip(self.buckets + (math.inf,), counts):
+                le = 'le="' + format_value(float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {format_value(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {count}')
+        self.text = ''.join(f'{line}\n' for line in lines)
+
+class MetricsExporter:
+    """Registered metric families and the cached exposition body"""
+
+    def __init__(self):
+        self.families = {}
+        self.version = 0
+        self._lock = threading.Lock()
+        self._assets = {}  # openmetrics flag -> (version, asset)
+
+    def _register(self, name, kind, help_text, labels, buckets=None):
+        with self._lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = MetricFamily(name, kind, help_text, labels,
+                                                            buckets)
+            return family
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(name, 'gauge', help_text, labels)
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(name, 'counter', help_text, labels)
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        return self._register(name, 'histogram', help_text, labels, sorted(buckets))
+
+    def _store(self, family, labels, sample):
+        """Set one sample (None removes it); re-render only on a change"""
+        labels = tuple(labels)
+        if sample is None:
+            if labels not in family.samples:
+                return
+            del family.samples[labels]
+        else:
+            if labels in family.samples and family.samples[labels] == sample:
+                return
+            family.samples[labels] = sample
+        family.render()
+        self.version += 1
+
+    def set(self, name, value, labels=()):
+        """Set a gauge, or a counter to a total tracked elsewhere"""
+        with self._lock:
+            self._store(self.families[name], labels, value)
+
+    def update(self, values):
+        """Set several unlabelled gauges from {name: value}"""
+        with self._lock:
+            for name, value in values.items():
+                self._store(self.families[name], (), value)
+
+    def inc(self, name, amount=1, labels=()):
+        with self._lock:
+            family = self.families[name]
+            self._store(family, labels, family.samples.get(tuple(labels), 0) + amount)
+
+    def observe(self, name, value, labels=()):
+        """Add one observation to a histogram"""
+        with self._lock:
+            family = self.families[name]
+            counts, total, count = family.samples.get(
+                tuple(labels), ((0,) * (len(family.buckets) + 1), 0.0, 0))
+            counts = tuple(cumulative + (value <= bound) for bound, cumulative in
+                           zip(family.buckets + (math.inf,), counts))
+            self._store(family, labels, (counts, total + value, count + 1))
+
+    def set_histogram(self, name, counts, total, count, labels=()):
+        """Set a histogram from cumulative bucket counts (one per bucket, plus +Inf)"""
+        with self._lock:
+            self._store(self.families[name], labels, (tuple(counts), total, count))
+
+    def render(self, openmetrics=False):
+        """The exposition text as bytes"""
+        with self._lock:
+            parts = [family.headers[openmetrics] + family.text
+                     for family in self.families.values() if family.samples]
+        if openmetrics:
+            parts.append('# EOF\n')
+        return ''.join(parts).encode()
+
+    def asset(self, openmetrics=False):
+        """Body, gzip variant and ETags in the static_assets layout, cached per version"""
+        version = self.version
+        cached = self._assets.get(openmetrics)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        body = self.render(openmetrics)
+        tag = hashlib.sha256(body).hexdigest()[:20]
+        variants = {'identity': (body, f'"{tag}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            variants['gzip'] = (gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+                                f'"{tag}-gz"')
+        asset = {
+            'content_type': OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE,
+            'cache_control': 'no-cache',
+            'variants': variants
+        }
+        self._assets[openmetrics] = (version, asset)
+        return asset
@@ -0,0 +1,173 @@
+"""
+In-process time series of admin panel metrics in fixed-size ring buffers
+
+Each metric is kept at two resolutions:
+
+    fine    1 s slots x 600    (last 10 minutes), latest value per slot
+    coarse  60 s slots x 1440  (last 24 hours), min/max/avg per slot
+
+Both tiers are array.array('f') buffers, allocated once, indexed by
+slot number modulo their size. Slots with no sample hold NaN, and a gap
+in the samples fills the skipped slots with NaN, so old values never
+show up as new. The coarse tier accumulates the current minute in
+scalars and writes it when the minute ends.
+
+Slots are numbered on the monotonic clock, so an NTP step never hides
+or reorders samples; query() converts slot times to wall clock time
+only for its output.
+
+Memory per metric is fixed: the fine tier takes 600 x 4 B = 2.4 KB and
+the coarse tier 1440 x 3 x 4 B = 17.3 KB, about 20 KB in all. The
+admin panel's six metrics take about 120 KB whatever the uptime.
+"""
+
+import array
+import math
+import threading
+import time
+
+FINE_RESOLUTION = 1
+FINE_SLOTS = 600
+COARSE_RESOLUTION = 60
+COARSE_SLOTS = 1440
+MAX_RANGE = COARSE_RESOLUTION * COARSE_SLOTS  # Seconds of history kept
+
+NAN = float('nan')
+
+class RingSeries:
+    """One metric at one resolution: min/max/avg buffers (or just values)"""
+
+    def __init__(self, resolution, slots, aggregate):
+        self.resolution = resolution
+        self.slots = slots
+        self.aggregate = aggregate
+        fields = ('min', 'max', 'avg') if aggregate else ('value',)
+        self.buffers = {name: array.array('f', [NAN]) * slots for name in fields}
+        self.head = None  # Slot number of the newest written position
+        # Running aggregate of the head slot (coarse tier only)
+        self._min = self._max = self._sum = 0.0
+        self._count = 0
+
+    def _advance(self, slot):
+        """Move the head to slot, clearing every position skipped on the way"""
+        if self.head is not None and slot <= self.head:
+            return
+        start = slot - self.slots + 1 if self.head is None else max(self.head + 1,
+                                                                    slot - self.slots + 1)
+        for skipped in range(start, slot + 1):
+            for buffer in self.buffers.values():
+                buffer[skipped % self.slots] = NAN
+        self.head = slot
+        self._count = 0
+
+    def add(self, timestamp, value):
+        slot = int(timestamp // self.resolution)
+        if self.head is not None and slot < self.head:
+            return  # Older than the newest slot; dropped
+        self._advance(slot)
+        position = slot % self.slots
+        if not self.aggregate:
+            self.buffers['value'][position] = value
+            return
+        if self._count == 0:
+            self._min = self._max = self._sum = value
+        else:
+            self._min = min(self._min, value)
+            self._max = max(self._max, value)
+            self._sum += value
+        self._count += 1
+        self.buffers['min'][position] = self._min
+        self.buffers['max'][position] = self._max
+        self.buffers['avg'][position] = self._sum / self._count
+
+    def points(self, start, end, offset=0.0):
+        """Non-empty slots between start and end as [slot_time + offset, value...] lists"""
+        if self.head is None:
+            return []
+        first = max(int(start // self.resolution), self.head - self.slots + 1)
+        last = min(int(end // self.resolution), self.head)
+        names = list(self.buffers)
+        points = []
+        for slot in range(first, last + 1):
+            position = slot % self.slots
+            values = [self.buffers[name][position] for name in names]
+            if math.isnan(values[0]):
+                continue
+            points.append([round(slot * self.resolution + offset, 3)] +
+                          [round(v, 3) for v in values])
+        return points
+
+    @property
+    def nbytes(self):
+        return sum(buffer.itemsize * len(buffer) for buffer in self.buffers.values())
+
+class MetricsHistory:
+    """Fine and coarse ring buffers for a fixed set of metrics"""
+
+    def __init__(self, metrics, fine=(FINE_RESOLUTION, FINE_SLOTS),
+                 coarse=(COARSE_RESOLUTION, COARSE_SLOTS)):
+        self.metrics = tuple(metrics)
+        self._lock = threading.Lock()
+        self._series = {
+            metric: (RingSeries(fine[0], fine[1], aggregate=False),
+                     RingSeries(coarse[0], coarse[1], aggregate=True))
+            for metric in self.metrics
+        }
+
+    def record(self, metric, value, timestamp=None):
+        """Add a sample at a time.monotonic() timestamp (default now)
+
+        None and unknown metrics are ignored.
+        """
+        series = self._series.get(metric)
+        if series is None or value is None:
+            return
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            for ring in series:
+                ring.add(timestamp, float(value))
+
+    def query(self, metric, seconds, now=None):
+        """Samples of the last seconds from the finest tier that covers them
+
+        now is a time.monotonic() value (default now). Returns {'metric',
+        'resolution', 'range', 'fields', 'points'} with point times in wall
+        clock seconds; raises KeyError for an unknown metric.
+        """
+        fine, coarse = self._series[metric]
+        now = time.monotonic() if now is None else now
+        offset = time.time() - time.monotonic()
+        ring = fine if seconds <= fine.resolution * fine.slots else coarse
+        with self._lock:
+            points = ring.points(now - seconds, now, offset)
+        return {
+            'metric': metric,
+            'resolution': ring.resolution,
+            'range': seconds,
+            'fields': ['time'] + list(ring.buffers),
+            'points': points
+        }
+
+    def memory_usage(self):
+        """Bytes held by the ring buffers of each metric (fixed at creation)"""
+        return {metric: sum(ring.nbytes for ring in series)
+                for metric, series in self._series.items()}
+
+def parse_range(text, default=FINE_RESOLUTION * FINE_SLOTS, maximum=MAX_RANGE):
+    """Seconds from '600', '90s', '10m' or '24h', at most maximum
+
+    Raises ValueError if malformed, not positive or not finite.
+    """
+    text = (text or '').strip().lower()
+    if not text:
+        return default
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    multiplier = units.get(text[-1])
+    number = text[:-1] if multiplier else text
+    value = float(number) * (multiplier or 1)
+    if not math.isfinite(value):
+        raise ValueError(f"Range must be finite: {text}")
+    seconds = int(value)
+    if seconds <= 0:
+        raise ValueError(f"Range must be positive: {text}")
+    return min(seconds, maximum)
@@ -0,0 +1,384 @@
+"""
+In-process network state reader for the Raspberry Pi WiFi configuration system
+
+Reads interface link state, addresses and wireless details straight from the
+kernel instead of forking iwconfig, ip or iwgetid:
+- /sys/class/net/<iface>/...  operstate, carrier, MAC, ifindex, byte counters
+- /proc/net/wireless          link quality, signal and noise levels
+- wireless extension ioctls   SSID, bitrate and frequency
+- rtnetlink RTM_GETADDR       IPv4 and IPv6 addresses (fallback: IPv4 from
+                              /proc/net/fib_trie and route, IPv6 from
+                              /proc/net/if_inet6)
+
+Every reader returns structured data (or None when the value is unavailable)
+and never raises for a missing interface. The /proc and /sys locations can be
+pointed at a directory of fixture files for testing on machines without a
+wireless card; addresses then come from the /proc fallback files, and the
+wireless ioctls only run if get_link_info() is handed an ioctl function.
+"""
+
+import array
+import fcntl
+import ipaddress
+import logging
+import os
+import socket
+import struct
+
+PROC_ROOT = '/proc'
+SYS_ROOT = '/sys'
+
+# Wireless extension ioctls (linux/wireless.h)
+SIOCGIWFREQ = 0x8B05
+SIOCGIWESSID = 0x8B1B
+SIOCGIWRATE = 0x8B21
+IW_ESSID_MAX_SIZE = 32
+IWREQ_SIZE = 32  # 16 byte interface name + 16 byte iwreq_data union
+
+# rtnetlink constants (linux/netlink.h, linux/rtnetlink.h, linux/if_addr.h)
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFF_UP = 0x1
+TCP_LISTEN = '0A'
+NLMSG_HEADER = struct.Struct('=IHHII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTATTR = struct.Struct('=HH')
+
+logger = logging.getLogger('network_state')
+
+def _read_sysfs(interface, name, sys_root=SYS_ROOT):
+    """Read a single /sys/class/net/<interface>/<name> value"""
+    try:
+        with open(os.path.join(sys_root, 'class', 'net', interface, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _read_sysfs_int(interface, name, sys_root=SYS_ROOT):
+    value = _read_sysfs(interface, name, sys_root)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def interface_exists(interface, sys_root=SYS_ROOT):
+    """Check whether the interface is known to the kernel"""
+    return os.path.isdir(os.path.join(sys_root, 'class', 'net', interface))
+
+def read_operstate(interface, sys_root=SYS_ROOT):
+    """Return the RFC 2863 operational state ('up', 'down', 'dormant', ...)"""
+    return _read_sysfs(interface, 'operstate', sys_root)
+
+def is_interface_up(interface, sys_root=SYS_ROOT):
+    """Check the administrative IFF_UP flag (set by 'ip link set up')"""
+    flags = _read_sysfs(interface, 'flags', sys_root)
+    try:
+        return bool(int(flags, 16) & IFF_UP)
+    except (TypeError, ValueError):
+        return False
+
+def is_port_listening(port, proc_root=PROC_ROOT):
+    """Check /proc/net/tcp and tcp6 for a socket listening on the port"""
+    for name in ('tcp', 'tcp6'):
+        try:
+            with open(os.path.join(proc_root, 'net', name)) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4 or fields[3] != TCP_LISTEN:
+                continue
+            if int(fields[1].rsplit(':', 1)[1], 16) == port:
+                return True
+    return False
+
+def read_wireless_stats(interface, proc_root=PROC_ROOT):
+    """Parse the interface's line of /proc/net/wireless
+
+    Returns a dict with link quality, signal level and noise level, or None
+    if the interface has no wireless statistics (not wireless or not up).
+    """
+    try:
+        with open(os.path.join(proc_root, 'net', 'wireless')) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    for line in lines[2:]:
+        name, _, fields = line.partition(':')
+        if name.strip() != interface:
+            continue
+        values = fields.split()
+        if len(values) < 4:
+            return None
+        try:
+            quality, level, noise = (float(v.rstrip('.')) for v in values[1:4])
+        except ValueError:
+            return None
+        return {
+            'link_quality': quality,
+            'signal_dbm': level,
+            # Drivers that do not report noise use -256 as a placeholder
+            'noise_dbm': noise if noise > -256 else None
+        }
+    return None
+
+def _iw_ioctl(interface, request, data):
+    """Issue a wireless extension ioctl and return the filled iwreq buffer
+
+    The read_* helpers below take an ioctl argument with this signature, so
+    recorded iwreq data can stand in for the kernel.
+    """
+    ifname = interface.encode()[:15]
+    buf = struct.pack('16s', ifname) + data.ljust(IWREQ_SIZE - 16, b'\0')
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        return fcntl.ioctl(sock.fileno(), request, buf)
+
+def read_ssid(interface, ioctl=None):
+    """Return the SSID the interface is associated with, or None"""
+    essid = array.array('b', b'\0' * (IW_ESSID_MAX_SIZE + 1))
+    address, length = essid.buffer_info()
+    try:
+        result = (ioctl or _iw_ioctl)(interface, SIOCGIWESSID,
+                                      struct.pack('PHH', address, length, 0))
+    except OSError:
+        return None
+    size = struct.unpack_from('PHH', result, 16)[1]
+    ssid = essid.tobytes()[:size].decode('utf-8', errors='replace')
+    return ssid or None
+
+def read_bitrate(interface, ioctl=None):
+    """Return the current transmit bitrate in Mb/s, or None"""
+    try:
+        result = (ioctl or _iw_ioctl)(interface, SIOCGIWRATE, b'')
+    except OSError:
+        return None
+    value = struct.unpack_from('i', result, 16)[0]
+    return value / 1e6 if value > 0 else None
+
+def read_frequency(interface, ioctl=None):
+    """Return the current channel frequency in MHz, or None"""
+    try:
+        result = (ioctl or _iw_ioctl)(interface, SIOCGIWFREQ, b'')
+    except OSError:
+        return None
+    mantissa, exponent = struct.unpack_from('ih', result, 16)
+    if mantissa <= 0:
+        return None
+    frequency = mantissa * 10 ** exponent
+    # Values below 1000 are channel numbers rather than frequencies
+    return frequency / 1e6 if frequency >= 1000 else None
+
+def parse_addr_messages(data, ifindex):
+    """Parse an RTM_GETADDR dump into address dicts for one interface index
+
+    Returns (addresses, done) where done is True once NLMSG_DONE was seen.
+    """
+    addresses = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+        if msg_type == NLMSG_DONE:
+            return addresses, True
+        if msg_type == NLMSG_ERROR:
+            raise OSError("netlink address dump failed")
+        if msg_type == RTM_NEWADDR:
+            body = offset + NLMSG_HEADER.size
+            family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(data, body)
+            if index == ifindex:
+                attrs = {}
+                pos = body + IFADDRMSG.size
+                end = offset + length
+                while pos + RTATTR.size <= end:
+                    attr_len, attr_type = RTATTR.unpack_from(data, pos)
+                    if attr_len < RTATTR.size:
+                        break
+                    attrs[attr_type] = data[pos + RTATTR.size:pos + attr_len]
+                    pos += (attr_len + 3) & ~3
+                raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+                if raw:
+                    addresses.append({
+                        'family': 'inet' if family == socket.AF_INET else 'inet6',
+                        'address': str(ipaddress.ip_address(raw)),
+                        'prefixlen': prefixlen,
+                        'scope': scope
+                    })
+        offset += (length + 3) & ~3
+    return addresses, False
+
+def _netlink_addresses(ifindex):
+    """Dump addresses over rtnetlink and keep the ones for ifindex"""
+    request = NLMSG_HEADER.pack(NLMSG_HEADER.size + IFADDRMSG.size, RTM_GETADDR,
+                                NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+    request += IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+    addresses = []
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        sock.settimeout(1)
+        sock.send(request)
+        done = False
+        while not done:
+            found, done = parse_addr_messages(sock.recv(65536), ifindex)
+            addresses.extend(found)
+    return addresses
+
+def _proc_inet6_addresses(interface, proc_root=PROC_ROOT):
+    """Read IPv6 addresses for the interface from /proc/net/if_inet6"""
+    addresses = []
+    try:
+        with open(os.path.join(proc_root, 'net', 'if_inet6')) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 6 or fields[5] != interface:
+                    continue
+                addresses.append({
+                    'family': 'inet6',
+                    'address': str(ipaddress.IPv6Address(bytes.fromhex(fields[0]))),
+                    'prefixlen': int(fields[2], 16),
+                    'scope': int(fields[3], 16)
+                })
+    except (OSError, ValueError):
+        pass
+    return addresses
+
+def _route_hex_to_address(value):
+    """Convert a /proc/net/route field (host byte order hex) to an IPv4Address"""
+    return ipaddress.IPv4Address(struct.pack('=I', int(value, 16)))
+
+def _proc_inet4_addresses(interface, proc_root=PROC_ROOT):
+    """Read IPv4 addresses for the interface from /proc/net/fib_trie and route
+
+    fib_trie lists every local address as a '/32 host LOCAL' leaf but not
+    the interface it belongs to; the interface and prefix length come from
+    the directly connected subnet in /proc/net/route that holds the address.
+    """
+    try:
+        with open(os.path.join(proc_root, 'net', 'route')) as f:
+            routes = f.readlines()[1:]
+        with open(os.path.join(proc_root, 'net', 'fib_trie')) as f:
+            trie = f.readlines()
+    except OSError:
+        return []
+
+    subnets = []
+    for line in routes:
+        fields = line.split()
+        if len(fields) < 8 or fields[0] != interface:
+            continue
+        try:
+            if int(fields[2], 16) != 0:
+                continue  # Via a gateway, not a connected subnet
+            subnets.append(ipaddress.IPv4Network(
+                (_route_hex_to_address(fields[1]), str(_route_hex_to_address(fields[7])))))
+        except ValueError:
+            continue
+
+    addresses = []
+    leaf = None
+    for line in trie:
+        text = line.strip()
+        if text.startswith('|--'):
+            leaf = text[3:].strip()
+        elif text == '/32 host LOCAL' and leaf is not None:
+            try:
+                address = ipaddress.IPv4Address(leaf)
+            except ValueError:
+                continue
+            matches = [net for net in subnets if address in net]
+            if not matches or any(a['address'] == leaf for a in addresses):
+                continue
+            addresses.append({
+                'family': 'inet',
+                'address': leaf,
+                'prefixlen': max(net.prefixlen for net in matches),
+                'scope': 0
+            })
+    return addresses
+
+def read_addresses(interface, proc_root=PROC_ROOT, sys_root=SYS_ROOT):
+    """Return the IPv4/IPv6 addresses assigned to the interface"""
+    ifindex = _read_sysfs_int(interface, 'ifindex', sys_root)
+    if ifindex is None:
+        return []
+    if proc_root == PROC_ROOT and sys_root == SYS_ROOT:
+        try:
+            return _netlink_addresses(ifindex)
+        except OSError as e:
+            logger.warning(f"Netlink address dump failed, reading /proc instead: {str(e)}")
+    return (_proc_inet4_addresses(interface, proc_root) +
+            _proc_inet6_addresses(interface, proc_root))
+
+def get_current_ssid(interface='wlan0'):
+    """Return the SSID the interface is associated with, or None"""
+    return read_ssid(interface)
+
+def get_link_info(interface='wlan0', proc_root=PROC_ROOT, sys_root=SYS_ROOT, ioctl=None):
+    """Collect link state, addresses and wireless details for an interface
+
+    SSID, bitrate and frequency come from wireless ioctls, which read the
+    live interface. With fixture roots they are only filled in when ioctl
+    (see _iw_ioctl) is given.
+    """
+    info = {
+        'interface': interface,
+        'exists': interface_exists(interface, sys_root),
+        'operstate': None,
+        'carrier': None,
+        'mac': None,
+        'rx_bytes': None,
+        'tx_bytes': None,
+        'ssid': None,
+        'link_quality': None,
+        'signal_dbm': None,
+        'noise_dbm': None,
+        'bitrate_mbps': None,
+        'frequency_mhz': None,
+        'addresses': []
+    }
+    if not info['exists']:
+        return info
+
+    info['operstate'] = read_operstate(interface, sys_root)
+    info['carrier'] = _read_sysfs_int(interface, 'carrier', sys_root) == 1
+    info['mac'] = _read_sysfs(interface, 'address', sys_root)
+    info['rx_bytes'] = _read_sysfs_int(interface, 'statistics/rx_bytes', sys_root)
+    info['tx_bytes'] = _read_sysfs_int(interface, 'statistics/tx_bytes', sys_root)
+    info['addresses'] = read_addresses(interface, proc_root, sys_root)
+
+    stats = read_wireless_stats(interface, proc_root)
+    if stats:
+        info.update(stats)
+    if ioctl is not None or sys_root == SYS_ROOT:
+        info['ssid'] = read_ssid(interface, ioctl)
+        info['bitrate_mbps'] = read_bitrate(interface, ioctl)
+        info['frequency_mhz'] = read_frequency(interface, ioctl)
+    return info
+
+def format_link_info(info):
+    """Render link info as short human readable text for the admin panel"""
+    if not info['exists']:
+        return 'Not available', 'Not available'
+
+    wifi_lines = [f"State: {info['operstate'] or 'unknown'}"]
+    if info['ssid']:
+        wifi_lines.append(f"SSID: {info['ssid']}")
+    if info['signal_dbm'] is not None:
+        wifi_lines.append(f"Signal: {info['signal_dbm']:.0f} dBm")
+    if info['bitrate_mbps'] is not None:
+        wifi_lines.append(f"Bitrate: {info['bitrate_mbps']:g} Mb/s")
+    if info['frequency_mhz'] is not None:
+        wifi_lines.append(f"Frequency: {info['frequency_mhz']:g} MHz")
+
+    ip_lines = [f"{a['address']}/{a['prefixlen']}" for a in info['addresses']]
+    if info['mac']:
+        ip_lines.append(f"MAC: {info['mac']}")
+    return '\n'.join(wifi_lines), '\n'.join(ip_lines) or 'No addresses'
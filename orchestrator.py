@@ -0,0 +1,205 @@
+"""
+Dependency-aware service orchestration for access point mode switches
+
+Steps declare what they run, which steps they must wait for, and an
+optional readiness probe. Independent steps run concurrently; a step only
+counts as done once its probe passes, which replaces fixed sleeps between
+service operations. Every step's start time and duration are recorded.
+
+A step looks like:
+    Step('start_hostapd', ['systemctl', 'start', 'hostapd'],
+         after=['link_up', 'hostapd_config'],
+         ready=('unit_active', 'hostapd'))
+
+Commands go through a runner (command_runner.CommandRunner) and probes are
+resolved by name on a probes object (SystemProbes). benchmarks/fakes.py has
+FakeCommandRunner and FakeProbes, so whole graphs can be exercised off-device.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import command_runner
+import network_state
+
+# Seconds between readiness probe checks, growing by PROBE_BACKOFF up to
+# MAX_PROBE_INTERVAL. Unit probes cost a systemctl call each and start at
+# UNIT_PROBE_INTERVAL; the others read sysfs or /proc and start at PROBE_INTERVAL.
+PROBE_INTERVAL = 0.05
+UNIT_PROBE_INTERVAL = 0.2
+UNIT_PROBES = ('unit_active', 'unit_inactive')
+PROBE_BACKOFF = 1.5
+MAX_PROBE_INTERVAL = 1.0
+MAX_WORKERS = 6
+
+class SystemProbes:
+    """Readiness checks against the running system"""
+
+    def __init__(self, runner=None):
+        self.runner = runner  # None: the shared command_runner.runner
+
+    def _states(self, units):
+        runner = self.runner or command_runner.runner
+        return runner.run(['systemctl', 'is-active', *units]).stdout.split()
+
+    def unit_active(self, *units):
+        """Every unit is active (one systemctl call for all of them)"""
+        states = self._states(units)
+        return len(states) == len(units) and all(state == 'active' for state in states)
+
+    def unit_inactive(self, *units):
+        """No unit is active"""
+        return 'active' not in self._states(units)
+
+    def interface_exists(self, interface):
+        return network_state.interface_exists(interface)
+
+    def interface_up(self, interface):
+        return network_state.is_interface_up(interface)
+
+    def interface_down(self, interface):
+        return not network_state.is_interface_up(interface)
+
+    def address_assigned(self, interface, address):
+        return any(a['address'] == address for a in network_state.read_addresses(interface))
+
+    def port_bound(self, port):
+        return network_state.is_port_listening(port)
+
+    def port_free(self, port):
+        return not network_state.is_port_listening(port)
+
+class Step:
+    """One unit of work in an orchestration graph
+
+    action is a command list (run through the runner) or a callable taking
+    the runner; a callable fails by raising or by returning False. A
+    required step that fails marks the whole run as failed and skips every
+    step that depends on it.
+    """
+
+    def __init__(self, name, action=None, after=(), ready=None, timeout=10.0, required=True):
+        self.name = name
+        self.action = action
+        self.after = list(after)
+        self.ready = ready
+        self.timeout = timeout
+        self.required = required
+
+class Orchestration:
+    """Result of running a step graph"""
+
+    def __init__(self):
+        self.steps = {}
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    @property
+    def ok(self):
+        return all(result['status'] == 'ok' or not result['required']
+                   for result in self.steps.values())
+
+    def format_timings(self):
+        """One line per step, ordered by start time"""
+        lines = [f"Total: {self.duration:.2f}s"]
+        for name, result in sorted(self.steps.items(), key=lambda item: item[1]['start']):
+            line = f"  {name}: {result['status']} +{result['start']:.2f}s {result['duration']:.2f}s"
+            if result['error']:
+                line += f" ({result['error']})"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def log_timings(self, logger, phase):
+        """Log one structured record per step and one for the whole run"""
+        for name, result in sorted(self.steps.items(), key=lambda item: item[1]['start']):
+            message = f"{phase} step {name}: {result['status']}"
+            if result['error']:
+                message += f" ({result['error']})"
+            logger.info(message, extra={
+                'phase': phase,
+                'step': name,
+                'status': result['status'],
+                'start_ms': round(result['start'] * 1000, 1),
+                'duration_ms': round(result['duration'] * 1000, 1)
+            })
+        logger.info(f"{phase} finished in {self.duration:.2f}s", extra={
+            'phase': phase,
+            'ok': self.ok,
+            'duration_ms': round(self.duration * 1000, 1)
+        })
+
+def _run_step(step, runner, probes, started):
+    start = time.monotonic()
+    result = {'status': 'ok', 'start': start - started, 'duration': 0.0,
+              'error': None, 'required': step.required}
+    try:
+        if callable(step.action):
+            if step.action(runner) is False:
+                raise RuntimeError(f"{step.name} reported failure")
+        elif step.action:
+            runner.run(step.action, check=True)
+
+        if step.ready:
+            probe = getattr(probes, step.ready[0])
+            deadline = start + step.timeout
+            interval = UNIT_PROBE_INTERVAL if step.ready[0] in UNIT_PROBES else PROBE_INTERVAL
+            while not probe(*step.ready[1:]):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"{step.ready[0]}{tuple(step.ready[1:])} not ready "
+                                       f"after {step.timeout}s")
+                time.sleep(min(interval, remaining))
+                interval = min(interval * PROBE_BACKOFF, MAX_PROBE_INTERVAL)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['duration'] = time.monotonic() - start
+    return result
+
+def run_steps(steps, runner=None, probes=None, max_workers=MAX_WORKERS):
+    """Run a step graph, starting each step as soon as its dependencies finish"""
+    runner = runner or command_runner.runner
+    probes = probes or SystemProbes(runner)
+    orchestration = Orchestration()
+    pending = {step.name: step for step in steps}
+    for step in steps:
+        missing = [dep for dep in step.after if dep not in pending]
+        if missing:
+            raise ValueError(f"Step {step.name} depends on unknown steps: {missing}")
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, step in list(pending.items()):
+                    deps = [orchestration.steps.get(dep) for dep in step.after]
+                    if any(dep is None for dep in deps):
+                        continue
+                    del pending[name]
+                    scheduled = True
+                    failed = [dep for dep, result in zip(step.after, deps)
+                              if result['status'] != 'ok' and result['required']]
+                    if failed:
+                        orchestration.steps[name] = {
+                            'status': 'skipped',
+                            'start': time.monotonic() - orchestration.started,
+                            'duration': 0.0,
+                            'error': f"dependency failed: {', '.join(failed)}",
+                            'required': step.required}
+                        continue
+                    future = executor.submit(_run_step, step, runner, probes,
+                                             orchestration.started)
+                    running[future] = name
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle between steps: {sorted(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                orchestration.steps[running.pop(future)] = future.result()
+
+    orchestration.duration = time.monotonic() - orchestration.started
+    return orchestration
@@ -16,12 +16,13 @@ Date: 11/10/2024
 Version: 1.0
 """
 
-import subprocess
 import os
 import sys
 import time
 import shutil
 
+import command_runner
+
 def check_root():
     """Check for root privileges"""
     if os.geteuid() != 0:
@@ -49,9 +50,8 @@ def recover_system():
         # 1. Stop and disable AP services
         print("1. Stopping AP services...")
         services_to_manage = ['hostapd', 'dnsmasq']
-        for service in services_to_manage:
-            subprocess.run(['sudo', 'systemctl', 'stop', service], check=False)
-            subprocess.run(['sudo', 'systemctl', 'disable', service], check=False)
+        command_runner.systemctl('stop', *services_to_manage)
+        command_runner.systemctl('disable', *services_to_manage)
         
         # 2. Restore network configs
         print("\n2. Restoring network configuration...")
@@ -59,37 +59,34 @@ def recover_system():
         
         # 3. Enable and start wpa_supplicant
         print("\n3. Restoring wpa_supplicant...")
-        subprocess.run(['sudo', 'systemctl', 'unmask', 'wpa_supplicant'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'enable', 'wpa_supplicant'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'wpa_supplicant'], check=True)
+        command_runner.systemctl('unmask', 'wpa_supplicant', check=True)
+        command_runner.systemctl('enable', '--now', 'wpa_supplicant', check=True)
         
         # 4. Reset network interface
         print("\n4. Resetting network interface...")
-        subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], check=True)
+        command_runner.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], check=True)
         time.sleep(1)
-        subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'up'], check=True)
+        command_runner.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'up'], check=True)
         
         # 5. Restart network services
         print("\n5. Restarting network services...")
-        subprocess.run(['sudo', 'systemctl', 'restart', 'dhcpcd'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'restart', 'networking'], check=True)
-""" 
-        print("\n6. Ensuring Raspberry Pi Desktop is installed...")
-        # Make sure RPD is installed and set as default
-        subprocess.run(['sudo', 'apt-get', 'update'], check=True)
-        subprocess.run(['sudo', 'apt-get', 'install', '--reinstall', 'raspberrypi-ui-mods', '-y'], check=True)
-        
-        print("\n7. Setting Raspberry Pi Desktop as default...")
-        # Set RPD as default display manager
-        subprocess.run(['sudo', 'update-alternatives', '--set', 'x-session-manager', '/usr/bin/startlxde-pi'], check=True)
-         """
+        command_runner.systemctl('restart', 'dhcpcd', 'networking', check=True)
+
+        # Desktop restore is disabled; uncomment to reinstall and select RPD
+        # print("\n6. Ensuring Raspberry Pi Desktop is installed...")
+        # command_runner.run(['sudo', 'apt-get', 'update'], check=True)
+        # command_runner.run(['sudo', 'apt-get', 'install', '--reinstall',
+        #                     'raspberrypi-ui-mods', '-y'], check=True)
+        # print("\n7. Setting Raspberry Pi Desktop as default...")
+        # command_runner.run(['sudo', 'update-alternatives', '--set', 'x-session-manager',
+        #                     '/usr/bin/startlxde-pi'], check=True)
+
         # Stop admin panel service if it exists
         print("\n8. Cleaning up admin panel service...")
         if os.path.exists('/etc/systemd/system/pi-admin-panel.service'):
-            subprocess.run(['sudo', 'systemctl', 'stop', 'pi-admin-panel'], check=False)
-            subprocess.run(['sudo', 'systemctl', 'disable', 'pi-admin-panel'], check=False)
-            subprocess.run(['sudo', 'rm', '/etc/systemd/system/pi-admin-panel.service'], check=False)
-            subprocess.run(['sudo', 'systemctl', 'daemon-reload'], check=False)
+            command_runner.systemctl('disable', '--now', 'pi-admin-panel')
+            command_runner.run(['sudo', 'rm', '/etc/systemd/system/pi-admin-panel.service'])
+            command_runner.systemctl('daemon-reload')
         
         print("\nSystem recovery completed successfully!")
         print("\nIMPORTANT: Please reboot your system to complete the recovery:")
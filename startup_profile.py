@@ -0,0 +1,113 @@
+"""
+Startup-time profiling for the access point daemon
+
+Run `sudo python3 access_point.py --profile-startup` to log how long each
+module import and each startup phase (logging, GPIO init, config
+verification, server bind, web app preload) took. Import timing works by
+wrapping builtins.__import__, so enable() has to run before the imports
+being measured. When profiling is off, phase() is a no-op.
+"""
+
+import builtins
+import contextlib
+import sys
+import threading
+import time
+
+FLAG = '--profile-startup'
+TOP_IMPORTS = 15  # Slowest imports shown in a report
+
+_profile = None
+
+class StartupProfile:
+    """Collect import and phase timings relative to process start"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.imports = []  # (module, cumulative_s, self_s, depth)
+        self.phases = []  # (phase, offset_s, duration_s)
+        self._original_import = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable_import_timing(self):
+        """Time every first-time import from now on"""
+        if self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def disable_import_timing(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        if level or name in sys.modules or original is None:
+            return original(name, globals, locals, fromlist, level)
+
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        started = self.clock()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = self.clock() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.imports.append((name, elapsed, elapsed - children, len(stack)))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, started - self.started, self.clock() - started))
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def format_report(self, milestone, top=TOP_IMPORTS):
+        """Readable summary of phases and the slowest top-level imports"""
+        with self._lock:
+            phases = list(self.phases)
+            imports = list(self.imports)
+        lines = [f"Startup profile at '{milestone}': {self.elapsed() * 1000:.1f} ms since start"]
+        for name, offset, duration in phases:
+            lines.append(f"  phase  {name:<22} +{offset * 1000:8.1f} ms  {duration * 1000:8.1f} ms")
+        total = sum(cumulative for _, cumulative, _, depth in imports if depth == 0)
+        lines.append(f"  imports: {len(imports)} modules, {total * 1000:.1f} ms at top level")
+        slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:top]
+        for name, cumulative, own, depth in slowest:
+            lines.append(f"  import {name:<22} {cumulative * 1000:8.1f} ms  (self {own * 1000:.1f} ms)")
+        return '\n'.join(lines)
+
+def enable(argv=None):
+    """Start profiling if --profile-startup was passed (or argv is None and it is in sys.argv)"""
+    global _profile
+    argv = sys.argv if argv is None else argv
+    if FLAG in argv and _profile is None:
+        _profile = StartupProfile()
+        _profile.enable_import_timing()
+    return _profile
+
+def enabled():
+    return _profile is not None
+
+def phase(name):
+    """Time a block as a startup phase (no-op unless profiling)"""
+    if _profile is None:
+        return contextlib.nullcontext()
+    return _profile.phase(name)
+
+def report(logger, milestone):
+    """Log the timings collected so far with milestone as the label"""
+    if _profile is not None:
+        logger.info(_profile.format_report(milestone),
+                    extra={'milestone': milestone,
+                           'elapsed_ms': round(_profile.elapsed() * 1000, 1)})
@@ -0,0 +1,98 @@
+"""
+Pre-rendered, precompressed pages for the config portal and admin panel
+
+config.html and the admin page shell have no per-request content, so they
+are rendered through Jinja once at startup and kept in memory together
+with gzip (and brotli, when the optional brotli package is installed)
+variants. Each variant has its own strong ETag; responses carry
+Cache-Control and Vary headers and a matching If-None-Match gets an
+empty 304, so a reload over the access point costs a few hundred bytes.
+"""
+
+import gzip
+import hashlib
+
+from flask import Response, render_template, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTML_TYPE = 'text/html; charset=utf-8'
+HTML_CACHE_CONTROL = 'no-cache'  # Always revalidate; unchanged pages cost a 304
+MIN_COMPRESS_SIZE = 256  # Smaller bodies are not worth compressing
+
+def build_asset(body, content_type=HTML_TYPE, cache_control=HTML_CACHE_CONTROL):
+    """Precompute the identity, gzip and brotli variants of body with their ETags"""
+    if isinstance(body, str):
+        body = body.encode()
+    tag = hashlib.sha256(body).hexdigest()[:20]
+    variants = {'identity': (body, f'"{tag}"')}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{tag}-gz"')
+        if brotli is not None:
+            variants['br'] = (brotli.compress(body, quality=11), f'"{tag}-br"')
+    return {
+        'content_type': content_type,
+        'cache_control': cache_control,
+        'variants': variants
+    }
+
+def render_page(app, template, **context):
+    """Render a template once, outside any request, into an asset"""
+    with app.app_context():
+        return build_asset(render_template(template, **context))
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q=0 excluded)"""
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(coding)
+    return accepted
+
+def choose_encoding(asset, accept_encoding):
+    """Best precompressed variant the client accepts"""
+    accepted = accepted_encodings(accept_encoding)
+    for coding in ('br', 'gzip'):
+        if coding in asset['variants'] and (coding in accepted or '*' in accepted):
+            return coding
+    return 'identity'
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header lists etag (weak comparison)"""
+    for tag in (if_none_match or '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+def asset_response(asset):
+    """Flask response for the current request: a 304 or the best variant"""
+    coding = choose_encoding(asset, request.headers.get('Accept-Encoding'))
+    body, etag = asset['variants'][coding]
+    headers = {
+        'ETag': etag,
+        'Cache-Control': asset['cache_control'],
+        'Vary': 'Accept-Encoding'
+    }
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    if coding != 'identity':
+        headers['Content-Encoding'] = coding
+    return Response(body, content_type=asset['content_type'], headers=headers)
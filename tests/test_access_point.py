@@ -0,0 +1,101 @@
+import pytest
+
+import access_point
+import watchdog
+import credential_store
+import wifi_scan
+import wifi_state
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """Watchdog-owned access point with recorded AP and reconnect actions"""
+    machine = wifi_state.WifiStateMachine(str(tmp_path / 'wifi_status.json'))
+    machine.transition(wifi_state.AP_STARTING, 'connectivity_lost', ap_owner='watchdog')
+    machine.transition(wifi_state.AP_READY, 'connectivity_lost')
+    store = credential_store.CredentialStore(str(tmp_path / 'known_networks.json'))
+    scan = {'results': [], 'calls': 0}
+
+    def scanner():
+        scan['calls'] += 1
+        return scan['results']
+
+    actions = []
+
+    def stop(reason):
+        actions.append(('stop', reason))
+        machine.transition(wifi_state.IDLE, reason)
+
+    def start(owner, reason):
+        actions.append(('start', reason))
+        return True
+
+    def reconnect():
+        actions.append(('reconnect',))
+        return False
+
+    monkeypatch.setattr(access_point, 'wifi', machine)
+    monkeypatch.setattr(access_point, 'concurrent_ap', None)
+    monkeypatch.setattr(access_point, 'web_host_server', None)
+    monkeypatch.setattr(credential_store, 'known_networks', store)
+    monkeypatch.setattr(wifi_scan, 'cache', wifi_scan.ScanCache(scanner))
+    monkeypatch.setattr(access_point, 'stop_access_point', stop)
+    monkeypatch.setattr(access_point, 'start_access_point', start)
+    monkeypatch.setattr(access_point, 'reconnect_known_network', reconnect)
+    return {'machine': machine, 'store': store, 'scan': scan, 'actions': actions}
+
+def bss(ssid, signal=-60):
+    return {'ssid': ssid, 'bssid': '02:00:00:00:00:01', 'signal_dbm': signal}
+
+def test_retry_keeps_the_ap_without_saved_networks(daemon):
+    daemon['scan']['results'] = [bss('Home')]
+    access_point.on_connectivity_retry()
+    assert daemon['actions'] == []
+    assert daemon['scan']['calls'] == 0  # Nothing to look for, so no scan
+    assert daemon['machine'].state == wifi_state.AP_READY
+
+def test_retry_keeps_the_ap_when_no_saved_network_is_in_range(daemon):
+    daemon['store'].add('Home', 'secret123')
+    daemon['scan']['results'] = [bss('Neighbour')]
+    access_point.on_connectivity_retry()
+    assert daemon['actions'] == []
+    assert daemon['machine'].state == wifi_state.AP_READY
+
+def test_retry_stops_the_ap_when_a_saved_network_is_in_range(daemon):
+    daemon['store'].add('Home', 'secret123')
+    daemon['scan']['results'] = [bss('Neighbour'), bss('Home', -70)]
+    access_point.on_connectivity_retry()
+    assert daemon['actions'] == [('stop', 'watchdog_retry'), ('reconnect',),
+                                 ('start', 'watchdog_retry')]
+
+def test_retry_uses_cached_results_when_the_scan_fails(daemon, monkeypatch):
+    daemon['store'].add('Home', 'secret123')
+    daemon['scan']['results'] = [bss('Home')]
+    wifi_scan.cache.get()
+
+    def failing():
+        raise OSError("Device or resource busy")
+
+    wifi_scan.cache.scanner = failing
+    wifi_scan.cache.ttl = 0
+    access_point.on_connectivity_retry()
+    assert daemon['actions'][0] == ('stop', 'watchdog_retry')
+
+@pytest.mark.parametrize('mode, owner, stopped', [
+    ('concurrent', 'watchdog', True),
+    ('concurrent', 'button', False),  # Someone is configuring WiFi on purpose
+    ('single', 'watchdog', False),
+])
+def test_connectivity_restored_stops_only_a_concurrent_watchdog_ap(daemon, monkeypatch,
+                                                                 mode, owner, stopped):
+    if mode == 'concurrent':
+        monkeypatch.setattr(access_point, 'concurrent_ap', object())
+    daemon['machine'].update(ap_owner=owner)
+    access_point.on_connectivity_restored()
+    assert daemon['actions'] == ([('stop', 'connectivity_restored')] if stopped else [])
+    assert daemon['machine'].state == (wifi_state.IDLE if stopped else wifi_state.AP_READY)
+
+def test_watchdog_reports_recovery(monkeypatch):
+    monkeypatch.setattr(watchdog.ConnectivityWatchdog, 'start', lambda self: None)
+    monkeypatch.setattr(access_point, 'connectivity_watchdog', None)
+    access_point.start_watchdog()
+    assert access_point.connectivity_watchdog.on_online is access_point.on_connectivity_restored
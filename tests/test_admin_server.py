@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'admin'))
+
+import admin_server
+
+def test_snapshot_age_is_the_stalest_group(monkeypatch):
+    sampler = admin_server.MetricsSampler()
+    sampler.samplers = {'system': lambda: {'cpu': 5}, 'internet': lambda: {'internet': True}}
+    clock = [1000.0]
+    monkeypatch.setattr(admin_server.time, 'time', lambda: clock[0])
+    sampler.refresh('internet')
+    clock[0] += 30
+    sampler.refresh('system')
+    clock[0] += 1
+    info = sampler._snapshot_locked()
+    assert info['ages'] == {'internet': 31.0, 'system': 1.0}
+    assert info['age'] == 31.0
+
+def test_snapshot_age_before_any_sample():
+    assert admin_server.MetricsSampler()._snapshot_locked()['age'] == 0.0
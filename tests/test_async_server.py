@@ -0,0 +1,95 @@
+import http.client
+import threading
+import time
+
+import pytest
+
+import async_server
+
+class Apps:
+    """WSGI app with a handler that blocks until released and an endless stream"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        if path == '/block':
+            self.release.wait(5)
+        if path == '/stream':
+            start_response('200 OK', [('Content-Type', 'text/event-stream')])
+            return self.events()
+        start_response('200 OK', [('Content-Length', '2')])
+        return [b'ok']
+
+    def events(self):
+        while not self.release.is_set():
+            yield b'data: tick\n\n'
+            time.sleep(0.02)
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(app, **options):
+        server = async_server.make_server('127.0.0.1', 0, app, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def get(server, path, timeout=5):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=timeout)
+    connection.request('GET', path)
+    return connection, connection.getresponse()
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_saturated_pool_answers_503(serve):
+    app = Apps()
+    server = serve(app, max_workers=1, max_queued=1)
+    blocked = [threading.Thread(target=get, args=(server, '/block')) for _ in range(2)]
+    for thread in blocked:
+        thread.start()
+    wait_until(lambda: server.busy[server.workers] == 2)
+    assert get(server, '/')[1].status == 503
+    app.release.set()
+    for thread in blocked:
+        thread.join()
+    wait_until(lambda: server.busy[server.workers] == 0)
+    assert get(server, '/')[1].status == 200
+
+def test_timed_out_handler_keeps_its_worker(serve):
+    app = Apps()
+    server = serve(app, max_workers=1, max_queued=8, handler_timeout=0.1)
+    assert get(server, '/block')[1].status == 504
+    # The handler still holds the only worker; queueing behind it is pointless
+    assert (server.busy[server.workers], server.stuck[server.workers]) == (1, 1)
+    assert get(server, '/')[1].status == 503
+    app.release.set()
+    wait_until(lambda: server.busy[server.workers] == 0)
+    assert server.stuck[server.workers] == 0
+    assert get(server, '/')[1].status == 200
+
+def test_streams_beyond_stream_workers_are_refused(serve):
+    app = Apps()
+    server = serve(app, stream_workers=1)
+    connection, first = get(server, '/stream')
+    assert first.status == 200
+    assert first.readline() == b'data: tick\n'
+    _, second = get(server, '/stream')
+    assert second.status == 503
+    # Ordinary requests are unaffected
+    assert get(server, '/')[1].status == 200
+    connection.close()
+    wait_until(lambda: server.busy[server.stream_workers] == 0)
+    assert get(server, '/stream')[1].status == 200
+    app.release.set()
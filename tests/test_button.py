@@ -0,0 +1,106 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import button
+
+class StrictGPIO(types.ModuleType):
+    """RPi.GPIO stand-in that enforces setmode -> setup -> input like the real one"""
+
+    BCM = 11
+    IN = 1
+    BOTH = 33
+    PUD_UP = 22
+
+    def __init__(self, level=1):
+        super().__init__('RPi.GPIO')
+        self.mode = None
+        self.inputs = {}
+        self.level = level
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None):
+        if self.mode is None:
+            raise RuntimeError("Please set pin numbering mode using GPIO.setmode")
+        self.inputs[pin] = direction
+
+    def input(self, pin):
+        if self.mode is None:
+            raise RuntimeError("Please set pin numbering mode using GPIO.setmode")
+        if pin not in self.inputs:
+            raise RuntimeError("You must setup() the GPIO channel first")
+        return self.level
+
+    def add_event_detect(self, pin, edge, callback=None):
+        if pin not in self.inputs:
+            raise RuntimeError("You must setup() the GPIO channel first")
+
+    def cleanup(self):
+        self.mode = None
+        self.inputs.clear()
+
+@pytest.fixture
+def gpio(monkeypatch):
+    module = StrictGPIO()
+    package = types.ModuleType('RPi')
+    package.GPIO = module
+    monkeypatch.setitem(sys.modules, 'RPi', package)
+    monkeypatch.setitem(sys.modules, 'RPi.GPIO', module)
+    return module
+
+def test_start_sets_up_gpio_before_reading(gpio):
+    pin = 17
+    gpio.level = 0  # Held down at startup
+    b = button.Button(pin, button.GPIOBackend())
+    b.start()
+    assert gpio.inputs == {pin: gpio.IN}
+    assert b.pressed
+    b.stop()
+
+def test_simulated_backend_rejects_read_before_setup():
+    backend = button.SimulatedBackend()
+    with pytest.raises(RuntimeError):
+        backend.read(17)
+
+def test_simulated_short_and_long_press():
+    backend = button.SimulatedBackend()
+    pressed, held = [], threading.Event()
+    b = button.Button(17, backend, on_press=pressed.append, on_long_press=held.set,
+                      debounce=0.01, long_press=0.2)
+    b.start()
+    backend.press(17, 0.05, bounces=2)
+    time.sleep(0.05)
+    backend.press(17, 0.3)
+    assert held.wait(1)
+    b.stop()
+    assert len(pressed) == 1 and pressed[0] < 0.2
+
+def test_held_at_startup_then_released():
+    backend = button.SimulatedBackend(idle_level=0)  # Level 0: held down across setup()
+    pressed, held = [], threading.Event()
+    b = button.Button(17, backend, on_press=pressed.append, on_long_press=held.set,
+                      debounce=0.01, long_press=0.3)
+    b.start()
+    assert b.pressed
+    time.sleep(0.05)
+    backend.set_level(17, 1)  # Released before the long press threshold
+    time.sleep(0.1)
+    assert len(pressed) == 1 and 0.04 < pressed[0] < 0.3
+    assert not held.is_set()
+    b.stop()
+
+def test_held_at_startup_fires_long_press():
+    backend = button.SimulatedBackend(idle_level=0)
+    held = threading.Event()
+    b = button.Button(17, backend, on_long_press=held.set, debounce=0.01, long_press=0.1)
+    b.start()
+    assert held.wait(1)
+    backend.set_level(17, 1)
+    time.sleep(0.05)
+    assert not b.pressed
+    b.stop()
@@ -0,0 +1,87 @@
+import http.client
+import io
+
+import pytest
+
+import captive_portal
+
+def parse(data):
+    """Split complete HTTP response bytes into (status line, headers dict, body)"""
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return lines[0], headers, body
+
+@pytest.mark.parametrize('path', captive_portal.PROBE_PATHS)
+@pytest.mark.parametrize('keep_alive', [True, False])
+def test_every_probe_path_redirects_to_the_portal(path, keep_alive):
+    status, headers, body = parse(captive_portal.lookup_bytes('GET', path, 'captive.apple.com',
+                                                              keep_alive))
+    assert status == 'HTTP/1.1 302 Found'
+    assert headers['Location'] == captive_portal.PORTAL_URL
+    assert headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+    assert headers['Connection'] == ('keep-alive' if keep_alive else 'close')
+    assert int(headers['Content-Length']) == len(body)
+    assert captive_portal.PORTAL_URL.encode() in body
+
+def test_head_gets_headers_only():
+    data = captive_portal.lookup_bytes('HEAD', '/generate_204', 'connectivitycheck.gstatic.com')
+    status, headers, body = parse(data)
+    assert status == 'HTTP/1.1 302 Found' and body == b''
+    assert int(headers['Content-Length']) > 0  # Length of the GET body, as HTTP requires
+    assert data.endswith(b'\r\n\r\n')
+
+@pytest.mark.parametrize('method, path, host', [
+    ('POST', '/generate_204', 'connectivitycheck.gstatic.com'),
+    ('GET', '/', captive_portal.PORTAL_IP),
+    ('GET', '/scan', f'{captive_portal.PORTAL_IP}:80'),
+    ('GET', '/status', 'raspberrypi.local'),
+    ('GET', '/', None),
+])
+def test_portal_requests_are_left_to_the_app(method, path, host):
+    assert captive_portal.lookup(method, path, host) is None
+    assert captive_portal.lookup_bytes(method, path, host) is None
+
+def test_foreign_hosts_are_redirected():
+    assert captive_portal.lookup('GET', '/', 'www.example.com') is captive_portal.REDIRECT
+    assert captive_portal.lookup_bytes('GET', '/news', 'WWW.Example.com:8080') == \
+        captive_portal.REDIRECT_BYTES[True]
+
+def test_wire_bytes_match_the_wsgi_responses():
+    for path, response in captive_portal.RESPONSES.items():
+        assert captive_portal.RESPONSE_BYTES[path, False] == \
+            captive_portal.to_bytes(response, keep_alive=False)
+
+def call(app, method, path, host):
+    started = []
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'HTTP_HOST': host}
+    body = b''.join(app(environ, lambda status, headers: started.append((status, dict(headers)))))
+    return started[0][0], started[0][1], body
+
+def test_middleware_answers_probes_before_the_app():
+    requests = []
+
+    def app(environ, start_response):
+        requests.append(environ['PATH_INFO'])
+        start_response('200 OK', [('Content-Length', '6')])
+        return [b'portal']
+
+    middleware = captive_portal.CaptivePortalMiddleware(app)
+    status, headers, body = call(middleware, 'GET', '/hotspot-detect.html', 'captive.apple.com')
+    assert status == '302 Found' and headers['Location'] == captive_portal.PORTAL_URL
+    assert call(middleware, 'HEAD', '/ncsi.txt', 'www.msftncsi.com')[2] == b''
+    assert call(middleware, 'GET', '/', captive_portal.PORTAL_IP) == \
+        ('200 OK', {'Content-Length': '6'}, b'portal')
+    assert requests == ['/']
+
+def test_response_bytes_parse_as_http():
+    """The prebuilt bytes are a valid HTTP/1.1 message for a real client parser"""
+    class Socket:
+        def makefile(self, mode):
+            return io.BytesIO(captive_portal.RESPONSE_BYTES['/generate_204', True])
+
+    response = http.client.HTTPResponse(Socket(), method='GET')
+    response.begin()
+    assert response.status == 302
+    assert response.getheader('Location') == captive_portal.PORTAL_URL
+    assert response.read() == captive_portal._REDIRECT_BODY
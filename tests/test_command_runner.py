@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pytest
+
+import command_runner
+import fakes
+import systemd_dbus
+
+class BrokenSystemd:
+    """systemd client whose bus fails mid-call"""
+
+    def __init__(self, error):
+        self.error = error
+
+    def handles(self, args):
+        return True
+
+    def systemctl(self, args, timeout):
+        raise self.error
+
+@pytest.mark.parametrize('error', [ConnectionResetError(104, 'Connection reset by peer'),
+                                   FileNotFoundError(2, 'No such file or directory'),
+                                   systemd_dbus.DBusError(systemd_dbus.DISCONNECTED, 'gone')])
+def test_bus_failure_falls_back_to_systemctl(error, caplog):
+    backend = fakes.FakeBackend(outputs={('systemctl', 'is-active'): 'active\n'})
+    runner = command_runner.CommandRunner(backend, drop_sudo=True, systemd=BrokenSystemd(error))
+    result = runner.run(['sudo', 'systemctl', 'is-active', 'hostapd'])
+    assert (result.returncode, result.stdout) == (0, 'active\n')
+    assert 'running systemctl' in caplog.text
+
+def test_fake_runner_records_calls():
+    runner = fakes.FakeCommandRunner(failures={('sudo', 'ip')})
+    assert runner.run(['sudo', 'ip', 'link']).returncode == 1
+    assert runner.systemctl('start', 'hostapd', 'dnsmasq').returncode == 0
+    assert [args for _, args in runner.calls] == [
+        ['sudo', 'ip', 'link'], ['sudo', 'systemctl', 'start', 'hostapd', 'dnsmasq']]
+
+def test_capture_false_passes_output_through(capfd):
+    runner = command_runner.CommandRunner(drop_sudo=False)
+    script = 'import sys; print("Reading package lists..."); sys.exit("E: Unable to locate package")'
+    result = runner.run([sys.executable, '-c', script], capture=False)
+    assert (result.returncode, result.stdout, result.stderr) == (1, None, None)
+    out, err = capfd.readouterr()
+    assert out == 'Reading package lists...\n'
+    assert err == 'E: Unable to locate package\n'
+
+def test_captured_output_is_kept_on_failure():
+    runner = command_runner.CommandRunner(drop_sudo=False)
+    with pytest.raises(subprocess.CalledProcessError) as failure:
+        runner.run([sys.executable, '-c', 'import sys; sys.exit("chmod: denied")'], check=True)
+    assert failure.value.stderr == 'chmod: denied\n'
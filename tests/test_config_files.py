@@ -0,0 +1,22 @@
+import config_files
+
+def test_passphrase_is_hashed_like_wpa_passphrase():
+    # IEEE 802.11i test vector
+    content = config_files.render_wpa_supplicant_networks([{'ssid': 'IEEE', 'psk': 'password'}])
+    assert 'psk=f42c6fc52df0ebef9ebb4b90b38a5f902e83fe1b135a70e23aed762e9710a12e' in content
+
+def test_quotes_and_newlines_cannot_inject_directives():
+    networks = [
+        {'ssid': 'Evil"\n}\nnetwork={\n ssid="x', 'psk': 'pass"\nkey_mgmt=NONE\n', 'priority': 2},
+        {'ssid': 'Home', 'psk': 'secret123', 'priority': 1},
+    ]
+    content = config_files.render_wpa_supplicant_networks(networks)
+    assert content.count('network={') == 2
+    assert 'key_mgmt=NONE' not in content
+    parsed = config_files.parse_wpa_supplicant_networks(content)
+    assert [network['ssid'] for network in parsed] == [networks[0]['ssid'], 'Home']
+
+def test_parses_quoted_configs_written_by_hand():
+    content = 'network={\n    ssid="Cafe"\n    psk="latte1234"\n}\n'
+    assert config_files.parse_wpa_supplicant_networks(content) == [
+        {'ssid': 'Cafe', 'psk': 'latte1234'}]
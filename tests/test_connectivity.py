@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+import pytest
+
+import connectivity
+import fakes
+
+@pytest.fixture
+def servers():
+    servers = fakes.StandInServers().start()
+    yield servers
+    servers.stop()
+
+def probe(servers, specs, timeout=1):
+    return connectivity.run_probes(connectivity.parse_targets(specs), timeout, servers.resolver)
+
+@pytest.mark.parametrize('kind', ['tcp', 'dns', 'http'])
+def test_each_probe_type_reaches_its_stand_in(servers, kind):
+    result = probe(servers, servers.targets((kind,)))
+    assert result['online']
+    assert result['target'].startswith(kind)
+    assert result['latency_ms'] is not None
+
+def test_captive_portal_is_offline(servers):
+    servers.http_status = 200
+    result = probe(servers, servers.targets(('http',)))
+    assert not result['online']
+    assert '200' in result['probes'][0]['error']
+
+def test_first_success_wins_over_unanswered_targets(servers):
+    servers.dns_drop = True
+    result = probe(servers, servers.targets(('dns', 'tcp')), timeout=2)
+    assert result['online'] and result['target'].startswith('tcp')
+    assert result['duration_ms'] < 1000
+
+def test_offline_results_back_off():
+    now = [0.0]
+    fake = fakes.FakeProbe(failure_rate=1.0)
+    checker = connectivity.ConnectivityChecker(['tcp://127.0.0.1:1'], probe=fake,
+                                               backoff=1, max_backoff=4, clock=lambda: now[0])
+    probed_at = []
+    while now[0] < 20:
+        runs = fake.runs
+        checker.check()
+        if fake.runs > runs:
+            probed_at.append(now[0])
+        now[0] += 0.5
+    assert probed_at[:4] == [0.0, 1.0, 3.0, 7.0]
+    assert all(b - a == 4 for a, b in zip(probed_at[4:], probed_at[5:]))
+
+def test_probe_engine_does_not_load_test_servers():
+    code = 'import sys, connectivity; print("http.server" in sys.modules)'
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=connectivity.__file__.rsplit('/', 1)[0])
+    assert output.stdout.strip() == 'False'
@@ -0,0 +1,113 @@
+import gzip
+import math
+
+import pytest
+
+import metrics_export
+
+@pytest.fixture
+def exporter():
+    exporter = metrics_export.MetricsExporter()
+    exporter.gauge('piap_cpu_usage_percent', "CPU usage")
+    exporter.counter('piap_state_transitions_total', "WiFi state transitions", labels=('to',))
+    exporter.histogram('piap_connect_seconds', "Connect duration", buckets=[5, 1, 2.5])
+    return exporter
+
+def lines(exporter, openmetrics=False):
+    return exporter.render(openmetrics).decode().splitlines()
+
+def test_prometheus_text_format(exporter):
+    exporter.set('piap_cpu_usage_percent', 12.5)
+    exporter.inc('piap_state_transitions_total', labels=('ap_ready',))
+    exporter.inc('piap_state_transitions_total', 2, labels=('ap_ready',))
+    assert lines(exporter) == [
+        '# HELP piap_cpu_usage_percent CPU usage',
+        '# TYPE piap_cpu_usage_percent gauge',
+        'piap_cpu_usage_percent 12.5',
+        '# HELP piap_state_transitions_total WiFi state transitions',
+        '# TYPE piap_state_transitions_total counter',
+        'piap_state_transitions_total{to="ap_ready"} 3',
+    ]
+
+def test_openmetrics_counters_are_declared_without_total(exporter):
+    exporter.inc('piap_state_transitions_total', labels=('client',))
+    text = exporter.render(openmetrics=True).decode()
+    assert text == ('# HELP piap_state_transitions WiFi state transitions\n'
+                    '# TYPE piap_state_transitions counter\n'
+                    'piap_state_transitions_total{to="client"} 1\n'
+                    '# EOF\n')
+
+def test_only_openmetrics_ends_with_eof(exporter):
+    assert exporter.render(openmetrics=True) == b'# EOF\n'  # No samples yet
+    assert exporter.render() == b''
+    exporter.set('piap_cpu_usage_percent', 1)
+    assert exporter.render(openmetrics=True).endswith(b'\n# EOF\n')
+    assert b'# EOF' not in exporter.render()
+
+def test_histogram_buckets_are_sorted_and_cumulative(exporter):
+    for value in (0.4, 2.0, 3.0, 30.0):
+        exporter.observe('piap_connect_seconds', value)
+    assert lines(exporter) == [
+        '# HELP piap_connect_seconds Connect duration',
+        '# TYPE piap_connect_seconds histogram',
+        'piap_connect_seconds_bucket{le="1.0"} 1',
+        'piap_connect_seconds_bucket{le="2.5"} 2',
+        'piap_connect_seconds_bucket{le="5.0"} 3',
+        'piap_connect_seconds_bucket{le="+Inf"} 4',
+        'piap_connect_seconds_sum 35.4',
+        'piap_connect_seconds_count 4',
+    ]
+
+def test_set_histogram_from_counts_kept_elsewhere():
+    exporter = metrics_export.MetricsExporter()
+    exporter.histogram('piap_probe_seconds', "Probe latency", buckets=[0.1], labels=('target',))
+    exporter.set_histogram('piap_probe_seconds', (3, 5), 0.75, 5, labels=('dns',))
+    assert lines(exporter, openmetrics=True)[2:] == [
+        'piap_probe_seconds_bucket{target="dns",le="0.1"} 3',
+        'piap_probe_seconds_bucket{target="dns",le="+Inf"} 5',
+        'piap_probe_seconds_sum{target="dns"} 0.75',
+        'piap_probe_seconds_count{target="dns"} 5',
+        '# EOF',
+    ]
+
+@pytest.mark.parametrize('value, text', [
+    (True, '1'), (False, '0'), (7, '7'), (0.5, '0.5'),
+    (math.inf, '+Inf'), (-math.inf, '-Inf'), (math.nan, 'NaN'),
+])
+def test_format_value(value, text):
+    assert metrics_export.format_value(value) == text
+
+def test_label_values_are_escaped():
+    exporter = metrics_export.MetricsExporter()
+    exporter.gauge('piap_network_info', "Network", labels=('ssid',))
+    exporter.set('piap_network_info', 1, labels=('My "Home"\\Net\nwork',))
+    assert lines(exporter)[-1] == 'piap_network_info{ssid="My \\"Home\\"\\\\Net\\nwork"} 1'
+
+def test_none_removes_a_sample_and_its_family_header(exporter):
+    exporter.update({'piap_cpu_usage_percent': 3})
+    exporter.set('piap_cpu_usage_percent', None)
+    assert exporter.render() == b''
+
+def test_asset_is_rebuilt_only_after_a_change(exporter):
+    exporter.set('piap_cpu_usage_percent', 12.5)
+    asset = exporter.asset()
+    version = exporter.version
+    exporter.set('piap_cpu_usage_percent', 12.5)  # Same value: nothing to do
+    assert exporter.version == version and exporter.asset() is asset
+    exporter.set('piap_cpu_usage_percent', 13)
+    changed = exporter.asset()
+    assert changed is not asset
+    assert changed['variants']['identity'][1] != asset['variants']['identity'][1]
+    assert asset['content_type'] == metrics_export.PROMETHEUS_TYPE
+    assert exporter.asset(openmetrics=True)['content_type'] == metrics_export.OPENMETRICS_TYPE
+
+def test_large_bodies_get_a_gzip_variant():
+    exporter = metrics_export.MetricsExporter()
+    exporter.gauge('piap_interface_up', "Interface up", labels=('interface',))
+    for index in range(20):
+        exporter.set('piap_interface_up', 1, labels=(f'veth{index}',))
+    variants = exporter.asset()['variants']
+    body, etag = variants['identity']
+    gzipped, gzip_etag = variants['gzip']
+    assert gzip.decompress(gzipped) == body
+    assert gzip_etag == etag[:-1] + '-gz"'
@@ -0,0 +1,26 @@
+import time
+
+import pytest
+
+import metrics_history
+
+@pytest.mark.parametrize('text', ['inf', '-inf', 'nan', 'infm', '1e400', '0', '-5m', 'abc'])
+def test_parse_range_rejects_bad_values(text):
+    with pytest.raises(ValueError):
+        metrics_history.parse_range(text)
+
+def test_parse_range_clamps_to_retention():
+    assert metrics_history.parse_range('10m') == 600
+    assert metrics_history.parse_range('7d') == metrics_history.MAX_RANGE
+    assert metrics_history.parse_range(' ') == 600
+
+def test_wall_clock_step_keeps_recent_samples(monkeypatch):
+    history = metrics_history.MetricsHistory(['cpu'])
+    for value in range(5):
+        history.record('cpu', value)
+    # NTP steps the wall clock back an hour; the monotonic buffer is unaffected
+    wall = time.time()
+    monkeypatch.setattr(metrics_history.time, 'time', lambda: wall - 3600)
+    points = history.query('cpu', 60)['points']
+    assert [point[1] for point in points][-1] == 4
+    assert abs(points[-1][0] - (wall - 3600)) < 5
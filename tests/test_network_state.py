@@ -0,0 +1,73 @@
+import ctypes
+import os
+import struct
+
+import network_state
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'network_state')
+PROC = os.path.join(FIXTURES, 'proc')
+SYS = os.path.join(FIXTURES, 'sys')
+
+def recorded_ioctl(ssid=b'Home', bitrate=72200000, frequency=(2437, 6)):
+    """Answer wireless extension ioctls with recorded iwreq data"""
+    def ioctl(interface, request, data):
+        if interface != 'wlan0':
+            raise OSError(19, 'No such device')
+        if request == network_state.SIOCGIWESSID:
+            address, _, flags = struct.unpack('PHH', data)
+            ctypes.memmove(address, ssid, len(ssid))
+            payload = struct.pack('PHH', address, len(ssid), flags)
+        elif request == network_state.SIOCGIWRATE:
+            payload = struct.pack('i', bitrate)
+        elif request == network_state.SIOCGIWFREQ:
+            payload = struct.pack('ih', *frequency)
+        else:
+            raise OSError(95, 'Operation not supported')
+        return struct.pack('16s', interface.encode()) + payload.ljust(16, b'\0')
+    return ioctl
+
+def test_fixture_addresses_include_ipv4_and_ipv6():
+    addresses = network_state.read_addresses('wlan0', PROC, SYS)
+    assert addresses == [
+        {'family': 'inet', 'address': '192.168.1.42', 'prefixlen': 24, 'scope': 0},
+        {'family': 'inet6', 'address': 'fe80::ba27:ebff:fe12:3456', 'prefixlen': 64,
+         'scope': 0x20}
+    ]
+
+def test_fib_trie_addresses_are_matched_to_their_interface():
+    assert network_state._proc_inet4_addresses('eth0', PROC) == [
+        {'family': 'inet', 'address': '10.1.2.3', 'prefixlen': 8, 'scope': 0}
+    ]
+    assert network_state._proc_inet4_addresses('wlan1', PROC) == []
+
+def test_netlink_failure_is_logged_and_falls_back(monkeypatch, caplog):
+    def fail(ifindex):
+        raise PermissionError(13, 'Permission denied')
+    monkeypatch.setattr(network_state, '_netlink_addresses', fail)
+    monkeypatch.setattr(network_state, 'PROC_ROOT', PROC)
+    monkeypatch.setattr(network_state, 'SYS_ROOT', SYS)
+    addresses = network_state.read_addresses('wlan0', PROC, SYS)
+    assert [a['address'] for a in addresses] == ['192.168.1.42', 'fe80::ba27:ebff:fe12:3456']
+    assert 'Netlink address dump failed' in caplog.text
+
+def test_link_info_from_fixtures():
+    info = network_state.get_link_info('wlan0', PROC, SYS, ioctl=recorded_ioctl())
+    assert info['exists'] and info['carrier']
+    assert info['operstate'] == 'up'
+    assert info['mac'] == 'b8:27:eb:12:34:56'
+    assert (info['rx_bytes'], info['tx_bytes']) == (123456, 654321)
+    assert (info['link_quality'], info['signal_dbm'], info['noise_dbm']) == (54, -56, None)
+    assert info['ssid'] == 'Home'
+    assert info['bitrate_mbps'] == 72.2
+    assert info['frequency_mhz'] == 2437
+    assert len(info['addresses']) == 2
+
+def test_link_info_without_ioctl_skips_wireless_details():
+    info = network_state.get_link_info('wlan0', PROC, SYS)
+    assert info['signal_dbm'] == -56
+    assert info['ssid'] is None and info['bitrate_mbps'] is None
+
+def test_missing_interface():
+    info = network_state.get_link_info('wlan1', PROC, SYS, ioctl=recorded_ioctl())
+    assert not info['exists']
+    assert network_state.read_addresses('wlan1', PROC, SYS) == []
@@ -0,0 +1,79 @@
+import types
+
+import pytest
+
+import access_point
+import config_files
+import fakes
+import orchestrator
+
+class Clock:
+    """Stand-in for the time module that records sleeps instead of sleeping"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    fake_time = types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep)
+    monkeypatch.setattr(orchestrator, 'time', fake_time)
+    monkeypatch.setattr(fakes, 'time', fake_time)  # FakeProbes delays
+    return clock
+
+def test_probe_polling_backs_off_until_the_timeout(clock):
+    calls = []
+    probes = types.SimpleNamespace(unit_active=lambda unit: calls.append(unit) and False)
+    step = orchestrator.Step('start', ready=('unit_active', 'hostapd'), timeout=3)
+    result = orchestrator._run_step(step, fakes.FakeCommandRunner(), probes, 0.0)
+    assert result['status'] == 'failed' and 'not ready after 3s' in result['error']
+    assert clock.sleeps == [0.2, 0.3, 0.45, 0.675, 1.0, 0.375]
+    assert len(calls) == 7
+
+def test_kernel_probes_start_polling_sooner(clock):
+    probes = types.SimpleNamespace(interface_up=lambda interface: False)
+    step = orchestrator.Step('link_up', ready=('interface_up', 'wlan0'), timeout=1)
+    orchestrator._run_step(step, fakes.FakeCommandRunner(), probes, 0.0)
+    assert clock.sleeps == [0.05, 0.075, 0.113, 0.169, 0.253, 0.341]
+
+def test_ready_probe_stops_polling(clock):
+    probes = fakes.FakeProbes({'unit_active': 0.4})
+    step = orchestrator.Step('start', ready=('unit_active', 'hostapd'))
+    result = orchestrator._run_step(step, fakes.FakeCommandRunner(), probes, 0.0)
+    assert result['status'] == 'ok'
+    assert clock.sleeps == [0.2, 0.3]
+
+def test_callable_returning_false_fails_the_step():
+    steps = [
+        orchestrator.Step('write_config', lambda runner: False),
+        orchestrator.Step('start', ['sudo', 'systemctl', 'restart', 'hostapd'],
+                          after=['write_config']),
+        orchestrator.Step('log', lambda runner: None),
+    ]
+    runner = fakes.FakeCommandRunner()
+    result = orchestrator.run_steps(steps, runner, fakes.FakeProbes())
+    assert not result.ok
+    assert result.steps['write_config']['status'] == 'failed'
+    assert result.steps['write_config']['error'] == 'write_config reported failure'
+    assert result.steps['start']['status'] == 'skipped'
+    assert result.steps['log']['status'] == 'ok'  # None is not a failure
+    assert runner.calls == []
+
+def test_config_write_failure_is_reported(tmp_path, monkeypatch):
+    blocker = tmp_path / 'dnsmasq.d'
+    blocker.write_text('')  # A file where the directory should be
+    monkeypatch.setattr(config_files, 'CAPTIVE_DNS_CONF', str(blocker / 'captive-portal.conf'))
+    step = orchestrator.Step('captive_dns_config',
+                             lambda runner: access_point.write_captive_dns_config(),
+                             required=False)
+    result = orchestrator.run_steps([step], fakes.FakeCommandRunner(), fakes.FakeProbes())
+    assert result.ok  # Not required
+    assert result.steps['captive_dns_config']['status'] == 'failed'
@@ -0,0 +1,96 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+import static_assets
+import web_config
+
+PAGE = '<html><body>' + 'WiFi setup ' * 100 + '</body></html>'
+
+@pytest.fixture
+def client(monkeypatch):
+    """App serving PAGE as a gzip-only asset (brotli may not be installed here)"""
+    monkeypatch.setattr(static_assets, 'brotli', None)
+    asset = static_assets.build_asset(PAGE)
+    app = Flask(__name__)
+    app.add_url_rule('/', 'page', lambda: static_assets.asset_response(asset))
+    return app.test_client()
+
+def test_build_asset_variants_have_their_own_etags(monkeypatch):
+    monkeypatch.setattr(static_assets, 'brotli', None)
+    asset = static_assets.build_asset(PAGE)
+    body, etag = asset['variants']['identity']
+    gzipped, gzip_etag = asset['variants']['gzip']
+    assert body == PAGE.encode() and gzip.decompress(gzipped) == body
+    assert gzip_etag == etag[:-1] + '-gz"' and etag.startswith('"')
+    assert static_assets.build_asset(PAGE) == asset  # mtime=0: stable across restarts
+
+def test_small_bodies_are_not_compressed():
+    asset = static_assets.build_asset('<p>ok</p>')
+    assert list(asset['variants']) == ['identity']
+
+@pytest.mark.parametrize('header, expected', [
+    (None, 'identity'),
+    ('', 'identity'),
+    ('gzip, deflate', 'gzip'),
+    ('GZIP', 'gzip'),
+    ('deflate, gzip;q=0.5', 'gzip'),
+    ('gzip;q=0', 'identity'),
+    ('*', 'gzip'),
+    ('br', 'identity'),  # No brotli variant without the brotli package
+    ('identity', 'identity'),
+])
+def test_encoding_negotiation(monkeypatch, header, expected):
+    monkeypatch.setattr(static_assets, 'brotli', None)
+    assert static_assets.choose_encoding(static_assets.build_asset(PAGE), header) == expected
+
+def test_brotli_preferred_when_available():
+    asset = static_assets.build_asset(PAGE)
+    asset['variants']['br'] = (b'brotli bytes', '"tag-br"')
+    assert static_assets.choose_encoding(asset, 'gzip, deflate, br') == 'br'
+    assert static_assets.choose_encoding(asset, 'gzip, br;q=0') == 'gzip'
+
+@pytest.mark.parametrize('header, matches', [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"old", "abc"', True),
+    ('*', True),
+    ('"abc-gz"', False),
+    (None, False),
+])
+def test_etag_matching(header, matches):
+    assert static_assets.etag_matches(header, '"abc"') == matches
+
+def test_gzip_response_and_304(client):
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Cache-Control'] == static_assets.HTML_CACHE_CONTROL
+    assert response.content_type == static_assets.HTML_TYPE
+    assert gzip.decompress(response.data) == PAGE.encode()
+
+    etag = response.headers['ETag']
+    revalidated = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+    assert 'Content-Encoding' not in revalidated.headers
+
+def test_etag_of_another_encoding_gets_the_full_page(client):
+    gzip_etag = client.get('/', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    response = client.get('/', headers={'If-None-Match': gzip_etag})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == PAGE.encode()
+    assert response.headers['ETag'] != gzip_etag
+
+def test_config_page_is_served_prerendered():
+    client = web_config.app.test_client()
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    again = client.get('/', headers={'Accept-Encoding': 'gzip',
+                                     'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
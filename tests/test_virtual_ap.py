@@ -0,0 +1,153 @@
+import os
+
+import pytest
+
+import access_point
+import config_files
+import credential_store
+import virtual_ap
+import web_config
+import wifi_scan
+import wifi_state
+import wpa_ctrl
+from fakes import FakeCommandRunner, FakeProbes, FakeStation
+from orchestrator import run_steps
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'virtual_ap')
+
+STOP_AP = ['sudo', 'systemctl', 'stop', 'hostapd', 'dnsmasq']
+DELETE_UAP0 = ['sudo', 'iw', 'dev', 'uap0', 'del']
+RESTART_HOSTAPD = ['sudo', 'systemctl', 'restart', 'hostapd']
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+def commands(runner, since=0):
+    return [args for _, args in runner.calls[since:]]
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_files, 'HOSTAPD_CONF', str(tmp_path / 'hostapd.conf'))
+    monkeypatch.setattr(config_files, 'CAPTIVE_DNS_CONF', str(tmp_path / 'captive-portal.conf'))
+    monkeypatch.setattr(config_files, 'WPA_SUPPLICANT_CONF', str(tmp_path / 'wpa_supplicant.conf'))
+    return tmp_path
+
+def make_ap(station):
+    """VirtualAP brought up on fakes; returns it with the index of its first connect command"""
+    runner = FakeCommandRunner()
+    ap = virtual_ap.VirtualAP('PiConfigWiFi', '12345678', '192.168.4.1', runner, FakeProbes(),
+                              station=station, check_interval=0.01)
+    assert run_steps(ap.setup_steps(), runner, ap.probes).ok
+    return ap, len(runner.calls)
+
+def test_supports_concurrent_on_brcmfmac_capture():
+    assert virtual_ap.supports_concurrent(read_fixture('iw_list_brcmfmac.txt'))
+
+def test_supports_concurrent_needs_ap_and_managed_in_one_combination():
+    # 'AP' is a supported mode here, but never alongside 'managed'
+    assert not virtual_ap.supports_concurrent(read_fixture('iw_list_no_ap_combination.txt'))
+    assert not virtual_ap.supports_concurrent('')
+
+def test_detect_support_reads_iw_list():
+    runner = FakeCommandRunner(outputs={('iw', 'list'): read_fixture('iw_list_brcmfmac.txt')})
+    assert virtual_ap.detect_support(runner)
+    assert commands(runner) == [['iw', 'list']]
+
+def test_setup_follows_the_station_channel(config_dir):
+    ap, _ = make_ap(FakeStation(channel=3))
+    assert ap.channel == 3
+    with open(config_files.HOSTAPD_CONF) as f:
+        config = f.read()
+    assert 'interface=uap0\n' in config and 'channel=3\n' in config
+
+def test_channel_move_happens_before_the_join(config_dir):
+    station = FakeStation()
+    ap, start = make_ap(station)
+    joined_after = []
+    join = station.join
+
+    def recording_join(ssid, timeout):
+        joined_after.append(commands(ap.runner, start))
+        return join(ssid, timeout)
+
+    station.join = recording_join
+    states = []
+
+    assert ap.connect('Home', 1.0, channel=11, on_state=states.append) == wpa_ctrl.CONNECTED
+    assert states == ['moving_ap_channel', 'associating', 'checking_internet']
+    assert joined_after == [[RESTART_HOSTAPD]]
+    assert ap.channel == 11
+    with open(config_files.HOSTAPD_CONF) as f:
+        assert 'channel=11\n' in f.read()
+
+def test_same_channel_joins_without_restarting_hostapd(config_dir):
+    ap, start = make_ap(FakeStation())
+    states = []
+    assert ap.connect('Home', 1.0, channel=virtual_ap.DEFAULT_CHANNEL,
+                      on_state=states.append) == wpa_ctrl.CONNECTED
+    assert states == ['associating', 'checking_internet']
+    assert commands(ap.runner, start) == []
+
+@pytest.mark.parametrize('options, outcome', [
+    ({'outcome': wpa_ctrl.WRONG_PASSWORD}, wpa_ctrl.WRONG_PASSWORD),
+    ({'internet_after': None}, wpa_ctrl.TIMEOUT),
+])
+def test_failed_join_keeps_the_ap_up(config_dir, options, outcome):
+    ap, start = make_ap(FakeStation(**options))
+    assert ap.connect('Home', 0.1) == outcome
+    assert commands(ap.runner, start) == []  # Nothing stopped, nothing deleted
+
+@pytest.fixture
+def portal(config_dir, monkeypatch):
+    """web_config and access_point wired to a concurrent AP on fakes"""
+    machine = wifi_state.WifiStateMachine(str(config_dir / 'wifi_status.json'))
+    machine.transition(wifi_state.AP_STARTING, 'button', ap_owner='button')
+    machine.transition(wifi_state.AP_READY, 'button')
+    connected = []
+    monkeypatch.setattr(wifi_state, 'machine', machine)
+    monkeypatch.setattr(access_point, 'wifi', machine)
+    monkeypatch.setattr(access_point, 'web_host_server', None)
+    monkeypatch.setattr(access_point, 'AP_TEARDOWN_DELAY', 0)
+    monkeypatch.setattr(web_config, 'credentials',
+                        credential_store.CredentialStore(str(config_dir / 'known_networks.json')))
+    monkeypatch.setattr(web_config, 'scan_cache', wifi_scan.ScanCache(lambda: []))
+    monkeypatch.setattr(web_config, 'on_connected', lambda: connected.append(True))
+    monkeypatch.setattr(web_config, 'connect_jobs', {})
+
+    def start(station):
+        ap, since = make_ap(station)
+        monkeypatch.setattr(web_config, 'concurrent_ap', ap)
+        monkeypatch.setattr(access_point, 'concurrent_ap', ap)
+        monkeypatch.setattr(access_point.command_runner, 'runner', ap.runner)
+        monkeypatch.setattr(access_point, 'system_probes', ap.probes)
+        return ap, since
+    return {'machine': machine, 'connected': connected, 'start': start}
+
+def test_failed_connect_job_leaves_the_portal_running(portal):
+    station = FakeStation(outcome=wpa_ctrl.WRONG_PASSWORD)
+    ap, start = portal['start'](station)
+    job = web_config.create_connect_job('Home')
+
+    web_config.run_connect_job(job, 'wrong-password')
+    assert job['state'] == 'failed'
+    assert portal['connected'] == []
+    assert station.calls == [('join', 'Home'), ('reload',)]
+    assert STOP_AP not in commands(ap.runner, start)
+    assert DELETE_UAP0 not in commands(ap.runner, start)
+    assert portal['machine'].state == wifi_state.AP_READY
+
+def test_ap_is_cleaned_up_only_after_a_successful_connect(portal):
+    ap, start = portal['start'](FakeStation())
+    job = web_config.create_connect_job('Home')
+
+    web_config.run_connect_job(job, 'secret123')
+    assert job['state'] == 'connected'
+    assert portal['connected'] == [True]
+    assert commands(ap.runner, start) == []  # The portal shows the result first
+
+    # on_connected in the daemon is access_point.on_client_connected
+    access_point.on_client_connected()
+    cleanup = commands(ap.runner, start)
+    assert cleanup == [STOP_AP, DELETE_UAP0]
+    assert portal['machine'].state == wifi_state.CLIENT
@@ -0,0 +1,28 @@
+import watchdog
+
+def test_rearm_fires_on_offline_again_after_failed_setup():
+    clock = watchdog.SimulatedClock()
+    offline = []
+
+    def on_offline():
+        offline.append(clock())
+        if len(offline) == 1:
+            dog.rearm()  # The access point failed to start
+
+    dog = watchdog.ConnectivityWatchdog(check=lambda: (False, False), on_offline=on_offline,
+                                        loss_seconds=120, clock=clock)
+    while clock() < 400:
+        clock.advance(dog.tick())
+    assert len(offline) == 2
+    assert offline[1] - offline[0] >= 120
+    assert dog.state == watchdog.OFFLINE
+
+def test_without_rearm_on_offline_fires_once():
+    clock = watchdog.SimulatedClock()
+    offline = []
+    dog = watchdog.ConnectivityWatchdog(check=lambda: (False, False),
+                                        on_offline=lambda: offline.append(clock()),
+                                        loss_seconds=120, clock=clock)
+    while clock() < 400:
+        clock.advance(dog.tick())
+    assert len(offline) == 1
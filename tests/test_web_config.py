@@ -0,0 +1,111 @@
+import queue
+import time
+import types
+
+import pytest
+
+import command_runner
+import config_files
+import connectivity
+import credential_store
+import web_config
+import wifi_scan
+import wifi_state
+import wpa_ctrl
+from fakes import FakeCommandRunner
+
+@pytest.fixture
+def portal(tmp_path, monkeypatch):
+    """Single-interface portal on a fake system layer; returns a Flask test client"""
+    machine = wifi_state.WifiStateMachine(str(tmp_path / 'wifi_status.json'))
+    machine.transition(wifi_state.AP_STARTING, 'button', ap_owner='button')
+    machine.transition(wifi_state.AP_READY, 'button')
+    runner = FakeCommandRunner()
+    outcome = {'association': wpa_ctrl.CONNECTED}
+    events = []
+
+    def wait_for_association(ssid, deadline):
+        events.append(('associating', ssid))
+        return outcome['association']
+
+    monkeypatch.setattr(config_files, 'WPA_SUPPLICANT_CONF', str(tmp_path / 'wpa_supplicant.conf'))
+    monkeypatch.setattr(wifi_state, 'machine', machine)
+    monkeypatch.setattr(command_runner, 'runner', runner)
+    monkeypatch.setattr(connectivity, 'internet_reachable', lambda fresh=False: True)
+    monkeypatch.setattr(web_config, 'credentials',
+                        credential_store.CredentialStore(str(tmp_path / 'known_networks.json')))
+    monkeypatch.setattr(web_config, 'scan_cache', wifi_scan.ScanCache(lambda: []))
+    monkeypatch.setattr(web_config, 'concurrent_ap', None)
+    monkeypatch.setattr(web_config, 'on_connected', lambda: events.append(('connected',)))
+    monkeypatch.setattr(web_config, 'connect_jobs', {})
+    monkeypatch.setattr(web_config, 'connect_queue', queue.Queue())
+    monkeypatch.setattr(web_config, 'connect_worker', None)
+    monkeypatch.setattr(web_config, 'wait_for_association', wait_for_association)
+    # Skip the one-second settle sleeps between interface commands
+    monkeypatch.setattr(web_config, 'time', types.SimpleNamespace(
+        time=time.time, monotonic=time.monotonic, sleep=lambda seconds: None))
+    return types.SimpleNamespace(client=web_config.app.test_client(), runner=runner,
+                                 machine=machine, outcome=outcome, events=events)
+
+def poll(client, status_url, timeout=5):
+    """GET status_url until the job finishes; returns the last response body"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get(status_url)
+        assert response.status_code == 200
+        job = response.get_json()
+        if job['state'] in ('connected', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job still {job['state']} after {timeout}s")
+
+def states(job):
+    return [transition['state'] for transition in job['transitions']]
+
+def test_connect_returns_202_and_the_job_finishes(portal):
+    response = portal.client.post('/connect', json={'ssid': 'Home', 'password': 'secret123'})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['success'] and body['status_url'] == f"/connect/{body['job_id']}"
+
+    job = poll(portal.client, body['status_url'])
+    assert job['success'] and job['id'] == body['job_id'] and job['ssid'] == 'Home'
+    assert states(job) == ['queued', 'writing_config', 'stopping_ap', 'restarting_network',
+                           'associating', 'checking_internet', 'connected']
+    assert job['error'] is None and job['duration'] is not None
+    assert portal.events == [('associating', 'Home'), ('connected',)]
+    assert web_config.credentials.get('Home') is not None
+    with open(config_files.WPA_SUPPLICANT_CONF) as f:
+        assert f"ssid={'Home'.encode().hex()}\n" in f.read()
+
+def test_wrong_password_job_fails_and_restores_the_ap(portal):
+    portal.outcome['association'] = wpa_ctrl.WRONG_PASSWORD
+    response = portal.client.post('/connect', json={'ssid': 'Home', 'password': 'wrong-pass'})
+    job = poll(portal.client, response.get_json()['status_url'])
+
+    assert states(job)[-3:] == ['associating', 'restoring_ap', 'failed']
+    assert job['error'] == "Authentication failed - check the WiFi password"
+    assert portal.events == [('associating', 'Home')]
+    assert portal.machine.state == wifi_state.AP_READY
+    assert web_config.credentials.get('Home') is None  # A new network is forgotten again
+    commands = [args for _, args in portal.runner.calls]
+    assert ['sudo', 'systemctl', 'start', 'hostapd', 'dnsmasq', 'dhcpcd'] in commands
+
+def test_jobs_run_one_at_a_time_in_order(portal):
+    job_ids = [portal.client.post('/connect', json={'ssid': ssid, 'password': 'secret123'})
+               .get_json()['job_id'] for ssid in ('First', 'Second')]
+    jobs = [poll(portal.client, f'/connect/{job_id}') for job_id in job_ids]
+    assert [job['state'] for job in jobs] == ['connected', 'connected']
+    assert portal.events == [('associating', 'First'), ('connected',),
+                             ('associating', 'Second'), ('connected',)]
+
+def test_connect_requires_ssid_and_password(portal):
+    response = portal.client.post('/connect', json={'ssid': 'Home'})
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'error': 'Missing SSID or password'}
+    assert web_config.connect_jobs == {}
+
+def test_unknown_job_is_404(portal):
+    response = portal.client.get('/connect/0123456789ab')
+    assert response.status_code == 404
+    assert response.get_json()['success'] is False
@@ -0,0 +1,109 @@
+import http.client
+
+import pytest
+
+import web_host
+
+def text_app(text):
+    """WSGI app answering every request with text"""
+    body = text.encode()
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+@pytest.fixture
+def loads():
+    """Loaders for both modes that record every import"""
+    loaded = []
+
+    def loader(mode):
+        def load():
+            loaded.append(mode)
+            return text_app(mode)
+        return load
+    loaders = {web_host.PORTAL: loader(web_host.PORTAL), web_host.ADMIN: loader(web_host.ADMIN)}
+    return loaders, loaded
+
+@pytest.fixture
+def stopped_samplers(monkeypatch):
+    stops = []
+    monkeypatch.setattr(web_host, 'stop_admin_sampler', lambda: stops.append(True))
+    return stops
+
+def get(port, path='/'):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+def call(dispatcher, path='/'):
+    statuses = []
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    body = b''.join(dispatcher(environ, lambda status, headers: statuses.append(status)))
+    return statuses[0], body
+
+def test_dispatcher_loads_each_app_once_on_first_use(loads):
+    loaders, loaded = loads
+    dispatcher = web_host.ModeDispatcher(loaders, mode=web_host.PORTAL)
+    assert loaded == [] and dispatcher.last_request is None
+    assert call(dispatcher) == ('200 OK', b'portal')
+    assert call(dispatcher) == ('200 OK', b'portal')
+    assert loaded == [web_host.PORTAL]
+    assert dispatcher.last_request is not None
+
+def test_switch_routes_the_next_request(loads, stopped_samplers):
+    loaders, loaded = loads
+    host = web_host.WebHost(loaders=loaders)
+    assert call(host.dispatcher) == ('200 OK', b'admin')
+
+    host.switch(web_host.PORTAL)
+    assert host.mode == web_host.PORTAL
+    assert call(host.dispatcher) == ('200 OK', b'portal')
+    assert stopped_samplers == [True]  # Leaving the admin panel stops its samplers
+
+    host.switch(web_host.PORTAL)  # Already there: nothing to do
+    host.switch(web_host.ADMIN)
+    assert call(host.dispatcher) == ('200 OK', b'admin')
+    assert loaded == [web_host.ADMIN, web_host.PORTAL]
+    assert stopped_samplers == [True]
+
+def test_preload_imports_every_app(loads):
+    loaders, loaded = loads
+    web_host.WebHost(loaders=loaders).preload()
+    assert sorted(loaded) == [web_host.ADMIN, web_host.PORTAL]
+
+def test_fast_response_only_answers_probes_in_portal_mode(loads, stopped_samplers):
+    loaders, _ = loads
+    host = web_host.WebHost(loaders=loaders)
+    assert host.fast_response('GET', '/generate_204', 'connectivitycheck.gstatic.com', True) is None
+    assert host.idle_seconds() is None
+
+    host.switch(web_host.PORTAL)
+    response = host.fast_response('GET', '/generate_204', 'connectivitycheck.gstatic.com', True)
+    assert response.startswith(b'HTTP/1.1 302 Found\r\n')
+    assert host.idle_seconds() is not None
+    assert host.fast_response('GET', '/', '127.0.0.1', True) is None  # Left to the app
+
+@pytest.mark.parametrize('server', [web_host.ASYNC, web_host.THREADED])
+def test_mode_switch_keeps_the_port(loads, stopped_samplers, server):
+    loaders, _ = loads
+    host = web_host.WebHost('127.0.0.1', 0, loaders=loaders, server=server)
+    host.preload()
+    host.start()
+    try:
+        port = host.server.server_port
+        assert get(port) == (200, b'admin')
+        host.switch(web_host.PORTAL)
+        assert get(port) == (200, b'portal')
+        host.switch(web_host.ADMIN)
+        assert get(port) == (200, b'admin')
+        assert host.server.server_port == port
+    finally:
+        host.stop()
+    assert host.server is None and host.thread is None
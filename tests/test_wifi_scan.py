@@ -0,0 +1,180 @@
+import os
+import threading
+import types
+
+import pytest
+
+import wifi_scan
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'wifi_scan')
+
+# bssid, ssid, signal_dbm, channel, frequency_mhz, security; same cells in both captures
+EXPECTED = [
+    ('b8:27:eb:12:34:56', 'Home', -52, 6, 2437, 'WPA2'),
+    ('3c:37:86:aa:10:01', 'Cafe Guest', -69, 1, 2412, 'open'),
+    ('00:14:6c:7e:40:80', 'OldRouter', -85, 11, 2462, 'WEP'),
+    ('dc:a6:32:01:02:03', 'Home-WPA3', -60, 36, 5180, 'WPA3'),  # PSK + SAE transition mode
+    ('b8:27:eb:12:34:57', None, -48, 6, 2437, 'WPA2'),  # Hidden SSID
+]
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+def summary(results):
+    return [(bss['bssid'], bss['ssid'], bss['signal_dbm'], bss['channel'],
+             bss['frequency_mhz'], bss['security']) for bss in results]
+
+def test_parse_iwlist_capture():
+    results = wifi_scan.parse_iwlist(read_fixture('iwlist_scan.txt'))
+    assert summary(results) == EXPECTED
+    assert [bss['quality'] for bss in results] == [83, 59, 36, 71, 89]
+    assert not any(bss['associated'] for bss in results)
+
+def test_parse_iw_capture():
+    results = wifi_scan.parse_iw(read_fixture('iw_dev_scan.txt'))
+    assert summary(results) == EXPECTED
+    assert [bss['associated'] for bss in results] == [True, False, False, False, False]
+
+@pytest.mark.parametrize('suites, security', [
+    ('PSK', 'WPA2'),
+    ('PSK SAE', 'WPA3'),
+    ('SAE', 'WPA3'),
+    ('PSK 00-0f-ac:8', 'WPA3'),  # iw releases that do not name SAE
+    ('IEEE 802.1X', 'WPA2-Enterprise'),
+])
+def test_iw_rsn_authentication_suites(suites, security):
+    output = ('BSS 02:00:00:00:00:01(on wlan0)\n'
+              '\tfreq: 2437\n'
+              '\tcapability: ESS Privacy ShortSlotTime (0x0411)\n'
+              '\tsignal: -50.00 dBm\n'
+              '\tSSID: Test\n'
+              '\tRSN:\t * Version: 1\n'
+              '\t\t * Group cipher: CCMP\n'
+              '\t\t * Pairwise ciphers: CCMP\n'
+              f'\t\t * Authentication suites: {suites}\n')
+    assert wifi_scan.parse_iw(output)[0]['security'] == security
+
+def test_iw_wpa1_network():
+    output = ('BSS 02:00:00:00:00:02(on wlan0)\n'
+              '\tfreq: 2412\n'
+              '\tcapability: ESS Privacy (0x0011)\n'
+              '\tsignal: -70.00 dBm\n'
+              '\tSSID: Legacy\n'
+              '\tWPA:\t * Version: 1\n'
+              '\t\t * Group cipher: TKIP\n'
+              '\t\t * Pairwise ciphers: TKIP\n'
+              '\t\t * Authentication suites: PSK\n')
+    assert wifi_scan.parse_iw(output)[0]['security'] == 'WPA'
+
+def test_best_by_ssid_keeps_the_strongest_named_bss():
+    results = wifi_scan.parse_iw(read_fixture('iw_dev_scan.txt'))
+    results.append(dict(results[0], bssid='b8:27:eb:12:34:58', signal_dbm=-40))
+    best = wifi_scan.best_by_ssid(results)
+    assert [(bss['ssid'], bss['signal_dbm']) for bss in best] == [
+        ('Home', -40), ('Home-WPA3', -60), ('Cafe Guest', -69), ('OldRouter', -85)
+    ]
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(wifi_scan, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+def counting_scanner():
+    scans = []
+
+    def scanner():
+        scans.append(len(scans) + 1)
+        return [{'ssid': f'scan {len(scans)}'}]
+    return scanner, scans
+
+def test_cache_serves_results_until_the_ttl(clock):
+    scanner, scans = counting_scanner()
+    cache = wifi_scan.ScanCache(scanner, ttl=15)
+    assert cache.peek() is None
+
+    assert cache.get() == ([{'ssid': 'scan 1'}], 0)
+    clock.now += 14.5
+    assert cache.get() == ([{'ssid': 'scan 1'}], 14.5)
+    clock.now += 0.5
+    assert cache.get() == ([{'ssid': 'scan 2'}], 0)
+    assert scans == [1, 2]
+
+def test_cache_force_and_invalidate_scan_again(clock):
+    scanner, scans = counting_scanner()
+    cache = wifi_scan.ScanCache(scanner)
+    cache.get()
+    cache.get(force=True)
+    cache.invalidate()
+    assert cache.peek() is None
+    cache.get()
+    assert scans == [1, 2, 3]
+
+def test_failed_scan_is_not_cached(clock):
+    scanner, scans = counting_scanner()
+    failing = [True]
+
+    def flaky():
+        if failing.pop():
+            raise RuntimeError('Device or resource busy')
+        return scanner()
+
+    cache = wifi_scan.ScanCache(flaky)
+    with pytest.raises(RuntimeError):
+        cache.get()
+    failing.append(False)
+    assert cache.get() == ([{'ssid': 'scan 1'}], 0)
+
+def test_concurrent_requests_share_one_scan():
+    started = threading.Event()
+    release = threading.Event()
+    scans = []
+
+    def slow_scanner():
+        scans.append(1)
+        started.set()
+        assert release.wait(5)
+        return [{'ssid': 'Home'}]
+
+    cache = wifi_scan.ScanCache(slow_scanner)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get()[0]))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(scans) == 1
+    assert results == [[{'ssid': 'Home'}]] * 8
+
+def test_concurrent_requests_share_a_scan_error():
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_scanner():
+        started.set()
+        assert release.wait(5)
+        raise RuntimeError('Device or resource busy')
+
+    cache = wifi_scan.ScanCache(failing_scanner)
+    errors = []
+
+    def request():
+        try:
+            cache.get()
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=request)
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ['Device or resource busy'] * 2
@@ -0,0 +1,150 @@
+import json
+import os
+import time
+
+import pytest
+
+import access_point
+import wifi_state
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'wifi_status.json')
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+def test_allowed_and_rejected_transitions(path):
+    machine = wifi_state.WifiStateMachine(path)
+    assert machine.transition(wifi_state.AP_STARTING, 'button', ap_owner='button')
+    assert machine.transition(wifi_state.AP_READY, 'button')
+    assert not machine.transition(wifi_state.CLIENT, 'portal')  # Must go through CONNECTING
+    assert machine.state == wifi_state.AP_READY
+    assert not machine.transition(wifi_state.IDLE, 'stale', expect=wifi_state.CONNECTING)
+    assert machine.transition(wifi_state.CONNECTING, 'portal', expect=(wifi_state.AP_READY,),
+                              ssid='Home')
+    assert machine.info == {'ssid': 'Home', 'ap_owner': 'button'}
+    assert machine.ap_running()
+    assert machine.transition(wifi_state.CLIENT, 'portal')
+    assert machine.info == {'ssid': 'Home', 'ap_owner': None}  # The AP session is over
+    assert not machine.ap_running()
+    assert [(r['from'], r['to'], r['reason']) for r in machine.history] == [
+        ('idle', 'ap_starting', 'button'),
+        ('ap_starting', 'ap_ready', 'button'),
+        ('ap_ready', 'connecting', 'portal'),
+        ('connecting', 'client', 'portal'),
+    ]
+
+def test_connecting_without_an_ap_session_is_not_ap_running(path):
+    machine = wifi_state.WifiStateMachine(path)
+    machine.transition(wifi_state.CONNECTING, 'known_network', ssid='Home')
+    assert not machine.ap_running()
+    assert not machine.snapshot()['ap_running']
+
+def test_listeners_get_each_transition_and_errors_are_contained(path):
+    machine = wifi_state.WifiStateMachine(path)
+    records = []
+
+    def broken(record):
+        raise RuntimeError('listener bug')
+
+    machine.listeners += [broken, records.append]
+    assert machine.transition(wifi_state.AP_STARTING, 'button')
+    assert [(r['from'], r['to']) for r in records] == [('idle', 'ap_starting')]
+    assert records[0]['duration_ms'] >= 0
+
+def test_flush_writes_the_snapshot(path):
+    machine = wifi_state.WifiStateMachine(path)
+    machine.transition(wifi_state.AP_STARTING, 'watchdog', ap_owner='watchdog')
+    machine.flush()
+    status = read(path)
+    assert status['state'] == wifi_state.AP_STARTING and status['ap_running']
+    assert status['info'] == {'ssid': None, 'ap_owner': 'watchdog'}
+    assert status['pid'] == os.getpid()
+    assert [r['to'] for r in status['transitions']] == [wifi_state.AP_STARTING]
+
+def test_writer_coalesces_a_burst_into_the_latest_state(path):
+    machine = wifi_state.WifiStateMachine(path, coalesce=0.2)
+    machine.start()
+    try:
+        wait_for(lambda: os.path.exists(path))
+        machine.transition(wifi_state.AP_STARTING, 'button', ap_owner='button')
+        machine.transition(wifi_state.AP_READY, 'button')
+        machine.transition(wifi_state.CONNECTING, 'portal', ssid='Home')
+        assert read(path)['state'] == wifi_state.IDLE  # Not written yet
+        wait_for(lambda: read(path)['state'] == wifi_state.CONNECTING)
+        assert len(read(path)['transitions']) == 3
+    finally:
+        machine.stop()
+    assert not machine.persisting
+
+def test_stop_writes_the_final_state(path):
+    machine = wifi_state.WifiStateMachine(path, coalesce=60)
+    machine.start()
+    machine.transition(wifi_state.AP_STARTING, 'button')
+    machine.stop()
+    assert read(path)['state'] == wifi_state.AP_STARTING
+
+def test_restore_returns_the_previous_run_and_keeps_its_history(path):
+    before = wifi_state.WifiStateMachine(path)
+    before.transition(wifi_state.AP_STARTING, 'button', ap_owner='button')
+    before.transition(wifi_state.AP_READY, 'button')
+    before.flush()
+
+    after = wifi_state.WifiStateMachine(path)
+    previous = after.restore()
+    assert previous['state'] == wifi_state.AP_READY and previous['ap_running']
+    assert previous['info']['ap_owner'] == 'button'
+    assert after.state == wifi_state.IDLE  # The caller decides how to resume
+    assert [r['to'] for r in after.history] == [wifi_state.AP_STARTING, wifi_state.AP_READY]
+
+    after.transition(wifi_state.RECOVERING, 'restart')
+    assert len(after.history) == 3
+
+def test_restore_without_a_usable_file(path):
+    assert wifi_state.WifiStateMachine(path).restore() is None
+    with open(path, 'w') as f:
+        f.write('{"state": "ap_re')  # Torn write from an older version
+    assert wifi_state.WifiStateMachine(path).restore() is None
+
+def test_history_is_capped(path):
+    machine = wifi_state.WifiStateMachine(path)
+    for _ in range(wifi_state.MAX_HISTORY):
+        machine.transition(wifi_state.AP_STARTING, 'button')
+        machine.transition(wifi_state.IDLE, 'button')
+    assert len(machine.history) == wifi_state.MAX_HISTORY
+    machine.flush()
+    assert len(read(path)['transitions']) == wifi_state.MAX_HISTORY
+
+def test_read_status_follows_the_file(path):
+    assert wifi_state.read_status(path) is None
+    machine = wifi_state.WifiStateMachine(path)
+    machine.flush()
+    assert wifi_state.read_status(path)['state'] == wifi_state.IDLE
+    machine.transition(wifi_state.AP_STARTING, 'button')
+    machine.flush()
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))  # Coarse mtimes
+    assert wifi_state.read_status(path)['state'] == wifi_state.AP_STARTING
+
+@pytest.mark.parametrize('ok, final', [(True, wifi_state.AP_READY), (False, wifi_state.IDLE)])
+def test_daemon_resumes_the_access_point_it_was_running(path, monkeypatch, ok, final):
+    before = wifi_state.WifiStateMachine(path)
+    before.transition(wifi_state.AP_STARTING, 'connectivity_lost', ap_owner='watchdog')
+    before.transition(wifi_state.AP_READY, 'connectivity_lost')
+    before.flush()
+
+    machine = wifi_state.WifiStateMachine(path)
+    monkeypatch.setattr(access_point, 'wifi', machine)
+    monkeypatch.setattr(access_point, 'setup_access_point', lambda: ok)
+    access_point.resume_access_point(machine.restore())
+    assert machine.state == final
+    assert [r['to'] for r in machine.history][-2:] == [wifi_state.RECOVERING, final]
+    if ok:
+        assert machine.info['ap_owner'] == 'watchdog'
@@ -0,0 +1,110 @@
+import os
+import socket
+import threading
+
+import pytest
+
+import wpa_ctrl
+
+def test_wrong_key_for_target_is_wrong_password():
+    event = ('CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="Home" auth_failures=1 '
+             'duration=10 reason=WRONG_KEY')
+    assert wpa_ctrl.classify_event(event, 'Home') == wpa_ctrl.WRONG_PASSWORD
+
+def test_wrong_key_for_other_network_is_ignored():
+    event = ('CTRL-EVENT-SSID-TEMP-DISABLED id=1 ssid="Neighbour" auth_failures=1 '
+             'duration=10 reason=WRONG_KEY')
+    assert wpa_ctrl.classify_event(event, 'Home') is None
+    assert wpa_ctrl.classify_event(event) == wpa_ctrl.WRONG_PASSWORD
+
+def test_escaped_ssid():
+    event = r'CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="My \"Home\"\x21" reason=WRONG_KEY'
+    assert wpa_ctrl.event_ssid(event) == 'My "Home"!'
+    assert wpa_ctrl.classify_event(event, 'My "Home"!') == wpa_ctrl.WRONG_PASSWORD
+
+def test_unnamed_handshake_failure_needs_any_network():
+    event = 'WPA: 4-Way Handshake failed - pre-shared key may be incorrect'
+    assert wpa_ctrl.classify_event(event, 'Home') is None
+    assert wpa_ctrl.classify_event(event) == wpa_ctrl.WRONG_PASSWORD
+
+class ReplaySupplicant:
+    """wpa_supplicant stand-in on a Unix datagram socket
+
+    Answers ATTACH, DETACH and STATUS (ssid=status_ssid once the events
+    were sent) and replays the recorded events after ATTACH.
+    """
+
+    def __init__(self, ctrl_dir, events, status_ssid=None):
+        self.events = events
+        self.status_ssid = status_ssid
+        self.sent = False
+        self.commands = []
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(os.path.join(ctrl_dir, 'wlan0'))
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, client = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            command = data.decode()
+            self.commands.append(command)
+            if command == 'STATUS':
+                if self.sent and self.status_ssid:
+                    reply = f'wpa_state=COMPLETED\nssid={self.status_ssid}\n'
+                else:
+                    reply = 'wpa_state=SCANNING\n'
+                self.sock.sendto(reply.encode(), client)
+            else:
+                self.sock.sendto(b'OK\n', client)
+            if command == 'ATTACH':
+                # Queue the events behind the STATUS reply that follows ATTACH
+                threading.Timer(0.05, self._replay, (client,)).start()
+
+    def _replay(self, client):
+        for event in self.events:
+            self.sock.sendto(f'<3>{event}'.encode(), client)
+        self.sent = True
+
+    def close(self):
+        self.sock.close()
+
+CONNECTED = 'CTRL-EVENT-CONNECTED - Connection to aa:bb:cc:dd:ee:ff completed [id=0 id_str=]'
+NOT_FOUND = 'CTRL-EVENT-NETWORK-NOT-FOUND'
+
+def wrong_key(ssid):
+    return (f'CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="{ssid}" auth_failures=1 '
+            'duration=10 reason=WRONG_KEY')
+
+@pytest.mark.parametrize('events, status_ssid, expected', [
+    ([NOT_FOUND, CONNECTED], 'Home', wpa_ctrl.CONNECTED),
+    ([NOT_FOUND, wrong_key('Home')], None, wpa_ctrl.WRONG_PASSWORD),
+    ([NOT_FOUND, NOT_FOUND], None, wpa_ctrl.TIMEOUT),
+    ([wrong_key('Neighbour'), NOT_FOUND], None, wpa_ctrl.TIMEOUT),
+    ([wrong_key('Neighbour'), CONNECTED], 'Home', wpa_ctrl.CONNECTED),
+    ([NOT_FOUND, CONNECTED], 'Neighbour', wpa_ctrl.OTHER_NETWORK),
+])
+def test_replayed_events(tmp_path, events, status_ssid, expected):
+    supplicant = ReplaySupplicant(str(tmp_path), events, status_ssid)
+    try:
+        with wpa_ctrl.open_when_ready('wlan0', str(tmp_path), timeout=1) as ctrl:
+            outcome, _ = wpa_ctrl.wait_for_connection(ctrl, 'Home', timeout=0.5)
+        assert outcome == expected
+        assert supplicant.commands[-1] == 'DETACH'
+    finally:
+        supplicant.close()
+
+def test_context_manager_keeps_the_open_socket(tmp_path):
+    supplicant = ReplaySupplicant(str(tmp_path), [])
+    try:
+        ctrl = wpa_ctrl.open_when_ready('wlan0', str(tmp_path), timeout=1)
+        sock = ctrl.sock
+        with ctrl as entered:
+            assert entered.sock is sock
+        assert sock.fileno() == -1
+        assert not os.path.exists(ctrl.local_path)
+    finally:
+        supplicant.close()
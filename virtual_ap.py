@@ -0,0 +1,195 @@
+"""
+Concurrent access point and station mode on a virtual interface
+
+In the default single-interface mode, hostapd and dnsmasq are stopped
+before the Pi joins the chosen network. The phone loses the portal in the
+middle of the connect, and a failure needs a full AP restore. Many WiFi
+chips can run an AP and a station interface at the same time on one
+channel; the brcmfmac in the Pi 3/4/Zero W is one of them. On those
+chips the access point runs on a virtual uap0 interface and wlan0 stays
+with wpa_supplicant:
+
+    setup_steps()    add uap0, address it, start hostapd and dnsmasq on it
+    connect()        join the network on wlan0 while the portal stays up
+    cleanup_steps()  stop the AP and delete uap0, only after a success
+
+The AP must follow the station's channel, so connect() moves it first
+when the target network is on another one.
+
+Commands go through a command_runner.CommandRunner and the station side goes
+through a Station object. With FakeCommandRunner, FakeProbes and
+FakeStation from benchmarks/fakes.py the whole flow runs without radio
+hardware.
+"""
+
+import logging
+import re
+import time
+
+import config_files
+import connectivity
+import network_state
+import wifi_scan
+import wpa_ctrl
+from orchestrator import Step, run_steps
+
+AP_INTERFACE = 'uap0'
+STATION_INTERFACE = 'wlan0'
+DEFAULT_CHANNEL = 7
+INTERNET_CHECK_INTERVAL = 1  # Seconds between upstream checks after associating
+
+logger = logging.getLogger('virtual_ap')
+
+def supports_concurrent(iw_list_output):
+    """True if 'iw list' reports an interface combination with AP and managed"""
+    section = iw_list_output.partition('valid interface combinations:')[2]
+    for combination in section.split('*')[1:]:
+        types = set()
+        for group in re.findall(r'#\{([^}]*)\}', combination):
+            types.update(name.strip() for name in group.split(','))
+        if 'AP' in types and 'managed' in types:
+            return True
+    return False
+
+def detect_support(runner):
+    """Ask the driver whether uap0 can run alongside wlan0"""
+    try:
+        return supports_concurrent(runner.run(['iw', 'list']).stdout or '')
+    except Exception as e:
+        logger.error(f"Error reading interface combinations: {str(e)}")
+        return False
+
+class Station:
+    """Station side of wlan0, driven through wpa_supplicant's control socket"""
+
+    def __init__(self, interface=STATION_INTERFACE):
+        self.interface = interface
+
+    def channel(self):
+        """Channel of the current association, or None"""
+        return wifi_scan.frequency_to_channel(network_state.read_frequency(self.interface))
+
+    def join(self, ssid, timeout):
+        """Reload wpa_supplicant.conf and wait for ssid; returns a wpa_ctrl outcome"""
+        with wpa_ctrl.open_when_ready(self.interface) as ctrl:
+            ctrl.request('RECONFIGURE')
+            outcome, event = wpa_ctrl.wait_for_connection(ctrl, ssid, timeout=timeout)
+            logger.info(f"wpa_supplicant: {outcome} ({event})")
+            return outcome
+
+    def reload(self):
+        """Reload wpa_supplicant.conf, e.g. to fall back after a failed join"""
+        with wpa_ctrl.open_when_ready(self.interface) as ctrl:
+            ctrl.request('RECONFIGURE')
+
+    def internet_reachable(self):
+        return connectivity.internet_reachable(fresh=True)
+
+class VirtualAP:
+    """Access point on a virtual interface next to the station interface"""
+
+    def __init__(self, ssid, password, address, runner, probes, station=None,
+                 interface=AP_INTERFACE, station_interface=STATION_INTERFACE,
+                 check_interval=INTERNET_CHECK_INTERVAL):
+        self.ssid = ssid
+        self.password = password
+        self.address = address
+        self.runner = runner
+        self.probes = probes
+        self.station = station or Station(station_interface)
+        self.interface = interface
+        self.station_interface = station_interface
+        self.check_interval = check_interval
+        self.channel = DEFAULT_CHANNEL
+
+    def add_interface(self, runner):
+        if not self.probes.interface_exists(self.interface):
+            runner.run(['sudo', 'iw', 'dev', self.station_interface, 'interface', 'add',
+                        self.interface, 'type', '__ap'], check=True)
+
+    def write_hostapd_config(self):
+        """hostapd.conf for uap0 on the station's channel"""
+        self.channel = self.station.channel() or self.channel
+        config_files.write_config(config_files.HOSTAPD_CONF,
+                                  config_files.render_hostapd_config(
+                                      self.interface, self.ssid, self.password, self.channel),
+                                  mode=0o600)
+
+    def write_dns_config(self):
+        config_files.write_config(config_files.CAPTIVE_DNS_CONF,
+                                  config_files.render_captive_dns_config(self.interface,
+                                                                         self.address))
+
+    def remove_dns_config(self):
+        config_files.remove_config(config_files.CAPTIVE_DNS_CONF)  # Already gone is fine
+
+    def setup_steps(self):
+        """Step graph bringing the AP up on uap0; wlan0 and its services are untouched"""
+        interface = self.interface
+        return [
+            Step('add_interface', self.add_interface, ready=('interface_exists', interface)),
+            Step('hostapd_config', lambda runner: self.write_hostapd_config()),
+            Step('link_up', ['sudo', 'ip', 'link', 'set', interface, 'up'],
+                 after=['add_interface'], ready=('interface_up', interface)),
+            Step('flush_address', ['sudo', 'ip', 'addr', 'flush', 'dev', interface],
+                 after=['link_up']),
+            Step('add_address', ['sudo', 'ip', 'addr', 'add', f'{self.address}/24',
+                                 'dev', interface],
+                 after=['flush_address'], ready=('address_assigned', interface, self.address)),
+            Step('start_hostapd', ['sudo', 'systemctl', 'restart', 'hostapd'],
+                 after=['link_up', 'hostapd_config'], ready=('unit_active', 'hostapd')),
+            Step('captive_dns_config', lambda runner: self.write_dns_config(), required=False),
+            Step('start_dnsmasq', ['sudo', 'systemctl', 'restart', 'dnsmasq'],
+                 after=['add_address', 'captive_dns_config'], ready=('unit_active', 'dnsmasq')),
+        ]
+
+    def cleanup_steps(self):
+        """Step graph removing the AP and uap0 while wlan0 stays connected"""
+        return [
+            Step('stop_ap_services', ['sudo', 'systemctl', 'stop', 'hostapd', 'dnsmasq'],
+                 ready=('unit_inactive', 'hostapd', 'dnsmasq'), required=False),
+            Step('remove_captive_dns', lambda runner: self.remove_dns_config(),
+                 after=['stop_ap_services'], required=False),
+            Step('delete_interface', ['sudo', 'iw', 'dev', self.interface, 'del'],
+                 after=['stop_ap_services'], required=False),
+        ]
+
+    def move_channel(self, channel):
+        """Restart hostapd on channel so the station can associate there"""
+        logger.info(f"Moving access point from channel {self.channel} to {channel}")
+        self.channel = channel
+        config_files.write_config(config_files.HOSTAPD_CONF,
+                                  config_files.render_hostapd_config(
+                                      self.interface, self.ssid, self.password, channel),
+                                  mode=0o600)
+        result = run_steps([Step('restart_hostapd', ['sudo', 'systemctl', 'restart', 'hostapd'],
+                                 ready=('unit_active', 'hostapd'))],
+                           self.runner, self.probes)
+        result.log_timings(logger, 'ap_channel_move')
+        return result.ok
+
+    def connect(self, ssid, timeout, channel=None, on_state=None):
+        """Join ssid on the station while the AP keeps serving the portal
+
+        wpa_supplicant.conf must already list ssid first. channel is the
+        target network's channel when known. on_state(name) is called as
+        the attempt progresses. Returns a wpa_ctrl outcome; the AP is left
+        running either way.
+        """
+        notify = on_state or (lambda state: None)
+        deadline = time.monotonic() + timeout
+        if channel is not None and channel != self.channel:
+            notify('moving_ap_channel')
+            self.move_channel(channel)
+
+        notify('associating')
+        outcome = self.station.join(ssid, max(0, deadline - time.monotonic()))
+        if outcome != wpa_ctrl.CONNECTED:
+            return outcome
+
+        notify('checking_internet')
+        while not self.station.internet_reachable():
+            if time.monotonic() >= deadline:
+                return wpa_ctrl.TIMEOUT
+            time.sleep(self.check_interval)
+        return wpa_ctrl.CONNECTED
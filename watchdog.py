@@ -0,0 +1,200 @@
+"""
+Connectivity watchdog that falls back to access point mode
+
+Checks the WiFi link and upstream reachability on one thread and moves
+between three states with hysteresis, so a brief dropout never tears the
+client connection down:
+
+    ONLINE   --first failed check-->                   DEGRADED
+    DEGRADED --failing for loss_seconds-->             OFFLINE  (on_offline)
+    DEGRADED/OFFLINE --recovery_checks good checks-->  ONLINE   (on_online)
+
+While OFFLINE, on_retry is called every retry_seconds (doubling up to
+max_retry_seconds) to try the known networks again. If on_offline could
+not bring the access point up, it calls rearm() to go back to DEGRADED,
+so on_offline fires again after another loss_seconds of failures.
+Checks run every interval seconds while online and every
+degraded_interval seconds otherwise; the upstream probe is skipped while
+the link is down.
+
+The clock is injectable: SimulatedClock and simulate() drive a watchdog
+through a connectivity timeline without sleeping or touching the network.
+"""
+
+import logging
+import threading
+import time
+
+import connectivity
+import network_state
+
+ONLINE = 'online'
+DEGRADED = 'degraded'
+OFFLINE = 'offline'
+
+CHECK_INTERVAL = 30  # Seconds between checks while online
+DEGRADED_INTERVAL = 10  # Seconds between checks while degraded or offline
+LOSS_SECONDS = 120  # Sustained failure before falling back to the AP
+RECOVERY_CHECKS = 3  # Consecutive good checks before going back online
+RETRY_SECONDS = 300  # First retry of the known networks while offline
+MAX_RETRY_SECONDS = 1800
+
+logger = logging.getLogger('watchdog')
+
+def link_connected(interface='wlan0'):
+    """True if the interface is up and associated with a network"""
+    return (network_state.read_operstate(interface) == 'up' and
+            network_state.get_current_ssid(interface) is not None)
+
+def upstream_reachable():
+    """True if any connectivity probe target answers (a fresh check, see connectivity.py)"""
+    return connectivity.internet_reachable(fresh=True)
+
+def system_check(interface='wlan0'):
+    """(link_ok, upstream_ok) for the real interface"""
+    if not link_connected(interface):
+        return False, False
+    return True, upstream_reachable()
+
+class ConnectivityWatchdog:
+    """Track connectivity with hysteresis and call back on state changes"""
+
+    def __init__(self, check=system_check, on_offline=None, on_online=None, on_retry=None,
+                 interval=CHECK_INTERVAL, degraded_interval=DEGRADED_INTERVAL,
+                 loss_seconds=LOSS_SECONDS, recovery_checks=RECOVERY_CHECKS,
+                 retry_seconds=RETRY_SECONDS, max_retry_seconds=MAX_RETRY_SECONDS,
+                 clock=time.monotonic):
+        self.check = check
+        self.on_offline = on_offline
+        self.on_online = on_online
+        self.on_retry = on_retry
+        self.interval = interval
+        self.degraded_interval = degraded_interval
+        self.loss_seconds = loss_seconds
+        self.recovery_checks = recovery_checks
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.clock = clock
+
+        self.state = ONLINE
+        self.failing_since = None
+        self.successes = 0
+        self.checks = 0
+        self.next_retry = None
+        self.retry_delay = retry_seconds
+        self.transitions = []  # (time, from_state, to_state)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _transition(self, state, now):
+        logger.info(f"Connectivity {self.state} -> {state}",
+                    extra={'from_state': self.state, 'to_state': state})
+        self.transitions.append((now, self.state, state))
+        self.state = state
+
+    def _call(self, callback, name):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Watchdog {name} callback failed: {str(e)}")
+
+    def tick(self):
+        """Run one check and act on it; returns the seconds until the next one"""
+        link_ok, upstream_ok = self.check()
+        now = self.clock()
+        self.checks += 1
+
+        if link_ok and upstream_ok:
+            self.successes += 1
+            if self.state != ONLINE and self.successes >= self.recovery_checks:
+                was_offline = self.state == OFFLINE
+                self.failing_since = None
+                self.next_retry = None
+                self.retry_delay = self.retry_seconds
+                self._transition(ONLINE, now)
+                if was_offline:
+                    self._call(self.on_online, 'online')
+        else:
+            self.successes = 0
+            if self.failing_since is None:
+                self.failing_since = now
+            if self.state == ONLINE:
+                self._transition(DEGRADED, now)
+            if self.state == DEGRADED and now - self.failing_since >= self.loss_seconds:
+                self._transition(OFFLINE, now)
+                self.next_retry = now + self.retry_delay
+                self._call(self.on_offline, 'offline')
+            elif self.state == OFFLINE and self.next_retry is not None and now >= self.next_retry:
+                self.retry_delay = min(self.retry_delay * 2, self.max_retry_seconds)
+                self.next_retry = now + self.retry_delay
+                self._call(self.on_retry, 'retry')
+
+        return self.interval if self.state == ONLINE else self.degraded_interval
+
+    def rearm(self):
+        """Back to DEGRADED with a fresh failure window, so on_offline can fire again"""
+        now = self.clock()
+        if self.state == OFFLINE:
+            self._transition(DEGRADED, now)
+        self.failing_since = now
+        self.next_retry = None
+
+    def run(self):
+        """Check until stop() is called"""
+        while not self._stop.is_set():
+            try:
+                delay = self.tick()
+            except Exception as e:
+                logger.error(f"Watchdog check failed: {str(e)}")
+                delay = self.degraded_interval
+            self._stop.wait(delay)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='watchdog', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class SimulatedClock:
+    """Manually advanced clock for driving a watchdog in simulations"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+def simulate(connectivity, duration, **options):
+    """Run a watchdog on a simulated clock for duration seconds
+
+    connectivity(t) returns (link_ok, upstream_ok) at simulated time t.
+    Callbacks are recorded instead of acting. Returns a dict with the
+    watchdog, its transitions, the callback events and the check count.
+    """
+    clock = SimulatedClock()
+    events = []
+    watchdog = ConnectivityWatchdog(
+        check=lambda: connectivity(clock()),
+        on_offline=lambda: events.append((clock(), 'offline')),
+        on_online=lambda: events.append((clock(), 'online')),
+        on_retry=lambda: events.append((clock(), 'retry')),
+        clock=clock, **options)
+    while clock() < duration:
+        clock.advance(watchdog.tick())
+    return {
+        'watchdog': watchdog,
+        'transitions': watchdog.transitions,
+        'events': events,
+        'checks': watchdog.checks
+    }
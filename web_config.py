@@ -20,6 +20,7 @@ Requirements:
 Usage:
 1. Start the access point using accessPoint.py
 2. Run this script: sudo python3 web_config.py
+   (add --async to serve it with the asyncio server from async_server.py)
 3. Connect to 'PiConfigWiFi' network
 4. Navigate to http://192.168.4.1 in a web browser
 
@@ -40,21 +41,52 @@ Date: 11/10/2024
 Version: 1.0
 """
 
-from flask import Flask, render_template, request, jsonify
-import subprocess
+from flask import Flask, request, jsonify
 import os
+import queue
 import sys
+import threading
 import time
+import uuid
 import logging
 
-# Basic logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler('logs/wifi_config.log')]
-)
+import app_logging
+import captive_portal
+import command_runner
+import config_files
+import connectivity
+import credential_store
+import network_state
+import static_assets
+import wifi_scan
+import wifi_state
+import wpa_ctrl
 
 app = Flask(__name__)
+# Answer OS connectivity checks with a redirect to this page before routing
+app.wsgi_app = captive_portal.CaptivePortalMiddleware(app.wsgi_app)
+
+# Scan results are cached for a few seconds and concurrent scans are shared
+scan_cache = wifi_scan.cache
+
+# Background connection jobs, run one at a time by a single worker thread
+MAX_CONNECT_JOBS = 20  # Finished jobs kept for status queries
+CONNECT_TIMEOUT = 30  # Seconds to associate and reach the internet
+connect_jobs = {}
+connect_jobs_lock = threading.Lock()
+connect_queue = queue.Queue()
+connect_worker = None
+
+# Every network joined through the portal, used to rejoin without it later
+credentials = credential_store.known_networks
+
+# Called instead of setup_admin_server() once a connection succeeds when the
+# portal is hosted inside the access point daemon (see web_host.py)
+on_connected = None
+
+# virtual_ap.VirtualAP when the access point daemon runs the AP on uap0; the
+# portal then stays up while wlan0 joins the network (see virtual_ap.py)
+concurrent_ap = None
 
 def setup_admin_server():
     """Setup and start the admin server as a systemd service"""
@@ -65,140 +97,315 @@ def setup_admin_server():
         if not all(os.path.exists(p) for p in [admin_dir, admin_server_path]):
             raise FileNotFoundError("Admin server files not found")
             
-        service_content = f'''[Unit]
-Description=Pi Admin Panel
-After=network.target
-
-[Service]
-ExecStart=/usr/bin/python3 {admin_server_path}
-WorkingDirectory={admin_dir}
-User=root
-Restart=always
-
-[Install]
-WantedBy=multi-user.target
-'''
-        
-        with open('/tmp/pi-admin-panel.service', 'w') as f:
-            f.write(service_content)
-            
-        subprocess.run(['sudo', 'mv', '/tmp/pi-admin-panel.service', 
-                       '/etc/systemd/system/pi-admin-panel.service'], check=True)
-        subprocess.run(['sudo', 'chmod', '644', '/etc/systemd/system/pi-admin-panel.service'], 
-                      check=True)
+        service_content = config_files.render_admin_service(admin_server_path, admin_dir)
+        result = config_files.write_config(config_files.ADMIN_SERVICE_FILE, service_content,
+                                           mode=0o644)
         
-        # Enable and start service
-        subprocess.run(['sudo', 'systemctl', 'daemon-reload'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'enable', 'pi-admin-panel'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'pi-admin-panel'], check=True)
+        # Enable and start service, reloading systemd only if the unit changed
+        if result['daemon_reload']:
+            command_runner.systemctl('daemon-reload', check=True)
+        command_runner.systemctl('enable', 'pi-admin-panel', check=True)
+        action = 'restart' if result['restart'] else 'start'
+        command_runner.systemctl(action, 'pi-admin-panel', check=True)
         
         logging.info("Admin server installed and started")
+        app_logging.shutdown_logging()
         os._exit(0)
         
     except Exception as e:
         logging.error(f"Admin server setup failed: {str(e)}")
         raise
 
+# config.html has no template variables: render and compress it once
+config_page = static_assets.render_page(app, 'config.html')
+
+hostapd_config_seen = False
+
+def hostapd_configured():
+    """Whether hostapd.conf exists; once it has been seen it is not checked again"""
+    global hostapd_config_seen
+    if not hostapd_config_seen:
+        hostapd_config_seen = os.path.exists(config_files.HOSTAPD_CONF)
+    return hostapd_config_seen
+
 # Define route for the main page ('/')
 @app.route('/')
 def index():
     """Serve the main configuration page"""
-    if not os.path.exists('/etc/hostapd/hostapd.conf'):
+    if not hostapd_configured():
         return "Error: Access point not configured. Run access_point.py first.", 500
-    return render_template('config.html')
+    return static_assets.asset_response(config_page)
 
 # Define route for network scanning endpoint
 @app.route('/scan_networks')
 def scan_networks():
-    """Scan for available WiFi networks"""
+    """Scan for available WiFi networks
+
+    Returns SSIDs ordered by signal strength plus the strongest BSS record
+    for each one. Pass ?refresh=1 to bypass the scan cache.
+    """
     try:
-        subprocess.run(['sudo', 'ifconfig', 'wlan0', 'up'], check=True)
-        time.sleep(1)
-        
-        result = subprocess.run(['sudo', 'iwlist', 'wlan0', 'scan'], 
-                              capture_output=True, text=True, check=True)
-        
-        networks = []
-        for line in result.stdout.split('\n'):
-            if 'ESSID:' in line:
-                ssid = line.split('ESSID:"')[1].split('"')[0]
-                if ssid and ssid not in networks:
-                    networks.append(ssid)
-                    
-        return jsonify({'success': True, 'networks': sorted(networks)})
+        with app_logging.timed(logging.getLogger(), "Network scan request") as fields:
+            results, age = scan_cache.get(force=request.args.get('refresh') == '1')
+            fields['cache_age_s'] = round(age, 1)
+        networks = wifi_scan.best_by_ssid(results)
+        return jsonify({
+            'success': True,
+            'networks': [bss['ssid'] for bss in networks],
+            'details': networks,
+            'age': round(age, 1)
+        })
         
     except Exception as e:
         logging.error(f"Network scan failed: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Define route for WiFi credentials submission
-@app.route('/connect', methods=['POST'])
-def connect_wifi():
+# Connection job handling
+def create_connect_job(ssid):
+    """Register a new queued connection job and return it"""
+    job = {
+        'id': uuid.uuid4().hex[:12],
+        'ssid': ssid,
+        'state': 'queued',
+        'error': None,
+        'created': time.time(),
+        'duration': None,
+        'transitions': [{'state': 'queued', 'at': 0.0}]
+    }
+    with connect_jobs_lock:
+        connect_jobs[job['id']] = job
+        # Forget the oldest finished jobs
+        finished = sorted((j for j in connect_jobs.values()
+                           if j['state'] in ('connected', 'failed')),
+                          key=lambda j: j['created'])
+        while len(connect_jobs) > MAX_CONNECT_JOBS and finished:
+            del connect_jobs[finished.pop(0)['id']]
+    return job
+
+def set_job_state(job, state, error=None):
+    """Record a job state transition with its offset from job creation"""
+    with connect_jobs_lock:
+        elapsed = round(time.time() - job['created'], 3)
+        job['state'] = state
+        job['transitions'].append({'state': state, 'at': elapsed})
+        if error:
+            job['error'] = error
+        if state in ('connected', 'failed'):
+            job['duration'] = elapsed
+    logging.info(f"Connect job {job['id']} ({job['ssid']}): {state}",
+                 extra={'job': job['id'], 'state': state, 'elapsed_ms': round(elapsed * 1000)})
+
+def get_job(job_id):
+    """Return a copy of a job record, or None"""
+    with connect_jobs_lock:
+        job = connect_jobs.get(job_id)
+        return dict(job, transitions=list(job['transitions'])) if job else None
+
+def enqueue_connect_job(ssid, password):
+    """Queue a connection attempt and make sure the worker is running"""
+    global connect_worker
+    job = create_connect_job(ssid)
+    connect_queue.put((job, password))
+    with connect_jobs_lock:
+        if connect_worker is None or not connect_worker.is_alive():
+            connect_worker = threading.Thread(target=connect_worker_loop,
+                                              name='connect-worker', daemon=True)
+            connect_worker.start()
+    return job
+
+def connect_worker_loop():
+    """Run queued connection jobs one after another"""
+    while True:
+        job, password = connect_queue.get()
+        try:
+            run_connect_job(job, password)
+        finally:
+            connect_queue.task_done()
+
+def wait_for_association(ssid, deadline):
+    """Wait for wpa_supplicant to associate with ssid
+
+    Listens for control interface events so success or a wrong password is
+    seen immediately; falls back to polling the SSID once per second if the
+    control socket is unavailable. Returns a wpa_ctrl outcome constant.
+    """
     try:
-        data = request.get_json()
-        ssid = data.get('ssid')
-        password = data.get('password')
-        
-        if not ssid or not password:
-            raise ValueError("Missing SSID or password")
-
-        # Write WPA supplicant configuration
-        wpa_config = f'''
-country=US
-ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev
-update_config=1
-
-network={{
-    ssid="{ssid}"
-    psk="{password}"
-    key_mgmt=WPA-PSK
-}}'''
-        
-        with open('/tmp/wpa_supplicant.conf', 'w') as f:
-            f.write(wpa_config)
-            
-        subprocess.run(['sudo', 'mv', '/tmp/wpa_supplicant.conf', 
-                       '/etc/wpa_supplicant/wpa_supplicant.conf'], check=True)
+        with wpa_ctrl.open_when_ready('wlan0') as ctrl:
+            outcome, event = wpa_ctrl.wait_for_connection(
+                ctrl, ssid, timeout=max(0, deadline - time.monotonic()))
+            logging.info(f"wpa_supplicant: {outcome} ({event})")
+            return outcome
+    except OSError as e:
+        logging.warning(f"wpa_supplicant control interface unavailable: {str(e)}")
+
+    while time.monotonic() < deadline:
+        if network_state.get_current_ssid('wlan0') == ssid:
+            return wpa_ctrl.CONNECTED
+        time.sleep(1)
+    return wpa_ctrl.TIMEOUT
+
+def connect_error(outcome, ssid):
+    """Message for a connect job that ended with a wpa_ctrl outcome other than CONNECTED"""
+    if outcome == wpa_ctrl.WRONG_PASSWORD:
+        return "Authentication failed - check the WiFi password"
+    if outcome == wpa_ctrl.OTHER_NETWORK:
+        return f"Joined another known network instead of {ssid}"
+    return "Failed to establish connection"
+
+def forget_failed_network(ssid, previous, outcome, scan_results):
+    """Undo a wrong password, or count the failure, and re-rank the known networks"""
+    try:
+        if outcome == wpa_ctrl.WRONG_PASSWORD:
+            credentials.restore(ssid, previous)
+        else:
+            credentials.record_failure(ssid)
+        credentials.write_config(scan_results)
+    except Exception as e:
+        logging.error(f"Error updating known networks: {str(e)}")
+
+def target_channel(ssid, scan_results):
+    """Channel of the strongest scanned BSS for ssid, or None"""
+    for bss in wifi_scan.best_by_ssid(scan_results or []):
+        if bss['ssid'] == ssid:
+            return bss['channel']
+    return None
+
+def run_concurrent_connect_job(job, ssid, scan_results):
+    """Join the network on wlan0 while the portal stays up on uap0; returns the outcome"""
+    outcome = concurrent_ap.connect(ssid, CONNECT_TIMEOUT, target_channel(ssid, scan_results),
+                                    on_state=lambda state: set_job_state(job, state))
+    if outcome == wpa_ctrl.CONNECTED:
+        credentials.record_success(ssid)
+        set_job_state(job, 'connected')
+        if on_connected is not None:
+            on_connected()
+    return outcome
+
+def run_connect_job(job, password):
+    """Switch from AP mode to the requested network, recording progress"""
+    ssid = job['ssid']
+    previous = outcome = scan_results = None
+    try:
+        set_job_state(job, 'writing_config')
+        # Remember the network and write every known one, the new one first
+        credential_store.import_existing(credentials)
+        previous = credentials.add(ssid, password)
+        scan_results = scan_cache.peek()
+        credentials.write_config(scan_results, first=ssid)
+        wifi_state.machine.transition(wifi_state.CONNECTING, 'portal', ssid=ssid)
+
+        if concurrent_ap is not None:
+            outcome = run_concurrent_connect_job(job, ssid, scan_results)
+            if outcome == wpa_ctrl.CONNECTED:
+                return
+            raise Exception(connect_error(outcome, ssid))
         
         # Stop AP services and connect to WiFi
-        services_to_stop = ['hostapd', 'dnsmasq']
-        for service in services_to_stop:
-            subprocess.run(['sudo', 'systemctl', 'stop', service], check=True)
+        set_job_state(job, 'stopping_ap')
+        command_runner.systemctl('stop', 'hostapd', 'dnsmasq', check=True)
             
         # Configure network interface
-        subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], check=True)
+        set_job_state(job, 'restarting_network')
+        command_runner.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], check=True)
         time.sleep(1)
-        subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'up'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'restart', 'wpa_supplicant'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'restart', 'dhcpcd'], check=True)
+        command_runner.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'up'], check=True)
+        command_runner.systemctl('restart', 'wpa_supplicant', 'dhcpcd', check=True)
         
         # Wait for connection
-        for _ in range(30):
-            result = subprocess.run(['iwgetid'], capture_output=True, text=True)
-            if ssid in result.stdout:
-                # Test internet connectivity
-                ping_test = subprocess.run(['ping', '-c', '1', '-W', '2', '8.8.8.8'])
-                if ping_test.returncode == 0:
+        set_job_state(job, 'associating')
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        outcome = wait_for_association(ssid, deadline)
+        if outcome != wpa_ctrl.CONNECTED:
+            raise Exception(connect_error(outcome, ssid))
+
+        # Test internet connectivity
+        set_job_state(job, 'checking_internet')
+        while time.monotonic() < deadline:
+            if connectivity.internet_reachable(fresh=True):
+                credentials.record_success(ssid)
+                set_job_state(job, 'connected')
+                if on_connected is not None:
+                    on_connected()
+                else:
+                    wifi_state.machine.transition(wifi_state.CLIENT, 'portal')
                     setup_admin_server()
-                    return jsonify({'success': True})
+                return
             time.sleep(1)
             
         raise Exception("Failed to establish connection")
         
     except Exception as e:
         logging.error(f"WiFi connection failed: {str(e)}")
-        restore_ap_mode()
-        return jsonify({'success': False, 'error': str(e)}), 500
+        forget_failed_network(ssid, previous, outcome, scan_results)
+        if concurrent_ap is not None:
+            # The portal never went away; send wlan0 back to the known networks
+            try:
+                concurrent_ap.station.reload()
+            except Exception as reload_error:
+                logging.error(f"Failed to reload wpa_supplicant: {str(reload_error)}")
+            wifi_state.machine.transition(wifi_state.AP_READY, 'connect_failed',
+                                          expect=wifi_state.CONNECTING)
+        else:
+            set_job_state(job, 'restoring_ap')
+            if wifi_state.machine.transition(wifi_state.RECOVERING, 'connect_failed',
+                                             expect=wifi_state.CONNECTING):
+                restore_ap_mode()
+                wifi_state.machine.transition(wifi_state.AP_READY, 'restored')
+            else:
+                restore_ap_mode()
+        set_job_state(job, 'failed', error=str(e))
+
+# Define route for WiFi credentials submission
+@app.route('/connect', methods=['POST'])
+def connect_wifi():
+    """Queue a connection attempt and return its job id immediately"""
+    data = request.get_json(silent=True) or {}
+    ssid = data.get('ssid')
+    password = data.get('password')
+    
+    if not ssid or not password:
+        return jsonify({'success': False, 'error': 'Missing SSID or password'}), 400
+
+    job = enqueue_connect_job(ssid, password)
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status_url': f"/connect/{job['id']}"
+    }), 202
+
+@app.route('/connect/<job_id>')
+def connect_job_status(job_id):
+    """Progress of a connection job: current state, transitions and timings"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(dict(job, success=True))
+
+@app.route('/status')
+def status():
+    """Current connection state and the most recent connection job
+
+    Answered from the in-memory state machine and job table; nothing on
+    the system is probed.
+    """
+    state = wifi_state.machine.snapshot()
+    with connect_jobs_lock:
+        latest = max(connect_jobs.values(), key=lambda j: j['created'], default=None)
+        latest = dict(latest, transitions=list(latest['transitions'])) if latest else None
+    return jsonify({
+        'connected': bool(latest and latest['state'] == 'connected'),
+        'current_ssid': state['info']['ssid'] if state['state'] == wifi_state.CLIENT else None,
+        'job': latest,
+        'wifi_state': state
+    })
 
 def restore_ap_mode():
     """Restore access point mode if connection fails"""
     try:
-        subprocess.run(['sudo', 'systemctl', 'stop', 'dhcpcd'], check=True)
-        subprocess.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], check=True)
+        command_runner.systemctl('stop', 'dhcpcd', check=True)
+        command_runner.run(['sudo', 'ip', 'link', 'set', 'wlan0', 'down'], check=True)
         time.sleep(1)
-        subprocess.run(['sudo', 'systemctl', 'start', 'hostapd'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'dnsmasq'], check=True)
-        subprocess.run(['sudo', 'systemctl', 'start', 'dhcpcd'], check=True)
+        command_runner.systemctl('start', 'hostapd', 'dnsmasq', 'dhcpcd', check=True)
     except Exception as e:
         logging.error(f"Failed to restore AP mode: {str(e)}")
 
@@ -206,8 +413,13 @@ if __name__ == '__main__':
     if os.geteuid() != 0:
         sys.exit("This script must be run as root")
         
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-        
-    app.run(host='0.0.0.0', port=80)
+    app_logging.setup_logging('wifi_config')
+
+    if '--async' in sys.argv:
+        # Event-loop server with bounded workers (see async_server.py)
+        import async_server
+        async_server.serve(app, host='0.0.0.0', port=80,
+                           fast_response=captive_portal.lookup_bytes)
+    else:
+        app.run(host='0.0.0.0', port=80)
 
@@ -0,0 +1,156 @@
+"""
+Single long-lived HTTP server hosting the config portal and admin panel
+
+Instead of killing one Flask process and spawning another on every mode
+change, both apps are loaded into this process and served from one
+werkzeug server that keeps port 80 bound for the life of the daemon.
+ModeDispatcher forwards each request to the route set for the current
+mode, so switching between the portal and the admin panel is a pointer
+swap that takes effect on the next request. The server is the asyncio
+one from async_server.py by default, or werkzeug's threaded server.
+
+Modes:
+    PORTAL - web_config.app (WiFi setup while the access point is up)
+    ADMIN  - admin/admin_server.app (system monitoring on the home network)
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+import captive_portal
+
+PORTAL = 'portal'
+ADMIN = 'admin'
+
+# HTTP server implementations
+ASYNC = 'async'  # async_server: one event loop, bounded worker pools
+THREADED = 'threaded'  # werkzeug: one thread per connection
+
+ADMIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'admin')
+
+logger = logging.getLogger('web_host')
+
+def load_portal_app():
+    import web_config
+    return web_config.app
+
+def load_admin_app():
+    if ADMIN_DIR not in sys.path:
+        sys.path.insert(0, ADMIN_DIR)
+    import admin_server
+    return admin_server.app
+
+APP_LOADERS = {
+    PORTAL: load_portal_app,
+    ADMIN: load_admin_app,
+}
+
+class ModeDispatcher:
+    """WSGI app that forwards requests to the app for the current mode"""
+
+    def __init__(self, loaders=None, mode=ADMIN):
+        self.loaders = dict(loaders or APP_LOADERS)
+        self.apps = {}
+        self._lock = threading.Lock()
+        self.mode = mode
+        self.last_request = None  # time.monotonic() of the latest request
+
+    def app_for(self, mode):
+        """Return the app for mode, importing it the first time"""
+        app = self.apps.get(mode)
+        if app is None:
+            with self._lock:
+                app = self.apps.get(mode)
+                if app is None:
+                    app = self.apps[mode] = self.loaders[mode]()
+        return app
+
+    def __call__(self, environ, start_response):
+        self.last_request = time.monotonic()
+        return self.app_for(self.mode)(environ, start_response)
+
+class WebHost:
+    """Serve the dispatcher on one port and switch route sets in place"""
+
+    def __init__(self, host='0.0.0.0', port=80, mode=ADMIN, loaders=None, server=ASYNC):
+        self.host = host
+        self.port = port
+        self.server_type = server
+        self.dispatcher = ModeDispatcher(loaders, mode)
+        self.server = None
+        self.thread = None
+
+    @property
+    def mode(self):
+        return self.dispatcher.mode
+
+    def start(self):
+        """Bind the port and serve requests on a background thread"""
+        if self.server is not None:
+            return
+        # Server modules are imported here so importing this module stays cheap
+        if self.server_type == THREADED:
+            from werkzeug.serving import make_server
+            self.server = make_server(self.host, self.port, self.dispatcher, threaded=True)
+        else:
+            from async_server import make_server
+            self.server = make_server(self.host, self.port, self.dispatcher,
+                                      fast_response=self.fast_response)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='web-host', daemon=True)
+        self.thread.start()
+        logger.info(f"Web host serving {self.mode} on port {self.server.server_port} "
+                    f"({self.server_type})")
+
+    def fast_response(self, method, path, host, keep_alive):
+        """Prebuilt captive-portal probe answers while the portal is up"""
+        if self.dispatcher.mode != PORTAL:
+            return None
+        self.dispatcher.last_request = time.monotonic()
+        return captive_portal.lookup_bytes(method, path, host, keep_alive)
+
+    def idle_seconds(self):
+        """Seconds since the last request, or None if nothing was served yet"""
+        if self.dispatcher.last_request is None:
+            return None
+        return time.monotonic() - self.dispatcher.last_request
+
+    def preload(self):
+        """Import every app up front so a mode switch never waits on an import"""
+        for mode in self.dispatcher.loaders:
+            self.dispatcher.app_for(mode)
+
+    def switch(self, mode):
+        """Route new requests to the app for mode; returns the elapsed seconds"""
+        started = time.monotonic()
+        previous = self.dispatcher.mode
+        if mode != previous:
+            self.dispatcher.app_for(mode)
+            self.dispatcher.mode = mode
+            if previous == ADMIN and ADMIN in self.dispatcher.apps:
+                # Nobody can reach the admin panel now; stop its samplers
+                stop_admin_sampler()
+        elapsed = time.monotonic() - started
+        logger.info(f"Web host switched from {previous} to {mode}",
+                    extra={'mode': mode, 'duration_ms': round(elapsed * 1000, 2)})
+        return elapsed
+
+    def stop(self):
+        """Release the port and stop the server thread"""
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server = self.thread = None
+        if ADMIN in self.dispatcher.apps:
+            stop_admin_sampler()
+
+def stop_admin_sampler():
+    """Stop the admin panel's metric sampler threads if it was loaded"""
+    admin_server = sys.modules.get('admin_server')
+    if admin_server is not None:
+        admin_server.sampler.stop(wait=False)
@@ -0,0 +1,235 @@
+"""
+WiFi scan parsing and caching for the configuration portal
+
+Parses `iwlist <iface> scan` and `iw dev <iface> scan` output into one dict
+per BSS:
+    {'bssid', 'ssid', 'signal_dbm', 'quality', 'channel', 'frequency_mhz',
+     'security', 'associated'}
+
+ScanCache keeps the last results for a TTL and coalesces concurrent
+requests into a single in-flight scan, so page reloads and many clients
+never queue up behind repeated multi-second radio scans. `cache` is the
+process-wide one for wlan0, shared by the portal and the daemon.
+"""
+
+import re
+import shutil
+import threading
+import time
+
+import command_runner
+import network_state
+
+SCAN_TTL = 15  # Seconds scan results are served from cache
+
+# SAE key management suites (8, and 24 for SAE-EXT-KEY); iwlist prints them
+# as 'unknown (8)' and older iw releases as '00-0f-ac:8'
+SAE_SUITE = re.compile(r'\bSAE\b|unknown \((?:8|24)\)|00-0f-ac:(?:8|24)\b')
+
+def frequency_to_channel(frequency_mhz):
+    """Convert a 2.4/5 GHz centre frequency to its channel number"""
+    if frequency_mhz is None:
+        return None
+    frequency = int(round(frequency_mhz))
+    if frequency == 2484:
+        return 14
+    if 2412 <= frequency <= 2472:
+        return (frequency - 2407) // 5
+    if 5000 <= frequency <= 5900:
+        return (frequency - 5000) // 5
+    return None
+
+def _new_bss(bssid):
+    return {
+        'bssid': bssid.lower(),
+        'ssid': None,
+        'signal_dbm': None,
+        'quality': None,
+        'channel': None,
+        'frequency_mhz': None,
+        'security': 'open',
+        'associated': False
+    }
+
+def _finish(bss, flags):
+    """Derive the security label and fill in a missing channel"""
+    if flags.get('sae'):
+        bss['security'] = 'WPA3'
+    elif flags.get('rsn'):
+        bss['security'] = 'WPA2'
+    elif flags.get('wpa'):
+        bss['security'] = 'WPA'
+    elif flags.get('privacy'):
+        bss['security'] = 'WEP'
+    if flags.get('enterprise') and bss['security'] != 'open':
+        bss['security'] += '-Enterprise'
+    if bss['channel'] is None:
+        bss['channel'] = frequency_to_channel(bss['frequency_mhz'])
+    return bss
+
+def parse_iwlist(output):
+    """Parse `iwlist <iface> scan` output into BSS dicts"""
+    results = []
+    bss = flags = None
+    for raw in output.splitlines():
+        line = raw.strip()
+        match = re.match(r'Cell \d+ - Address: ([0-9A-Fa-f:]{17})', line)
+        if match:
+            if bss:
+                results.append(_finish(bss, flags))
+            bss, flags = _new_bss(match.group(1)), {}
+            continue
+        if bss is None:
+            continue
+        if line.startswith('ESSID:'):
+            match = re.match(r'ESSID:"(.*)"$', line)
+            bss['ssid'] = match.group(1) if match and match.group(1) else None
+        elif line.startswith('Channel:'):
+            bss['channel'] = int(line.split(':', 1)[1])
+        elif line.startswith('Frequency:'):
+            match = re.match(r'Frequency:([\d.]+) GHz', line)
+            if match:
+                bss['frequency_mhz'] = round(float(match.group(1)) * 1000)
+        elif 'Signal level' in line:
+            match = re.search(r'Signal level[=:](-?\d+) dBm', line)
+            if match:
+                bss['signal_dbm'] = int(match.group(1))
+            match = re.search(r'Quality[=:](\d+)/(\d+)', line)
+            if match:
+                bss['quality'] = round(100 * int(match.group(1)) / int(match.group(2)))
+        elif line.startswith('Encryption key:'):
+            flags['privacy'] = line.endswith('on')
+        elif line.startswith('IE:'):
+            if 'WPA2' in line or '802.11i' in line:
+                flags['rsn'] = True
+            elif 'WPA Version' in line:
+                flags['wpa'] = True
+        elif line.startswith('Authentication Suites'):
+            if '802.1x' in line:
+                flags['enterprise'] = True
+            if SAE_SUITE.search(line):
+                flags['sae'] = True
+    if bss:
+        results.append(_finish(bss, flags))
+    return results
+
+def parse_iw(output):
+    """Parse `iw dev <iface> scan` output into BSS dicts"""
+    results = []
+    bss = flags = None
+    section = None
+    for raw in output.splitlines():
+        match = re.match(r'BSS ([0-9a-fA-F:]{17})', raw)
+        if match:
+            if bss:
+                results.append(_finish(bss, flags))
+            bss, flags, section = _new_bss(match.group(1)), {}, None
+            bss['associated'] = 'associated' in raw
+            continue
+        if bss is None:
+            continue
+        line = raw.strip()
+        if not raw.startswith('\t\t'):
+            section = line.split(':', 1)[0]
+        if line.startswith('freq:'):
+            bss['frequency_mhz'] = round(float(line.split(':', 1)[1]))
+        elif line.startswith('signal:'):
+            bss['signal_dbm'] = round(float(line.split(':', 1)[1].split()[0]))
+        elif line.startswith('SSID:'):
+            bss['ssid'] = line[5:].strip() or None
+        elif line.startswith('DS Parameter set: channel'):
+            bss['channel'] = int(line.rsplit(' ', 1)[1])
+        elif line.startswith('capability:'):
+            flags['privacy'] = 'Privacy' in line
+        elif line.startswith('RSN:'):
+            flags['rsn'] = True
+        elif line.startswith('WPA:'):
+            flags['wpa'] = True
+        if section in ('RSN', 'WPA') and 'Authentication suites' in line:
+            if 'IEEE 802.1X' in line:
+                flags['enterprise'] = True
+            if SAE_SUITE.search(line):
+                flags['sae'] = True
+    if bss:
+        results.append(_finish(bss, flags))
+    return results
+
+def best_by_ssid(results):
+    """Keep the strongest BSS per SSID, sorted by signal (strongest first)"""
+    best = {}
+    for bss in results:
+        if not bss['ssid']:
+            continue
+        current = best.get(bss['ssid'])
+        if current is None or (bss['signal_dbm'] or -999) > (current['signal_dbm'] or -999):
+            best[bss['ssid']] = bss
+    return sorted(best.values(), key=lambda bss: bss['signal_dbm'] or -999, reverse=True)
+
+def scan(interface='wlan0'):
+    """Run a scan with iw (or iwlist when iw is missing) and parse it"""
+    if not network_state.is_interface_up(interface):
+        command_runner.run(['sudo', 'ip', 'link', 'set', interface, 'up'], check=True)
+
+    if shutil.which('iw'):
+        result = command_runner.run(['sudo', 'iw', 'dev', interface, 'scan'], check=True)
+        return parse_iw(result.stdout)
+    result = command_runner.run(['sudo', 'iwlist', interface, 'scan'], check=True)
+    return parse_iwlist(result.stdout)
+
+class ScanCache:
+    """Serve scan results from cache and share one in-flight scan"""
+
+    def __init__(self, scanner, ttl=SCAN_TTL):
+        self.scanner = scanner
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = None
+        self._scanned_at = None
+        self._in_flight = None
+
+    def get(self, force=False):
+        """Return (results, age_seconds), scanning if the cache is stale"""
+        with self._lock:
+            fresh = (self._results is not None and
+                     time.monotonic() - self._scanned_at < self.ttl)
+            if fresh and not force:
+                return self._results, time.monotonic() - self._scanned_at
+            in_flight = self._in_flight
+            if in_flight is None:
+                in_flight = self._in_flight = {'done': threading.Event(), 'error': None}
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            try:
+                results = self.scanner()
+                with self._lock:
+                    self._results = results
+                    self._scanned_at = time.monotonic()
+            except Exception as e:
+                in_flight['error'] = e
+            finally:
+                with self._lock:
+                    self._in_flight = None
+                in_flight['done'].set()
+        else:
+            in_flight['done'].wait()
+
+        if in_flight['error'] is not None:
+            raise in_flight['error']
+        with self._lock:
+            return self._results, time.monotonic() - self._scanned_at
+
+    def peek(self):
+        """Last results without scanning (None if nothing cached), ignoring the TTL"""
+        with self._lock:
+            return self._results
+
+    def invalidate(self):
+        """Drop cached results so the next request scans again"""
+        with self._lock:
+            self._results = None
+
+# Shared by the portal's scan page and the daemon's known network checks
+cache = ScanCache(lambda: scan('wlan0'))
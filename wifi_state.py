@@ -0,0 +1,223 @@
+"""
+WiFi mode state machine shared by the access point daemon and web apps
+
+Replaces the old ap_running flag with explicit states:
+
+    IDLE         no access point; not connected (or not yet known)
+    AP_STARTING  access point services are being brought up
+    AP_READY     the portal is reachable on PiConfigWiFi
+    CONNECTING   joining a network (from the portal or the known networks)
+    CLIENT       connected to a network, access point down
+    RECOVERING   bringing the access point back after a failure or restart
+
+Only the transitions in TRANSITIONS are allowed. Each one records how long
+the previous state lasted. The current state lives in memory (the
+module-level `machine`), so the web apps answer status queries without
+probing the system. A background writer persists it to
+logs/wifi_status.json at most once per COALESCE_SECONDS, atomically and
+fsynced. After a crash, restore() tells the daemon whether the access
+point was up, so it can bring it back.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import app_logging
+import config_files
+
+IDLE = 'idle'
+AP_STARTING = 'ap_starting'
+AP_READY = 'ap_ready'
+CONNECTING = 'connecting'
+CLIENT = 'client'
+RECOVERING = 'recovering'
+
+TRANSITIONS = {
+    IDLE: {AP_STARTING, CONNECTING, CLIENT, RECOVERING},
+    AP_STARTING: {AP_READY, RECOVERING, IDLE},
+    AP_READY: {CONNECTING, RECOVERING, IDLE},
+    CONNECTING: {CLIENT, AP_READY, AP_STARTING, RECOVERING, IDLE},
+    CLIENT: {IDLE, AP_STARTING, CONNECTING},
+    RECOVERING: {AP_READY, AP_STARTING, IDLE},
+}
+
+STATUS_FILE = os.path.join(app_logging.LOG_DIR, 'wifi_status.json')
+COALESCE_SECONDS = 0.5  # Transitions within this window are written once
+MAX_HISTORY = 20  # Transitions kept in memory and in the status file
+
+logger = logging.getLogger('wifi_state')
+
+class WifiStateMachine:
+    """Current WiFi mode, its transition history and its persisted copy
+
+    info holds details that go with the state: 'ssid' (network being
+    joined or connected) and 'ap_owner' ('button' or 'watchdog' while an
+    access point session is active; cleared on IDLE and CLIENT).
+    """
+
+    def __init__(self, path=STATUS_FILE, coalesce=COALESCE_SECONDS):
+        self.path = path
+        self.coalesce = coalesce
+        self.state = IDLE
+        self.info = {'ssid': None, 'ap_owner': None}
+        self.since = time.time()
+        self._entered = time.monotonic()
+        self.history = collections.deque(maxlen=MAX_HISTORY)
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._writer = None
+        # Called with each transition record ({'from', 'to', 'reason', 'at',
+        # 'duration_ms'}) after it is made, e.g. by the metrics exporter
+        self.listeners = []
+
+    def transition(self, state, reason=None, expect=None, **info):
+        """Move to state; returns False if not allowed or the state isn't in expect
+
+        expect (a state or tuple of states) makes the transition conditional,
+        for callers racing with other threads. Extra keywords update info.
+        """
+        with self._lock:
+            current = self.state
+            if expect is not None and current not in (
+                    (expect,) if isinstance(expect, str) else expect):
+                return False
+            if state != current and state not in TRANSITIONS[current]:
+                logger.error(f"Invalid WiFi state transition {current} -> {state}")
+                return False
+            now = time.monotonic()
+            duration = now - self._entered
+            self.info.update(info)
+            if state in (IDLE, CLIENT):
+                self.info['ap_owner'] = None
+            self.state = state
+            self.since = time.time()
+            self._entered = now
+            record = {
+                'from': current,
+                'to': state,
+                'reason': reason,
+                'at': round(self.since, 3),
+                'duration_ms': round(duration * 1000, 1)
+            }
+            self.history.append(record)
+        logger.info(f"WiFi state {current} -> {state}" + (f" ({reason})" if reason else ''),
+                    extra={'from_state': current, 'to_state': state, 'reason': reason,
+                           'duration_ms': round(duration * 1000, 1)})
+        self._dirty.set()
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                logger.error(f"Error in WiFi state listener: {str(e)}")
+        return True
+
+    def update(self, **info):
+        """Change info without a transition"""
+        with self._lock:
+            self.info.update(info)
+        self._dirty.set()
+
+    def ap_running(self):
+        """True while an access point session is active (the old ap_running flag)"""
+        with self._lock:
+            return (self.state in (AP_STARTING, AP_READY, RECOVERING) or
+                    (self.state == CONNECTING and self.info['ap_owner'] is not None))
+
+    def snapshot(self):
+        """Current state as a JSON-ready dict"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'since': round(self.since, 3),
+                'duration': round(time.monotonic() - self._entered, 3),
+                'info': dict(self.info),
+                'ap_running': (self.state in (AP_STARTING, AP_READY, RECOVERING) or
+                               (self.state == CONNECTING and
+                                self.info['ap_owner'] is not None)),
+                'transitions': list(self.history),
+                'pid': os.getpid()
+            }
+
+    def restore(self):
+        """Persisted snapshot from the previous run, or None
+
+        The in-memory state starts at IDLE either way; the caller decides
+        how to resume (see access_point.main()).
+        """
+        try:
+            with open(self.path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.history.extend(previous.get('transitions', [])[-MAX_HISTORY:])
+        return previous
+
+    def flush(self):
+        """Write the current state now"""
+        self._dirty.clear()
+        try:
+            config_files.write_config(self.path, json.dumps(self.snapshot(), indent=2) + '\n')
+        except Exception as e:
+            logger.error(f"Error writing WiFi state: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._dirty.wait()
+            # Let a burst of transitions settle, then write the latest state once
+            if self._stop.wait(self.coalesce):
+                break
+            self.flush()
+
+    def start(self):
+        """Persist every change from now on, coalesced on a background thread"""
+        if self._writer is None:
+            self._stop.clear()
+            self._writer = threading.Thread(target=self._run, name='wifi-state-writer',
+                                            daemon=True)
+            self._writer.start()
+            self._dirty.set()
+
+    def stop(self):
+        """Stop the writer and write the final state"""
+        if self._writer is not None:
+            self._stop.set()
+            self._dirty.set()
+            self._writer.join()
+            self._writer = None
+        self.flush()
+
+    @property
+    def persisting(self):
+        return self._writer is not None
+
+# Shared by the access point daemon and the web apps it hosts
+machine = WifiStateMachine()
+
+_file_cache = {'mtime': None, 'status': None}
+
+def read_status(path=STATUS_FILE):
+    """Persisted state for processes that don't own the machine (cached by mtime)"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    if _file_cache['mtime'] != mtime:
+        try:
+            with open(path) as f:
+                _file_cache['status'] = json.load(f)
+            _file_cache['mtime'] = mtime
+        except (OSError, ValueError):
+            return None
+    return _file_cache['status']
+
+def status():
+    """The live state when this process owns it, else the persisted copy"""
+    if machine.persisting:
+        return machine.snapshot()
+    return read_status(machine.path)
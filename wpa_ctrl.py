@@ -0,0 +1,204 @@
+"""
+Client for the wpa_supplicant control interface
+
+wpa_supplicant listens on a Unix datagram socket per interface under the
+ctrl_interface directory (/var/run/wpa_supplicant in the generated config).
+After ATTACH it sends unsolicited event messages such as:
+    <3>CTRL-EVENT-CONNECTED - Connection to aa:bb:cc:dd:ee:ff completed [id=0 id_str=]
+    <3>CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="Home" auth_failures=1 duration=10 reason=WRONG_KEY
+
+wait_for_connection() uses these events to report success or a wrong
+password the moment wpa_supplicant knows, instead of polling iwgetid.
+The control directory is a parameter, so a local socket that replays an
+event sequence can stand in for wpa_supplicant.
+"""
+
+import itertools
+import os
+import re
+import socket
+import time
+
+CTRL_DIR = '/var/run/wpa_supplicant'
+LOCAL_DIR = '/tmp'
+REQUEST_TIMEOUT = 2
+
+# Outcomes of wait_for_connection()
+CONNECTED = 'connected'
+WRONG_PASSWORD = 'wrong_password'
+REJECTED = 'rejected'
+OTHER_NETWORK = 'other_network'  # Joined another known network instead
+TIMEOUT = 'timeout'
+
+MAX_REJECTS = 3  # Association/authentication rejections before giving up
+
+_local_ids = itertools.count()
+
+class WpaCtrl:
+    """Connection to one interface's wpa_supplicant control socket"""
+
+    def __init__(self, interface='wlan0', ctrl_dir=CTRL_DIR, local_dir=LOCAL_DIR):
+        self.ctrl_path = os.path.join(ctrl_dir, interface)
+        self.local_path = os.path.join(local_dir, f'wpa_ctrl_{os.getpid()}-{next(_local_ids)}')
+        self.sock = None
+        self.events = []
+        self.attached = False
+
+    def open(self):
+        """Bind a local socket and connect it to wpa_supplicant"""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(self.local_path):
+                os.unlink(self.local_path)
+            self.sock.bind(self.local_path)
+            self.sock.connect(self.ctrl_path)
+        except OSError:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        """Detach and remove the local socket"""
+        if self.sock is None:
+            return
+        if self.attached:
+            try:
+                self.request('DETACH')
+            except OSError:
+                pass
+            self.attached = False
+        self.sock.close()
+        self.sock = None
+        try:
+            os.unlink(self.local_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        # open_when_ready() hands out an already open instance
+        return self if self.sock is not None else self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, command, timeout=REQUEST_TIMEOUT):
+        """Send a command and return its reply, queueing any events received meanwhile"""
+        self.sock.send(command.encode())
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No reply to {command} from wpa_supplicant")
+            self.sock.settimeout(remaining)
+            message = self.sock.recv(4096).decode(errors='replace')
+            if message.startswith('<'):
+                self.events.append(message)
+                continue
+            return message.strip()
+
+    def attach(self):
+        """Subscribe to unsolicited events"""
+        if self.request('ATTACH') != 'OK':
+            raise OSError("wpa_supplicant refused ATTACH")
+        self.attached = True
+
+    def status(self):
+        """Return STATUS as a dict (wpa_state, ssid, bssid, ...)"""
+        reply = self.request('STATUS')
+        return dict(line.split('=', 1) for line in reply.splitlines() if '=' in line)
+
+    def next_event(self, timeout):
+        """Return the next event text without its <level> prefix, or None on timeout"""
+        if self.events:
+            return _strip_level(self.events.pop(0))
+        self.sock.settimeout(max(timeout, 0.001))
+        try:
+            message = self.sock.recv(4096).decode(errors='replace')
+        except socket.timeout:
+            return None
+        return _strip_level(message)
+
+def _strip_level(message):
+    return re.sub(r'^<\d+>', '', message).strip()
+
+def event_ssid(event):
+    """The ssid="..." field of an event (unescaped as wpa_ssid_txt escapes it), or None"""
+    match = re.search(r'\bssid="((?:[^"\\]|\\.)*)"', event)
+    if match is None:
+        return None
+    def unescape(escape):
+        code = escape.group(1)
+        if code.startswith('x') and len(code) == 3:
+            return chr(int(code[1:], 16))
+        return {'n': '\n', 'r': '\r', 't': '\t', 'e': '\x1b'}.get(code, code)
+    return re.sub(r'\\(x[0-9a-fA-F]{2}|.)', unescape, match.group(1))
+
+def classify_event(event, ssid=None):
+    """Map an event line to CONNECTED, WRONG_PASSWORD, REJECTED or None
+
+    With ssid, events naming another network (wpa_supplicant.conf holds
+    every known network) are ignored.
+    """
+    named = event_ssid(event)
+    if ssid is not None and named is not None and named != ssid:
+        return None
+    if event.startswith('CTRL-EVENT-CONNECTED'):
+        return CONNECTED
+    if event.startswith('CTRL-EVENT-SSID-TEMP-DISABLED') and 'reason=WRONG_KEY' in event:
+        return WRONG_PASSWORD
+    # This one names no network, so it only counts when any network will do
+    if 'pre-shared key may be incorrect' in event and ssid is None:
+        return WRONG_PASSWORD
+    if event.startswith(('CTRL-EVENT-AUTH-REJECT', 'CTRL-EVENT-ASSOC-REJECT')):
+        return REJECTED
+    return None
+
+def wait_for_connection(ctrl, ssid=None, timeout=30):
+    """Block until the interface connects, authentication fails or timeout
+
+    ctrl must be open. Returns (outcome, detail) where outcome is CONNECTED,
+    WRONG_PASSWORD, REJECTED, OTHER_NETWORK or TIMEOUT and detail is the
+    deciding event. Failures of other known networks are ignored; a
+    connection to one of them ends the wait with OTHER_NETWORK.
+    """
+    deadline = time.monotonic() + timeout
+    ctrl.attach()
+
+    # The connection may have completed before we attached
+    status = ctrl.status()
+    if status.get('wpa_state') == 'COMPLETED' and (ssid is None or status.get('ssid') == ssid):
+        return CONNECTED, 'already connected'
+
+    rejects = 0
+    last_event = None
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return TIMEOUT, last_event
+        event = ctrl.next_event(remaining)
+        if event is None:
+            continue
+        last_event = event
+        outcome = classify_event(event, ssid)
+        if outcome == CONNECTED:
+            connected_to = ctrl.status().get('ssid') if ssid is not None else None
+            if connected_to is None or connected_to == ssid:
+                return CONNECTED, event
+            return OTHER_NETWORK, f"{event} (ssid={connected_to})"
+        elif outcome == WRONG_PASSWORD:
+            return WRONG_PASSWORD, event
+        elif outcome == REJECTED:
+            rejects += 1
+            if rejects >= MAX_REJECTS:
+                return REJECTED, event
+
+def open_when_ready(interface='wlan0', ctrl_dir=CTRL_DIR, timeout=5):
+    """Open the control socket, waiting for wpa_supplicant to create it"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return WpaCtrl(interface, ctrl_dir).open()
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.1)